@@ -0,0 +1,29 @@
+"""
+    Cli commands for the admin schema. Run them with `flask blocklist <command>`.
+"""
+import click
+from flask import current_app
+from flask.cli import AppGroup
+
+blocklist_cli = AppGroup('blocklist', help='Manage the revoked tokens.')
+
+@blocklist_cli.command('purge')
+def purge_blocklist():
+    """
+        Delete the expired rows of admin.token_blocklist.
+    """
+    purged = current_app.blocklist_writer.purge_expired()
+    click.echo(f"Purged {purged} expired tokens")
+
+
+
+oidc_cli = AppGroup('oidc', help='Manage the cached OIDC metadata of the Google login.')
+
+@oidc_cli.command('warm')
+def warm_oidc():
+    """
+        Fetch the discovery document and JWKS into the disk cache, e.g. before starting the workers.
+    """
+    current_app.oidc_cache.refresh()
+    stats = current_app.oidc_cache.stats()
+    click.echo(f"Cached {stats['keys']} keys, valid until {stats['expires_at']:.0f}")
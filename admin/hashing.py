@@ -0,0 +1,148 @@
+"""
+    Password hashing in a pool of processes. The hashes are CPU heavy on purpose,
+    running them in the request thread holds the GIL and stalls every other endpoint
+    of the worker. The queue is bounded: when it is full the request gets a 503 with
+    Retry-After instead of waiting.
+"""
+import logging
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+from werkzeug.security import check_password_hash, generate_password_hash
+from extension import db
+
+logger = logging.getLogger(__name__)
+try:
+    from werkzeug.security import DEFAULT_PBKDF2_ITERATIONS
+except ImportError:  # werkzeug < 2.3
+    DEFAULT_PBKDF2_ITERATIONS = 600000
+
+
+class HashingBusy(Exception):
+    """
+        The pool is saturated, answered with a 503.
+    """
+    def __init__(self, retry_after: int = 1):
+        super().__init__("Password hashing is saturated")
+        self.retry_after = retry_after
+
+
+def full_method(method: str) -> str:
+    """
+        The method with the parameters werkzeug fills in: scrypt -> scrypt:32768:8:1,
+        pbkdf2:sha256 -> pbkdf2:sha256:<default iterations>. Others are left as they are.
+    """
+    name, *params = method.split(':')
+    if name == 'scrypt':
+        defaults = [str(2 ** 15), '8', '1']
+    elif name == 'pbkdf2':
+        defaults = ['sha256', str(DEFAULT_PBKDF2_ITERATIONS)]
+    else:
+        return method
+    return ':'.join([name, *params, *defaults[len(params):]])
+
+
+# Run in the pool processes, must be importable top level functions
+def _hash(password, method):
+    return generate_password_hash(password, method=method)
+
+def _check(pwhash, password):
+    return check_password_hash(pwhash, password)
+
+
+class PasswordHasher:
+    """
+        `method` is a werkzeug method, with or without its parameters (scrypt or
+        scrypt:32768:8:1, pbkdf2:sha256:600000); the hashes keep the full form as
+        prefix. Hashes made with another method or other parameters are rehashed in
+        the background after a successful login.
+    """
+    def __init__(self, app, method: str = 'scrypt:32768:8:1', workers: int = 2,
+                 queue_size: int = 16, timeout: float = 10, retry_after: int = 1):
+        self.app = app
+        self.method = method
+        self._full_method = full_method(method)
+        self.workers = workers
+        self.timeout = timeout
+        self.retry_after = retry_after
+        # Jobs running plus waiting, beyond that we refuse
+        self._slots = threading.BoundedSemaphore(workers + queue_size)
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def hash(self, password: str) -> str:
+        return self._run(_hash, password, self.method)
+
+    def check(self, pwhash: str, password: str) -> bool:
+        if not pwhash:
+            return False
+        return self._run(_check, pwhash, password)
+
+    def needs_rehash(self, pwhash: str) -> bool:
+        return bool(pwhash) and full_method(pwhash.split('$', 1)[0]) != self._full_method
+
+    def rehash_later(self, user_id: int, password: str):
+        """
+            Save a new hash with the current method, only if the pool has room for it.
+        """
+        try:
+            future = self._submit(_hash, password, self.method)
+        except HashingBusy:
+            return
+        future.add_done_callback(lambda done: self._save_rehash(user_id, done))
+
+    def _save_rehash(self, user_id, future):
+        from admin.models import User
+        try:
+            with self.app.app_context():
+                user = User.query.filter_by(id=user_id).first()
+                if user is not None and self.needs_rehash(user.password):
+                    user.password = future.result()
+                    db.session.commit()
+        except Exception:
+            logger.exception("Could not rehash the password of user %s", user_id)
+
+    def _run(self, fn, *args):
+        future = self._submit(fn, *args)
+        try:
+            return future.result(self.timeout)
+        except FutureTimeout:
+            raise HashingBusy(self.retry_after)
+        except BrokenProcessPool:
+            self._reset_pool()
+            raise HashingBusy(self.retry_after)
+
+    def _submit(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            raise HashingBusy(self.retry_after)
+        try:
+            future = self._pool().submit(fn, *args)
+        except BrokenProcessPool:
+            self._slots.release()
+            self._reset_pool()
+            raise HashingBusy(self.retry_after)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def _reset_pool(self):
+        # A process died (OOM kill, segfault), the pool refuses every job from now on:
+        # drop it, the next job starts a new one
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            logger.error("Password hashing pool broken, starting a new one")
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def _pool(self):
+        # Created on first use, spawn so the children don't inherit the app state
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ProcessPoolExecutor(
+                        max_workers=self.workers, mp_context=multiprocessing.get_context('spawn')
+                    )
+        return self._executor
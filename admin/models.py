@@ -3,11 +3,18 @@
 """
 import enum
 from datetime import datetime, timezone
+from sqlalchemy.orm import validates
 from extension import db
 
 def get_current_time():
     return datetime.now(tz=timezone.utc)
 
+def normalize_login(value):
+    """
+        Lookup key of username and email, login is case insensitive.
+    """
+    return str(value).strip().lower() if value is not None else None
+
 class UserRoleEnum(enum.Enum):
     guest = "guest"
     admin = "admin"
@@ -17,22 +24,54 @@ class UserRoleEnum(enum.Enum):
 class User(db.Model):
     """User model"""
     __tablename__ = 'user'
-    __table_args__ = {'schema': 'admin'}
+    __table_args__ = (
+        # Normalized copies of username and email, login finds the user with one index probe.
+        # Named like the migration that created them
+        db.Index('ix_admin_user_username_key', 'username_key', unique=True),
+        db.Index('ix_admin_user_email_key', 'email_key', unique=True),
+        {'schema': 'admin'}
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(80), unique=True, nullable=False)
     email = db.Column(db.String(150), unique=True, nullable=False)
+    username_key = db.Column(db.String(80), nullable=False)
+    email_key = db.Column(db.String(150), nullable=False)
     password = db.Column(db.String(300), nullable = True)
     role = db.Column(db.Enum(UserRoleEnum), nullable=False, default=UserRoleEnum.guest)
     first_name = db.Column(db.String(150), nullable=False)
     last_name = db.Column(db.String(150), nullable=False)
     country = db.Column(db.String(150), nullable=True)
+    # Bump this to invalidate every token issued before (role change, forced logout)
+    token_version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
 
     created_at = db.Column(db.DateTime, default=get_current_time)
     updated_at = db.Column(db.DateTime, default=get_current_time, onupdate=get_current_time)
 
     def __repr__(self):
         return f'<User {self.username}>'
+
+    @validates('username', 'email')
+    def update_login_key(self, key, value):
+        """
+            Keep the lookup keys in sync with username and email.
+        """
+        setattr(self, f'{key}_key', normalize_login(value))
+        return value
+
+    @staticmethod
+    def find_for_login(login):
+        """
+            User by username or email. Emails have an '@', so the usual case is a single
+            probe of one unique index, usernames with an '@' are still found on the second.
+        """
+        key = normalize_login(login)
+        user = None
+        if '@' in key:
+            user = User.query.filter_by(email_key=key).first()
+        if user is None:
+            user = User.query.filter_by(username_key=key).first()
+        return user
     
     def check_password(self, password):
         """
@@ -41,6 +80,12 @@ class User(db.Model):
         return True
         # return compare_digest(password, "password")
 
+    def bump_token_version(self):
+        """
+            Invalidate all the tokens of this user. Done in sql to be safe with concurrent bumps.
+        """
+        self.token_version = User.token_version + 1
+
     def to_dict(self):
         """
             Convert object to dict
@@ -63,4 +108,6 @@ class TokenBlocklist(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     jti = db.Column(db.String(36), nullable=False, index=True)
     created_at = db.Column(db.DateTime, default=get_current_time)
+    # exp claim of the token, after that the row is useless and can be purged
+    expires_at = db.Column(db.DateTime, nullable=True, index=True)
 
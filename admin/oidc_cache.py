@@ -0,0 +1,213 @@
+"""
+    Cache of the OIDC discovery document and the JWKS of the Google login. Authlib
+    fetches both lazily on the first login of every worker, so after a deploy the
+    first users wait for two outbound HTTPS round trips. Here they are kept in a
+    json file shared by the workers of the host, can be loaded when the app starts,
+    are refreshed by a background thread before they expire, and the key set is
+    fetched again when a token is signed with a key id we don't know (key rotation).
+
+    The urls come from GOOGLE_SERVER_METADATA_URL, point it to a local stand-in
+    server to test the login without Google.
+"""
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+import urllib.request
+
+logger = logging.getLogger(__name__)
+MAX_AGE = re.compile(r'max-age=(\d+)')
+# Seconds an expired copy is served before asking the provider again
+STALE_RETRY = 30
+
+
+class OidcCache:
+    """
+        `ttl` is used when the provider doesn't send Cache-Control max-age, the
+        refresh runs `refresh_before` seconds before the expiry. A forced refetch of
+        the key set (unknown kid) happens at most once every `min_refetch_interval`
+        seconds, so tokens with made up key ids can't make us hammer the provider.
+    """
+    def __init__(self, metadata_url: str, path: str, ttl: float = 3600, refresh_before: float = 300,
+                 timeout: float = 5, min_refetch_interval: float = 60):
+        self.metadata_url = metadata_url
+        self.path = path
+        self.ttl = ttl
+        self.refresh_before = refresh_before
+        self.timeout = timeout
+        self.min_refetch_interval = min_refetch_interval
+        self._entry = None  # {'url', 'metadata', 'jwks', 'fetched_at', 'expires_at'}
+        self._clients = []
+        self._lock = threading.Lock()
+        self._thread = None
+        self._last_refetch = 0.0
+
+    # Authlib client
+
+    def attach(self, client):
+        """
+            Serve the metadata and the key set of the authlib client from the cache.
+        """
+        client.load_server_metadata = lambda: self._install(client)
+        client.fetch_jwk_set = lambda force=False: self.jwks(force)
+        self._clients.append(client)
+        if self._entry is not None:
+            self._install(client)
+        return client
+
+    def _install(self, client):
+        self._update_client(client, self.load())
+        return client.server_metadata
+
+    # Cache
+
+    def load(self) -> dict:
+        """
+            The fresh entry: from memory, else from the file, else from the provider.
+        """
+        entry = self._entry
+        if entry is not None and entry['expires_at'] > time.time():
+            return entry
+        with self._lock:
+            entry = self._entry
+            if entry is not None and entry['expires_at'] > time.time():
+                return entry
+            entry = self._read_file()
+            if entry is not None and entry['expires_at'] > time.time():
+                self._set(entry, persist=False)
+            else:
+                try:
+                    self._set(self._fetch())
+                except Exception:
+                    if entry is None:
+                        raise
+                    # Provider down, an expired key set is better than no login at all
+                    logger.exception("Could not refresh the OIDC metadata, using the cached copy")
+                    self._set(dict(entry, expires_at=time.time() + STALE_RETRY), persist=False)
+            entry = self._entry
+        self.ensure_started()
+        return entry
+
+    def jwks(self, force: bool = False) -> dict:
+        entry = self.load()
+        if not force:
+            return entry['jwks']
+        with self._lock:
+            if time.monotonic() - self._last_refetch < self.min_refetch_interval:
+                return self._entry['jwks']
+            self._last_refetch = time.monotonic()
+            entry = dict(self._entry, jwks=self._get_json(self._entry['metadata']['jwks_uri'])[0])
+            self._set(entry)
+        return entry['jwks']
+
+    def warm(self) -> dict:
+        """
+            Load at startup, so the first login doesn't wait for the provider.
+        """
+        return self.load()
+
+    def refresh(self) -> dict:
+        with self._lock:
+            entry = self._fetch()
+            self._set(entry)
+        return entry
+
+    def stats(self) -> dict:
+        entry = self._entry or {}
+        return {'fetched_at': entry.get('fetched_at'), 'expires_at': entry.get('expires_at'),
+                'keys': len((entry.get('jwks') or {}).get('keys', []))}
+
+    def _set(self, entry, persist=True):
+        # The caller holds the lock
+        if persist:
+            self._write_file(entry)
+        self._entry = entry
+        for client in self._clients:
+            self._update_client(client, entry)
+
+    @staticmethod
+    def _update_client(client, entry):
+        # _loaded_at stops authlib from fetching the url itself
+        client.server_metadata.update(entry['metadata'], jwks=entry['jwks'], _loaded_at=entry['fetched_at'])
+
+    def _fetch(self) -> dict:
+        metadata, metadata_age = self._get_json(self.metadata_url)
+        jwks, jwks_age = self._get_json(metadata['jwks_uri'])
+        now = time.time()
+        ages = [age for age in (metadata_age, jwks_age) if age is not None]
+        return {
+            'url': self.metadata_url,
+            'metadata': metadata,
+            'jwks': jwks,
+            'fetched_at': now,
+            'expires_at': now + (min(ages) if ages else self.ttl),
+        }
+
+    def _get_json(self, url):
+        """
+            (body, max-age of the response or None)
+        """
+        request = urllib.request.Request(url, headers={'Accept': 'application/json'})
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            body = json.loads(response.read())
+            match = MAX_AGE.search(response.headers.get('Cache-Control', ''))
+        return body, int(match.group(1)) if match else None
+
+    # File shared by the workers
+
+    def _read_file(self):
+        try:
+            with open(self.path) as fh:
+                entry = json.load(fh)
+        except (OSError, ValueError):
+            return None
+        if entry.get('url') != self.metadata_url:
+            return None  # Cached for another provider
+        return entry
+
+    def _write_file(self, entry):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        try:
+            fd, tmp = tempfile.mkstemp(dir=directory, prefix='.oidc-')
+            with os.fdopen(fd, 'w') as fh:
+                json.dump(entry, fh)
+            os.replace(tmp, self.path)  # Atomic, the other workers never read half a file
+        except OSError:
+            logger.exception("Could not write the OIDC cache %s", self.path)
+
+    # Background refresh
+
+    def ensure_started(self):
+        """
+            Started with the first load, not in create_app, so cli commands don't run it.
+        """
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name='oidc-refresh', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        retry = 5
+        while True:
+            entry = self._entry
+            wait = entry['expires_at'] - self.refresh_before - time.time() if entry else 0
+            time.sleep(max(wait, STALE_RETRY))
+            try:
+                # Another worker may have refreshed the file already
+                on_disk = self._read_file()
+                with self._lock:
+                    if on_disk is not None and on_disk['expires_at'] - self.refresh_before > time.time():
+                        self._set(on_disk, persist=False)
+                    else:
+                        self._set(self._fetch())
+                retry = 5
+            except Exception:
+                logger.exception("Could not refresh the OIDC metadata, retrying in %ss", retry)
+                time.sleep(retry)
+                retry = min(retry * 2, 300)
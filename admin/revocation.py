@@ -0,0 +1,320 @@
+"""
+    In memory index of the revoked tokens, so most of the protected requests
+    don't need to query admin.token_blocklist.
+"""
+import atexit
+import hashlib
+import logging
+import math
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from flask import current_app
+from sqlalchemy import and_, delete, insert, or_, select
+from extension import db
+from admin.models import TokenBlocklist, get_current_time
+
+logger = logging.getLogger(__name__)
+
+
+class BloomFilter:
+    """
+        Plain bloom filter over strings. Sized from the expected capacity and the
+        false positive rate, uses double hashing over one blake2b digest.
+    """
+    def __init__(self, capacity: int, fp_rate: float):
+        capacity = max(capacity, 1)
+        self.capacity = capacity
+        self.fp_rate = fp_rate
+        self.size = max(8, int(-capacity * math.log(fp_rate) / (math.log(2) ** 2)))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.count = 0
+        self._bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, item: str):
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        for i in range(self.hashes):
+            yield (h1 + i * h2) % self.size
+
+    def add(self, item: str):
+        for pos in self._positions(item):
+            self._bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def __contains__(self, item: str) -> bool:
+        bits = self._bits
+        return all(bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(item))
+
+
+class RevocationIndex:
+    """
+        Per process index of the revoked jtis.
+        - A bloom filter answers "surely not revoked" without touching the database.
+        - A dict jti -> expiry keeps the exact jtis still inside their expiry window.
+        - A positive of the bloom filter that is not in the dict is a false positive,
+          only then we ask the database.
+        The index is seeded lazily from admin.token_blocklist and every `sync_interval`
+        seconds it reads the rows inserted by the other workers after the last seen id.
+        Until that read a token revoked by another worker is not in the bloom filter, so
+        it is accepted here: the window is `sync_interval` (plus the flush interval of a
+        batched BlocklistWriter). One request at a time runs the sync, the others go on
+        with the index they have, except for the seed that they wait for.
+    """
+    def __init__(self, capacity: int = 100000, fp_rate: float = 0.001,
+                 sync_interval: float = 5, window=None, sync_lookback: int = 100):
+        self.capacity = capacity
+        self.fp_rate = fp_rate
+        self.sync_interval = sync_interval
+        self.window = window  # max lifetime of a token, used when a row has no expiry
+        self.sync_lookback = sync_lookback
+        self._bloom = BloomFilter(capacity, fp_rate)
+        self._exact = {}  # jti -> expiry timestamp
+        self._high_water = 0  # last TokenBlocklist.id seen
+        self._last_sync = None
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+
+    def add(self, jti: str, expires_at: float = None):
+        """
+            Register a revoked jti, `expires_at` is the exp claim of the token.
+        """
+        if expires_at is None:
+            expires_at = time.time() + self._window_seconds()
+        with self._lock:
+            if jti in self._exact:
+                return
+            if self._bloom.count >= self._bloom.capacity:
+                self._drop_expired()
+                self._rebuild(max(self.capacity, len(self._exact) * 2))
+            self._exact[jti] = expires_at
+            self._bloom.add(jti)
+
+    def is_revoked(self, jti: str) -> bool:
+        self._maybe_sync()
+        if jti not in self._bloom:
+            return False
+        expires_at = self._exact.get(jti)
+        if expires_at is not None:
+            return True
+        return db.session.query(TokenBlocklist.id).filter_by(jti=jti).first() is not None
+
+    def sync(self):
+        """
+            Load the rows written after the last seen id. It is the path used to learn
+            about the tokens revoked by the other workers. The lookback re-reads some rows
+            in case a transaction with a lower id committed after a higher one. The
+            expired rows are never read, so the seed is bounded by the live tokens.
+        """
+        with self._sync_lock:
+            self._sync()
+
+    def _sync(self):
+        # Called with the sync lock held
+        window = self._window_seconds()
+        now = time.time()
+        cutoff = get_current_time()
+        rows = db.session.query(TokenBlocklist.id, TokenBlocklist.jti,
+                                TokenBlocklist.created_at, TokenBlocklist.expires_at)\
+            .filter(TokenBlocklist.id > self._high_water - self.sync_lookback)\
+            .filter(or_(TokenBlocklist.expires_at > cutoff,
+                        and_(TokenBlocklist.expires_at.is_(None),
+                             TokenBlocklist.created_at > cutoff - timedelta(seconds=window))))\
+            .order_by(TokenBlocklist.id).all()
+        for row_id, jti, created_at, row_expires_at in rows:
+            if row_expires_at is not None:
+                expires_at = self._timestamp(row_expires_at)
+            else:
+                expires_at = self._timestamp(created_at) + window
+            if expires_at > now:
+                self.add(jti, expires_at)
+            self._high_water = max(self._high_water, row_id)
+        self._last_sync = time.monotonic()
+
+    def purge_expired(self):
+        """
+            Drop the expired jtis from the dict. The bloom filter can't delete, so it is
+            rebuilt from what is left.
+        """
+        with self._lock:
+            self._drop_expired()
+            self._rebuild(max(self.capacity, len(self._exact) * 2))
+
+    def stats(self) -> dict:
+        return {
+            'exact': len(self._exact),
+            'bloom_size_bits': self._bloom.size,
+            'bloom_hashes': self._bloom.hashes,
+            'high_water': self._high_water,
+        }
+
+    def _maybe_sync(self):
+        if self._last_sync is None:
+            with self._sync_lock:
+                if self._last_sync is None:  # Seeded by another request while we waited
+                    self._sync()
+        elif time.monotonic() - self._last_sync >= self.sync_interval:
+            if self._sync_lock.acquire(blocking=False):
+                try:
+                    self._sync()
+                finally:
+                    self._sync_lock.release()
+
+    def _drop_expired(self):
+        # Called with the lock held
+        now = time.time()
+        self._exact = {jti: exp for jti, exp in self._exact.items() if exp > now}
+
+    def _rebuild(self, capacity: int):
+        # Called with the lock held
+        bloom = BloomFilter(capacity, self.fp_rate)
+        for jti in self._exact:
+            bloom.add(jti)
+        self._bloom = bloom
+
+    def _window_seconds(self) -> float:
+        if self.window is None:
+            return 30 * 24 * 3600  # default refresh token lifetime of flask_jwt_extended
+        return self.window.total_seconds()
+
+    @staticmethod
+    def _timestamp(value: datetime) -> float:
+        if value is None:
+            return time.time()
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return value.timestamp()
+
+
+class BlocklistWriter:
+    """
+        Writes the revoked tokens to admin.token_blocklist and purges the expired rows.
+        Modes:
+        - 'sync': the row is inserted and committed inside the request (durable).
+        - 'batched': rows are buffered and flushed by a background thread with one
+          multi-row INSERT every `flush_interval` seconds or `flush_size` rows. A crash
+          loses at most the last interval, and until the flush the other workers only
+          learn about the revocation if they share the database row, so use it with the
+          revocation index enabled.
+        The same thread deletes expired rows in chunks of `purge_chunk` every
+        `purge_interval` seconds, so the table doesn't grow forever.
+    """
+    def __init__(self, app, mode: str = 'sync', flush_interval: float = 1, flush_size: int = 500,
+                 purge_interval: float = 300, purge_chunk: int = 1000, window: timedelta = None):
+        if mode not in ('sync', 'batched'):
+            raise ValueError(f"Unknown blocklist write mode {mode}")
+        self.app = app
+        self.mode = mode
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        self.purge_interval = purge_interval
+        self.purge_chunk = purge_chunk
+        self.window = window or timedelta(days=30)
+        self._buffer = []
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._last_purge = time.monotonic()
+
+    def revoke(self, jti: str, exp: float = None):
+        """
+            Save the jti, `exp` is the exp claim of the token.
+        """
+        row = {
+            'jti': jti,
+            'created_at': get_current_time(),
+            'expires_at': datetime.fromtimestamp(exp, tz=timezone.utc) if exp else None,
+        }
+        self.ensure_started()
+        if self.mode == 'sync':
+            self._insert([row])
+            return
+        with self._lock:
+            self._buffer.append(row)
+            full = len(self._buffer) >= self.flush_size
+        if full:
+            self._wakeup.set()
+
+    def flush(self):
+        """
+            Write the buffered rows with one multi-row INSERT.
+        """
+        with self._lock:
+            rows, self._buffer = self._buffer, []
+        if not rows:
+            return 0
+        try:
+            with self.app.app_context():
+                self._insert(rows)
+        except Exception:
+            logger.exception("Could not flush %s revoked tokens, retrying later", len(rows))
+            with self._lock:
+                self._buffer = rows + self._buffer
+            return 0
+        return len(rows)
+
+    def purge_expired(self) -> int:
+        """
+            Delete the expired rows in bounded chunks, each one in its own transaction
+            so we never hold long locks on the table. Rows written before the expires_at
+            column existed are purged when they are older than the longest token lifetime.
+        """
+        total = 0
+        while True:
+            now = get_current_time()
+            expired = or_(
+                TokenBlocklist.expires_at < now,
+                and_(TokenBlocklist.expires_at.is_(None),
+                     TokenBlocklist.created_at < now - self.window)
+            )
+            ids = select(TokenBlocklist.id).where(expired).limit(self.purge_chunk).scalar_subquery()
+            result = db.session.execute(delete(TokenBlocklist).where(TokenBlocklist.id.in_(ids)))
+            db.session.commit()
+            total += result.rowcount
+            if result.rowcount < self.purge_chunk:
+                return total
+
+    def ensure_started(self):
+        """
+            The thread starts with the first request that needs it, not in create_app,
+            so commands like `flask db upgrade` don't run it.
+        """
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name='blocklist-writer', daemon=True)
+            self._thread.start()
+            if self.mode == 'batched':
+                atexit.register(self.flush)
+
+    def _insert(self, rows):
+        db.session.execute(insert(TokenBlocklist).values(rows))
+        db.session.commit()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+            if self.purge_interval and time.monotonic() - self._last_purge >= self.purge_interval:
+                self._last_purge = time.monotonic()
+                try:
+                    with self.app.app_context():
+                        purged = self.purge_expired()
+                    logger.info("Purged %s expired revoked tokens", purged)
+                except Exception:
+                    logger.exception("Could not purge the expired revoked tokens")
+
+
+def revoke_token(jwt_data: dict):
+    """
+        Revoke the token of the current request: it is rejected by this worker right
+        away through the index, and saved with the writer configured in the app.
+    """
+    app = current_app
+    if app.revocation_index is not None:
+        app.revocation_index.add(jwt_data['jti'], jwt_data.get('exp'))
+    app.blocklist_writer.revoke(jwt_data['jti'], jwt_data.get('exp'))
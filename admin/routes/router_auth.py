@@ -3,10 +3,13 @@
 """
 # admin/auth.py
 from flask import Blueprint, request, jsonify, url_for, current_app
-from sqlalchemy import or_, func
-from werkzeug.security import generate_password_hash, check_password_hash
+from sqlalchemy.exc import IntegrityError
 from extension import db
-from admin.models import User, TokenBlocklist
+from admin.models import User, UserRoleEnum, normalize_login
+from admin.revocation import revoke_token
+from admin.hashing import HashingBusy
+from permissions import admin_required
+from db_routing import read_only
 
 from flask_jwt_extended import (
     create_access_token,
@@ -19,6 +22,13 @@ from flask_jwt_extended import (
 
 auth_blueprint = Blueprint("auth", __name__, url_prefix="/auth")
 
+@auth_blueprint.errorhandler(HashingBusy)
+def hashing_busy(e):
+    """
+        The password hashing pool is full, ask the client to come back later.
+    """
+    return jsonify("Too many requests, try again later"), 503, {'Retry-After': str(e.retry_after)}
+
 # Registration endpoint (ensure your User model has a 'password' field or related setup)
 @auth_blueprint.route('/register', methods=['POST'])
 def register():
@@ -33,17 +43,21 @@ def register():
     last_name = data.get('last_name')
     if email is None or username is None or password is None or first_name is None or last_name is None:
         return jsonify("Missing required parameter"), 400
-    hashed_password = generate_password_hash(password)
     role = data.get('role')
     if role is None:
         role = 'guest'
     if not role.lower() in ['guest', 'admin', 'superadmin']:
         return jsonify("Role not valid"), 422
+    hashed_password = current_app.password_hasher.hash(password) # Runs in the hashing pool
     
     user = User(username=username, email=email, first_name=first_name,
                 last_name=last_name, password=hashed_password)
     db.session.add(user)
-    db.session.commit()
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        return jsonify("Username or email already registered"), 409
     return jsonify(message="User created successfully"), 201
 
 # Login endpoint: issues access and refresh tokens
@@ -54,15 +68,13 @@ def login():
     password = data.get("password")
     if username is None or password is None:
         return jsonify("Missing required parameter"), 400
-    user = User.query.filter(
-        or_(
-            func.lower(User.username) == str(username).lower(),
-            func.lower(User.email) == str(username).lower(),
-        )
-        ).first()
+    user = User.find_for_login(username)
 
-    if not user or not check_password_hash(user.password, password):
+    hasher = current_app.password_hasher
+    if not user or not hasher.check(user.password, password):
         return jsonify(message="Invalid credentials"), 401
+    if hasher.needs_rehash(user.password):
+        hasher.rehash_later(user.id, password) # Hashed with old parameters
     access_token = create_access_token(identity=user)
     refresh_token = create_refresh_token(identity=user)
     return jsonify(access_token=access_token, refresh_token=refresh_token), 200
@@ -78,9 +90,7 @@ def refresh():
     identity = get_jwt_identity()  # returns user's id
     user = User.query.filter_by(id = identity).first()
     # Block the current access token
-    jti = get_jwt()['jti']
-    db.session.add(TokenBlocklist(jti=jti))
-    db.session.commit()
+    revoke_token(get_jwt())
 
     # Generate new tokens
     new_access_token = create_access_token(identity=user)
@@ -94,17 +104,48 @@ def logout():
     """
         Logout endpoint. Save refresh token to tokenblocklist
     """
-    jti = get_jwt()["jti"]
-    db.session.add(TokenBlocklist(jti=jti))
-    db.session.commit()
+    revoke_token(get_jwt())
     return jsonify(message="Access token has been revoked"), 200
 
+@auth_blueprint.route('/logout-all', methods=['POST'])
+@jwt_required()
+def logout_all():
+    """
+        Forced logout, bump the token version so every token of the user is rejected.
+    """
+    user = User.query.filter_by(id=current_user.id).first()
+    user.bump_token_version()
+    db.session.commit()
+    current_app.token_versions.forget(user.id)
+    return jsonify(message="All the tokens have been revoked"), 200
+
+@auth_blueprint.route('/users/<int:user_id>/role', methods=['PUT'])
+@jwt_required()
+@admin_required
+def change_role(user_id):
+    """
+        Change the role of a user. The old tokens carry the old role in the claims
+        so they are invalidated bumping the token version.
+    """
+    data = request.get_json()
+    role = data.get('role')
+    if role is None or not role.lower() in ['guest', 'admin', 'superadmin']:
+        return jsonify("Role not valid"), 422
+    user = User.query.filter_by(id=user_id).first()
+    if user is None:
+        return jsonify("User not found"), 404
+    user.role = UserRoleEnum(role.lower())
+    user.bump_token_version()
+    db.session.commit()
+    current_app.token_versions.forget(user.id)
+    return jsonify(user.to_dict()), 200
 
 @auth_blueprint.route('/who-i-am', methods = ['GET'])
 @jwt_required()
+@read_only
 def authenticated():
     """
-        Return authenticated user
+        Return authenticated user, in claims mode it is built from the token.
     """
     user = current_user
     return jsonify(user.to_dict())
@@ -117,7 +158,6 @@ def google_login():
     # Redirect user to Google for authorization.
     google = current_app.oauth.google
     redirect_uri = url_for('auth.google_auth', _external=True) # prefix of the blueprint 'auth'
-    print('url for google', redirect_uri)
     return google.authorize_redirect(redirect_uri)
 
 
@@ -134,7 +174,7 @@ def google_auth():
     last_name = user_info.get('family_name')
 
     # Now, check if this email already exists in your database
-    user = User.query.filter(func.lower(User.email) == str(email).lower(),).first()
+    user = User.query.filter_by(email_key=normalize_login(email)).first()
     if not user:
         user = User(
             email=email,
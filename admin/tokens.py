@@ -0,0 +1,100 @@
+"""
+    Helpers to serve the identity of the user from the jwt claims instead of
+    loading the User row on every request.
+"""
+import threading
+import time
+from extension import db
+from admin.models import User, UserRoleEnum
+
+
+def user_claims(user: User) -> dict:
+    """
+        Extra claims embedded on every token, enough to authorize the request
+        and to answer who-i-am without touching the database.
+    """
+    return {
+        'role': user.role.value if user.role else UserRoleEnum.guest.value,
+        'username': user.username,
+        'email': user.email,
+        'first_name': user.first_name,
+        'last_name': user.last_name,
+        'ver': user.token_version or 0,
+    }
+
+
+class ClaimsUser:
+    """
+        Lightweight user built from the jwt claims. It is what current_user returns
+        in claims mode, so it exposes the same attributes the views use from User.
+    """
+    def __init__(self, jwt_data: dict):
+        self.id = int(jwt_data['sub'])
+        self.role = UserRoleEnum(jwt_data['role'])
+        self.username = jwt_data.get('username')
+        self.email = jwt_data.get('email')
+        self.first_name = jwt_data.get('first_name')
+        self.last_name = jwt_data.get('last_name')
+        self.token_version = jwt_data.get('ver', 0)
+
+    def __repr__(self):
+        return f'<ClaimsUser {self.username}>'
+
+    @staticmethod
+    def has_claims(jwt_data: dict) -> bool:
+        """
+            Tokens issued before the claims mode don't carry the role.
+        """
+        return 'role' in jwt_data
+
+    def to_dict(self):
+        """
+            Same shape as User.to_dict
+        """
+        return {
+            'id': self.id,
+            'first_name': self.first_name,
+            'last_name': self.last_name,
+            'username': self.username,
+            'email': self.email,
+            'role': self.role.value
+        }
+
+
+class TokenVersionCache:
+    """
+        Per process cache of user_id -> token_version. A token is stale when its
+        'ver' claim is lower than the current version of the user. The version is
+        read with a primary key probe at most once every `ttl` seconds per user,
+        so a bump made by another worker is seen after `ttl` seconds at most.
+    """
+    def __init__(self, ttl: float = 30):
+        self.ttl = ttl
+        self._versions = {}  # user_id -> (version, loaded_at)
+        self._lock = threading.Lock()
+
+    def get(self, user_id: int):
+        now = time.monotonic()
+        cached = self._versions.get(user_id)
+        if cached is not None and now - cached[1] < self.ttl:
+            return cached[0]
+        version = db.session.query(User.token_version).filter_by(id=user_id).scalar()
+        with self._lock:
+            self._versions[user_id] = (version, now)
+        return version
+
+    def forget(self, user_id: int):
+        """
+            Drop the cached version, call it after bumping the version of the user.
+        """
+        with self._lock:
+            self._versions.pop(user_id, None)
+
+    def is_stale(self, jwt_payload: dict) -> bool:
+        """
+            True if the user was deleted or its version was bumped after the token was issued.
+        """
+        current = self.get(int(jwt_payload['sub']))
+        if current is None:
+            return True
+        return jwt_payload.get('ver', 0) < current
@@ -8,6 +8,7 @@ from flask_migrate import Migrate
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
 from config import DevelopmentConfig
+import ratelimit_storage # Registers the mmap:// storage of flask-limiter
 from extension import db
 def create_app():
     """
@@ -17,16 +18,53 @@ def create_app():
     config = DevelopmentConfig() # Because the property is not being execute unless is instance
     app.config.from_object(config)
     db.init_app(app) # Initialize the db with app config
+    from db_routing import init_db_routing
+    init_db_routing(app)
+    from query_budget import init_query_budget
+    init_query_budget(app)
+    from metrics import init_metrics
+    init_metrics(app)
     jwt_manager = JWTManager(app)
     limiter = Limiter(
         get_remote_address,
         app=app,
-        default_limits=["30 per minute"]
+        default_limits=[app.config.get("RATELIMIT_DEFAULT", "30 per minute")]
     )
+    limiter.exempt(app.view_functions['metrics']) # Scraped often, never throttle it
+    app.limiter = limiter # The native listings of asgi.py count in the same storage
 
     # If you need to register the models
     from admin.models import User, TokenBlocklist
     from authors.models import AuthorBook, Author, Book
+    from admin.tokens import ClaimsUser, TokenVersionCache, user_claims
+    from admin.revocation import RevocationIndex, BlocklistWriter
+    from admin.hashing import PasswordHasher
+    app.token_versions = TokenVersionCache(ttl=app.config.get("JWT_TOKEN_VERSION_TTL", 30))
+    app.revocation_index = None
+    if app.config.get("REVOCATION_INDEX_ENABLED"):
+        app.revocation_index = RevocationIndex(
+            capacity=app.config.get("REVOCATION_BLOOM_CAPACITY", 100000),
+            fp_rate=app.config.get("REVOCATION_BLOOM_FP_RATE", 0.001),
+            sync_interval=app.config.get("REVOCATION_SYNC_INTERVAL", 5),
+            window=app.config.get("JWT_REFRESH_TOKEN_EXPIRES"),
+        )
+    app.password_hasher = PasswordHasher(
+        app,
+        method=app.config.get("PASSWORD_HASH_METHOD", "scrypt:32768:8:1"),
+        workers=app.config.get("PASSWORD_HASH_WORKERS", 2),
+        queue_size=app.config.get("PASSWORD_HASH_QUEUE", 16),
+        timeout=app.config.get("PASSWORD_HASH_TIMEOUT", 10),
+        retry_after=app.config.get("PASSWORD_HASH_RETRY_AFTER", 1),
+    )
+    app.blocklist_writer = BlocklistWriter(
+        app,
+        mode=app.config.get("BLOCKLIST_WRITE_MODE", "sync"),
+        flush_interval=app.config.get("BLOCKLIST_FLUSH_INTERVAL", 1),
+        flush_size=app.config.get("BLOCKLIST_FLUSH_SIZE", 500),
+        purge_interval=app.config.get("BLOCKLIST_PURGE_INTERVAL", 300),
+        purge_chunk=app.config.get("BLOCKLIST_PURGE_CHUNK", 1000),
+        window=app.config.get("JWT_REFRESH_TOKEN_EXPIRES"),
+    )
     
     @jwt_manager.user_identity_loader
     def user_identity_lookup(user: User):
@@ -34,13 +72,23 @@ def create_app():
             Pass the id of the user as sub for jwt body
         """
         return user.id
+
+    @jwt_manager.additional_claims_loader
+    def add_claims_to_token(user: User):
+        """
+            Embed role, username and token version so we can authorize from the claims.
+        """
+        return user_claims(user)
     
     @jwt_manager.user_lookup_loader
     def user_lookup_callback(_jwt_header, jwt_data):
         """
             Return the user instance that belongs to this claim.
             Load the current_user object of flask with this info.
+            In claims mode the user is built from the token, no query needed.
         """
+        if app.config.get("JWT_CLAIMS_MODE") and ClaimsUser.has_claims(jwt_data):
+            return ClaimsUser(jwt_data)
         identity = jwt_data["sub"]
         return User.query.filter_by(id=identity).one_or_none()
     
@@ -49,7 +97,13 @@ def create_app():
         """
             Expand the jwt_required decorator to check if the token is in the block list
         """
+        if app.token_versions.is_stale(jwt_payload):
+            return True # The role changed or the user forced a logout
+        app.blocklist_writer.ensure_started()
         jti = jwt_payload["jti"]
+        if app.revocation_index is not None:
+            # Seeded on the first call, a negative answer skips the database
+            return app.revocation_index.is_revoked(jti)
         token = TokenBlocklist.query.filter_by(jti = jti).first()
         return token is not None # True means that is not revoked yet
     #  Save Oauth credentials
@@ -57,16 +111,82 @@ def create_app():
     oauth.register(
         name='google',
         client_kwargs={'scope': 'openid email profile'}, # Required by google!!
-        server_metadata_url='https://accounts.google.com/.well-known/openid-configuration',  # <== This ensures JWKS can be fetched
+        server_metadata_url=app.config.get("GOOGLE_SERVER_METADATA_URL"),  # <== This ensures JWKS can be fetched
     )
     app.oauth = oauth
+    # Discovery and JWKS served from a disk cache instead of fetched on the first login
+    from admin.oidc_cache import OidcCache
+    app.oidc_cache = OidcCache(
+        app.config.get("GOOGLE_SERVER_METADATA_URL"),
+        app.config.get("OIDC_CACHE_PATH", "/tmp/author_books_oidc.json"),
+        ttl=app.config.get("OIDC_CACHE_TTL", 3600),
+        refresh_before=app.config.get("OIDC_REFRESH_BEFORE", 300),
+        timeout=app.config.get("OIDC_FETCH_TIMEOUT", 5),
+        min_refetch_interval=app.config.get("OIDC_MIN_REFETCH_INTERVAL", 60),
+    )
+    app.oidc_cache.attach(oauth.create_client('google'))
+    if app.config.get("OIDC_WARM_AT_STARTUP"):
+        try:
+            app.oidc_cache.warm()
+        except Exception:
+            # The login fetches it later, don't keep the app from starting
+            app.logger.exception("Could not warm the OIDC cache")
+
+    # Catalog change events and search
+    from authors.events import init_catalog_events, on_catalog_commit
+    from authors.search import CatalogSearch
+    init_catalog_events()
+    app.catalog_search = CatalogSearch()
+    on_catalog_commit(app.catalog_search.fallback.invalidate)
+    from authors.cache import create_cache
+    from metrics import REGISTRY
+    app.catalog_cache = create_cache(app.config)
+    if app.catalog_cache is not None:
+        on_catalog_commit(app.catalog_cache.invalidate)
+        REGISTRY.add_collector(app.catalog_cache.metric_lines)
+    from authors.autocomplete import Autocomplete
+    app.autocomplete = Autocomplete(
+        app,
+        sync_interval=app.config.get("AUTOCOMPLETE_SYNC_INTERVAL", 30),
+        rebuild_interval=app.config.get("AUTOCOMPLETE_REBUILD_INTERVAL", 3600),
+        sync_overlap=app.config.get("CATALOG_SYNC_OVERLAP", 300),
+    )
+    on_catalog_commit(app.autocomplete.apply_changes)
+    REGISTRY.add_collector(app.autocomplete.metric_lines)
+    if app.config.get("AUTOCOMPLETE_BUILD_AT_STARTUP"):
+        # Built in the background, the database answers until it is ready
+        app.autocomplete.ensure_started()
+    from authors.graph import CoauthorGraph
+    app.coauthor_graph = CoauthorGraph(
+        app,
+        sync_interval=app.config.get("GRAPH_SYNC_INTERVAL", 30),
+        rebuild_interval=app.config.get("GRAPH_REBUILD_INTERVAL", 3600),
+        sync_overlap=app.config.get("CATALOG_SYNC_OVERLAP", 300),
+        compact_after=app.config.get("GRAPH_COMPACT_AFTER", 50000),
+    )
+    on_catalog_commit(app.coauthor_graph.apply_changes)
+    REGISTRY.add_collector(app.coauthor_graph.metric_lines)
+    if app.config.get("GRAPH_BUILD_AT_STARTUP"):
+        app.coauthor_graph.ensure_started()
+    from authors.similar import SimilarBooks
+    app.similar_books = SimilarBooks(app.config.get("SIMILAR_BOOKS_PATH", "/tmp/author_books_similar"))
+    REGISTRY.add_collector(app.similar_books.metric_lines)
 
     # Add my blueprints
     from admin.routes.router_auth import auth_blueprint
     app.register_blueprint(auth_blueprint)
+    from authors.routes.router_author import author_blueprint
+    app.register_blueprint(author_blueprint)
 
     # register the migrations
     migrate = Migrate(app, db)
+
+    # Custom cli commands
+    from admin.commands import blocklist_cli, oidc_cli
+    app.cli.add_command(blocklist_cli)
+    app.cli.add_command(oidc_cli)
+    from authors.commands import catalog_cli
+    app.cli.add_command(catalog_cli)
     return app
 
 if __name__ == '__main__':
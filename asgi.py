@@ -0,0 +1,258 @@
+"""
+    ASGI entry point: uvicorn asgi:app --workers 4
+
+    The catalog listings (GET /author-books/author and /author-books/book) are
+    served natively with the asyncio engine of SQLAlchemy, so a slow query doesn't
+    hold a worker and one process keeps hundreds of requests in flight. Everything
+    else goes to the same flask app through asgiref's WsgiToAsgi.
+    Needs the packages of requirements-asgi.txt (asgiref, greenlet, the async drivers, uvicorn).
+    The token is validated by flask_jwt_extended with the same loaders as the sync
+    app (blocklist, token version), in a thread because it may touch the database.
+    The reads go to a replica when there is one, unless the sticky cookie of
+    db_routing is set (the client wrote in the last DB_REPLICA_STICKY_SECONDS).
+    The requests are recorded in the same http_request_* metrics as the flask views,
+    with X-SQL-Statements when SQL_COUNT_HEADER is on, and are rate limited with the
+    limit (RATELIMIT_DEFAULT) and the storage of the flask-limiter of the app.
+    The native listings don't use the response cache (CATALOG_CACHE_*): they answer
+    If-None-Match with their ETag and a miss costs three cheap async statements. The
+    related=true variant and the rest of the catalog go through flask and use it.
+"""
+import asyncio
+import math
+import time
+from urllib.parse import parse_qsl
+from asgiref.wsgi import WsgiToAsgi
+from flask_jwt_extended import verify_jwt_in_request
+from flask_jwt_extended.exceptions import JWTExtendedException
+from jwt.exceptions import PyJWTError
+from limits import parse_many
+from sqlalchemy.ext.asyncio import create_async_engine
+from werkzeug.http import http_date, parse_cookie, parse_etags
+from app import create_app
+from authors.conditional import compute_version, page_salt, version_columns
+from authors.models import Author, Book
+from authors.pagination import (PageRequest, PaginationError, count_statement, estimate_statement,
+                                next_cursor, page_statement, valid_estimate)
+from authors.routes.router_author import AUTHOR_SORTS, BOOK_SORTS
+from db_routing import STICKY_COOKIE, pinned_to_primary
+from fast_json import listing_json, rows_to_dicts
+from metrics import RATELIMIT_REJECTIONS, REQUEST_LATENCY, REQUEST_SQL_SECONDS, REQUEST_STATEMENTS
+
+ASYNC_DRIVERS = {'postgresql': 'postgresql+asyncpg', 'sqlite': 'sqlite+aiosqlite'}
+
+
+def async_url(uri: str) -> str:
+    scheme, rest = uri.split('://', 1)
+    return f"{ASYNC_DRIVERS.get(scheme.split('+')[0], scheme)}://{rest}"
+
+
+class AsyncCatalog:
+    """
+        Native async handlers of the catalog listings.
+    """
+    def __init__(self, flask_app):
+        self.flask_app = flask_app
+        config = flask_app.config
+        self.engine = self._engine(config['SQLALCHEMY_DATABASE_URI'])
+        # Reads only, so a replica when there is one
+        replicas = config.get('DB_REPLICA_URIS')
+        self.replica = self._engine(replicas[0]) if replicas else None
+        # Same endpoint names as the flask views, for the metrics
+        self.routes = {
+            '/author-books/author': (Author, AUTHOR_SORTS, 'authors.handle_authors'),
+            '/author-books/book': (Book, BOOK_SORTS, 'authors.list_books'),
+        }
+        self.limits = list(parse_many(config.get('RATELIMIT_DEFAULT', '30 per minute')))
+
+    def _engine(self, uri):
+        config = self.flask_app.config
+        options = {'pool_pre_ping': config.get('DB_POOL_PRE_PING', True)}
+        if uri.startswith('sqlite'):
+            options['execution_options'] = {'schema_translate_map': {'admin': None, 'authors': None}}
+        else:
+            options.update(pool_size=config.get('DB_POOL_SIZE', 5), max_overflow=config.get('DB_MAX_OVERFLOW', 10),
+                           pool_recycle=config.get('DB_POOL_RECYCLE', 1800))
+            if config.get('DB_STATEMENT_TIMEOUT_MS'):
+                options['connect_args'] = {'server_settings': {
+                    'statement_timeout': str(config['DB_STATEMENT_TIMEOUT_MS'])}}
+        return create_async_engine(async_url(uri), **options)
+
+    def handles(self, scope) -> bool:
+        if scope['method'] != 'GET' or scope['path'] not in self.routes:
+            return False
+        args = dict(parse_qsl(scope.get('query_string', b'').decode()))
+        return args.get('related') != 'true'  # The eager loaded variant stays in flask
+
+    async def __call__(self, scope, receive, send):
+        started = time.perf_counter()
+        model, sorts, endpoint = self.routes[scope['path']]
+        stats = {'statements': 0, 'seconds': 0.0}
+        status = 500
+        try:
+            status = await self.respond(scope, send, model, sorts, endpoint, stats)
+        finally:
+            REQUEST_LATENCY.observe(time.perf_counter() - started, 'authors', endpoint, 'GET', status)
+            REQUEST_STATEMENTS.observe(stats['statements'], 'authors', endpoint)
+            REQUEST_SQL_SECONDS.observe(stats['seconds'], 'authors', endpoint)
+
+    async def respond(self, scope, send, model, sorts, endpoint, stats) -> int:
+        # Before the token, like the before_request of flask-limiter
+        retry_after = await asyncio.to_thread(self._rate_limit, scope, endpoint)
+        if retry_after is not None:
+            RATELIMIT_REJECTIONS.inc('authors', endpoint)
+            return await self._respond(send, 429, "Too many requests", [(b'retry-after', str(retry_after).encode())])
+        headers = {key.decode().lower(): value.decode() for key, value in scope.get('headers', [])}
+        error = await asyncio.to_thread(self._verify_jwt, headers.get('authorization'))
+        if error is not None:
+            return await self._respond(send, 401, {'msg': error})
+        args = dict(parse_qsl(scope.get('query_string', b'').decode()))
+        engine = self.read_engine(headers.get('cookie'))
+        try:
+            page = self.page_request(sorts, args)
+            version = await self.version(engine, model, page, stats)
+            validators = [(b'etag', f'W/"{version.etag}"'.encode()), (b'cache-control', b'private, no-cache')]
+            if version.last_modified is not None:
+                validators.append((b'last-modified', http_date(version.last_modified).encode()))
+            if parse_etags(headers.get('if-none-match')).contains_weak(version.etag):
+                return await self._respond(send, 304, None, validators, stats)
+            body = await self.page(engine, model, page, stats, version.total)
+        except PaginationError as e:
+            return await self._respond(send, 422, str(e), stats=stats)
+        return await self._respond(send, 200, body, validators, stats)
+
+    def _rate_limit(self, scope, endpoint):
+        """
+            Count the request in the storage of flask-limiter, per client address and
+            endpoint. Returns the seconds to wait when a limit is exceeded, else None.
+        """
+        limiter = self.flask_app.limiter
+        if not limiter.enabled:
+            return None
+        address = (scope.get('client') or ('127.0.0.1', 0))[0]
+        for limit in self.limits:
+            if not limiter.limiter.hit(limit, 'asgi', address, endpoint):
+                reset_at = limiter.limiter.get_window_stats(limit, 'asgi', address, endpoint).reset_time
+                return max(1, math.ceil(reset_at - time.time()))
+        return None
+
+    def read_engine(self, cookie_header):
+        """
+            The replica, or the primary while the client is pinned to it (read your writes).
+        """
+        if self.replica is None or pinned_to_primary(parse_cookie(cookie_header or '').get(STICKY_COOKIE)):
+            return self.engine
+        return self.replica
+
+    def _verify_jwt(self, authorization):
+        """
+            Same checks as @jwt_required(), returns the error message or None.
+        """
+        headers = {'Authorization': authorization} if authorization else {}
+        with self.flask_app.test_request_context(headers=headers):
+            try:
+                verify_jwt_in_request()
+            except (JWTExtendedException, PyJWTError) as e:
+                # The other errors (database down...) are a 500, not a bad token
+                return str(e) or e.__class__.__name__
+        return None
+
+    def page_request(self, sorts, args):
+        config = self.flask_app.config
+        return PageRequest(args, sorts, 'created_at', default_limit=config.get('PAGE_SIZE_DEFAULT', 50),
+                           max_limit=config.get('PAGE_SIZE_MAX', 200))
+
+    async def version(self, engine, model, page, stats):
+        """
+            Same validators as authors.conditional.page_version.
+        """
+        async with engine.connect() as conn:
+            rows = (await self.execute(conn, page_statement(model, page, version_columns(model)), stats)).all()
+            total, is_estimate = await self.total(conn, model, page, stats)
+        version = compute_version(rows, salt=page_salt(model, page, False, None if is_estimate else total), weak=True)
+        version.total = (total, is_estimate)
+        return version
+
+    @staticmethod
+    async def execute(conn, statement, stats):
+        """
+            conn.execute, counted like the statements of the flask requests.
+        """
+        started = time.perf_counter()
+        try:
+            return await conn.execute(statement)
+        finally:
+            stats['statements'] += 1
+            stats['seconds'] += time.perf_counter() - started
+
+    async def total(self, conn, model, page, stats):
+        """
+            Same as authors.pagination.total_count, (total, is_estimate).
+        """
+        if not page.exact_count and conn.dialect.name == 'postgresql':
+            total = valid_estimate((await self.execute(conn, estimate_statement(model), stats)).scalar())
+            if total is not None:
+                return total, True
+        return (await self.execute(conn, count_statement(model), stats)).scalar(), False
+
+    async def page(self, engine, model, page, stats, total) -> dict:
+        columns = model.list_columns()
+        keys = [column.key for column in columns]
+        entities = list(columns)
+        if page.column.key not in keys:
+            entities.append(page.column)
+        sort_index = [entity.key for entity in entities].index(page.column.key)
+        async with engine.connect() as conn:
+            rows = (await self.execute(conn, page_statement(model, page, entities), stats)).all()
+            rows, cursor = next_cursor(rows, page, lambda row: row[sort_index], lambda row: row[0])
+        total, is_estimate = total  # Counted once, by version()
+        return {
+            'items': rows_to_dicts(keys, rows),
+            'next_cursor': cursor,
+            'limit': page.limit,
+            'total': total,
+            'total_is_estimate': is_estimate,
+        }
+
+    async def _respond(self, send, status, body, headers=(), stats=None):
+        payload = listing_json(body, self.flask_app) if status != 304 else b''
+        if stats is not None and self.flask_app.config.get('SQL_COUNT_HEADER'):
+            headers = [*headers, (b'x-sql-statements', str(stats['statements']).encode())]  # Read by benchmarks.load
+        await send({'type': 'http.response.start', 'status': status,
+                    'headers': [(b'content-type', b'application/json'),
+                                (b'content-length', str(len(payload)).encode()), *headers]})
+        await send({'type': 'http.response.body', 'body': payload})
+        return status
+
+    async def close(self):
+        await self.engine.dispose()
+        if self.replica is not None:
+            await self.replica.dispose()
+
+
+def create_asgi_app():
+    """
+        ASGI variant of create_app.
+    """
+    flask_app = create_app()
+    wsgi = WsgiToAsgi(flask_app)
+    catalog = AsyncCatalog(flask_app)
+
+    async def asgi_app(scope, receive, send):
+        if scope['type'] == 'lifespan':
+            while True:
+                message = await receive()
+                if message['type'] == 'lifespan.startup':
+                    await send({'type': 'lifespan.startup.complete'})
+                elif message['type'] == 'lifespan.shutdown':
+                    await catalog.close()
+                    await send({'type': 'lifespan.shutdown.complete'})
+                    return
+        if scope['type'] == 'http' and catalog.handles(scope):
+            return await catalog(scope, receive, send)
+        return await wsgi(scope, receive, send)
+
+    asgi_app.flask_app = flask_app
+    return asgi_app
+
+
+app = create_asgi_app()
@@ -0,0 +1,355 @@
+"""
+    Type-ahead over book titles and author names from an in process prefix index.
+    Every label is normalized (lower case, no accents, words split on anything that
+    is not a letter or a digit) and stored once per word, as the suffix of the label
+    starting at that word, so 'win' finds "The Winter Garden". The keys live in one
+    sorted list ('<suffix>\\0<id>') and a prefix is a range found with two bisects.
+    The matches are ranked by popularity (the link counters of the rows), outside of
+    the lock, and the top of every prefix asked is cached until a row it matches changes.
+
+    The index is built by a background thread with a streamed scan. The commits of
+    this worker reach it through the catalog events (the same thread reloads the
+    touched rows right after the commit); the rows changed by the other workers are
+    read every `sync_interval` seconds (updated_at moves with every edit and link)
+    and a full rebuild every `rebuild_interval` seconds drops the rows they deleted,
+    until then those are still suggested (the link to them answers 404).
+    updated_at is set before the commit (at the flush, or at the start of the
+    transaction by the counter triggers), so each sync reads again the last
+    `sync_overlap` seconds: a transaction still open at the previous sync is caught.
+    Until the first build is done the queries go to the database, served on
+    postgres by the pg_trgm indexes of the titles and names (accents are not
+    removed there).
+"""
+import heapq
+import logging
+import re
+import sys
+import threading
+import time
+import unicodedata
+from bisect import bisect_left, insort
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import select
+from extension import db
+from authors.models import Author, Book
+
+logger = logging.getLogger(__name__)
+NON_WORD = re.compile(r'[^\w]+')
+SEPARATOR = '\0'
+# Upper bound of the keys starting with a prefix, sorts after any id
+END = '\U0010ffff'
+# Approximate size of a (label, popularity) tuple
+TUPLE_BYTES = sys.getsizeof((None, None))
+# Ranked ids kept per cached prefix, and prefixes cached per kind (the oldest go first)
+TOP_SIZE = 50
+TOP_PREFIXES = 4096
+
+
+def normalize(text: str) -> str:
+    text = unicodedata.normalize('NFKD', text or '')
+    text = ''.join(char for char in text if not unicodedata.combining(char))
+    return NON_WORD.sub(' ', text.casefold()).replace('_', ' ').strip()
+
+
+def label_keys(label: str, row_id: int):
+    words = normalize(label).split()
+    return {f"{' '.join(words[start:])}{SEPARATOR}{row_id}" for start in range(len(words))}
+
+
+def entry_bytes(row_id, label, popularity, keys) -> int:
+    return (sys.getsizeof(row_id) + sys.getsizeof(label) + sys.getsizeof(popularity) + TUPLE_BYTES
+            + sum(sys.getsizeof(key) for key in keys))
+
+
+class PrefixIndex:
+    """
+        Keys of one kind plus {id: (label, popularity)}.
+    """
+    def __init__(self):
+        self.keys = []
+        self.rows = {}
+        self._top = {}  # prefix -> ranked ids, at most TOP_SIZE
+        self._generation = 0  # Moved by every change, a ranking done across one is not cached
+        self._entries_bytes = 0  # Kept by every change, /metrics doesn't walk the index
+        self._lock = threading.Lock()
+
+    @classmethod
+    def build(cls, rows):
+        """
+            rows: iterable of (id, label, popularity), streamed.
+        """
+        index = cls()
+        keys = []
+        for row_id, label, popularity in rows:
+            index.rows[row_id] = (label, popularity or 0)
+            row_keys = label_keys(label, row_id)
+            keys.extend(row_keys)
+            index._entries_bytes += entry_bytes(row_id, label, popularity or 0, row_keys)
+        keys.sort()
+        index.keys = keys
+        return index
+
+    def upsert(self, row_id: int, label: str, popularity: int):
+        popularity = popularity or 0
+        with self._lock:
+            old = self.rows.get(row_id)
+            if old == (label, popularity):
+                return  # Read again by an overlapping sync
+            if old is not None:
+                self._entries_bytes -= entry_bytes(row_id, *old, label_keys(old[0], row_id))
+                if old[0] != label:
+                    self._remove_keys(old[0], row_id)
+            keys = label_keys(label, row_id)
+            if old is None or old[0] != label:
+                for key in keys:
+                    insort(self.keys, key)
+            self.rows[row_id] = (label, popularity)
+            self._entries_bytes += entry_bytes(row_id, label, popularity, keys)
+            self._forget_top(label, old[0] if old else '')
+
+    def remove(self, row_id: int):
+        with self._lock:
+            old = self.rows.pop(row_id, None)
+            if old is not None:
+                self._entries_bytes -= entry_bytes(row_id, *old, label_keys(old[0], row_id))
+                self._remove_keys(old[0], row_id)
+                self._forget_top(old[0])
+
+    def _forget_top(self, *labels):
+        # Only the prefixes of the keys of the row can rank it
+        self._generation += 1
+        if not self._top:
+            return
+        for label in labels:
+            words = normalize(label).split()
+            for start in range(len(words)):
+                suffix = ' '.join(words[start:])
+                for size in range(1, len(suffix) + 1):
+                    self._top.pop(suffix[:size], None)
+
+    def _remove_keys(self, label, row_id):
+        for key in label_keys(label, row_id):
+            position = bisect_left(self.keys, key)
+            if position < len(self.keys) and self.keys[position] == key:
+                del self.keys[position]
+
+    def search(self, prefix: str, limit: int = 10) -> list:
+        """
+            [(id, label, popularity)] of the labels with a word starting with prefix.
+        """
+        prefix = normalize(prefix)
+        if not prefix:
+            return []
+        with self._lock:
+            ranked = self._top.get(prefix)
+            # Shorter than TOP_SIZE: every match is there
+            if ranked is not None and (limit <= len(ranked) or len(ranked) < TOP_SIZE):
+                return self._items(ranked[:limit])
+            start, stop = bisect_left(self.keys, prefix), bisect_left(self.keys, prefix + END)
+            keys, generation = self.keys[start:stop], self._generation
+        # Ranked without the lock, the upserts don't wait for it. A row changed meanwhile
+        # moves the generation and this ranking is not cached.
+        ids = {int(key.rpartition(SEPARATOR)[2]) for key in keys}
+        found = [(row_id, row) for row_id, row in ((row_id, self.rows.get(row_id)) for row_id in ids) if row is not None]
+        ranked = heapq.nsmallest(max(limit, TOP_SIZE), found, key=lambda item: (-item[1][1], item[1][0], item[0]))
+        with self._lock:
+            if generation == self._generation:
+                if len(self._top) >= TOP_PREFIXES:
+                    self._top.pop(next(iter(self._top)))
+                self._top[prefix] = [row_id for row_id, _ in ranked]
+        return [(row_id, *row) for row_id, row in ranked[:limit]]
+
+    def _items(self, ids):
+        return [(row_id, *self.rows[row_id]) for row_id in ids]
+
+    def memory_bytes(self) -> int:
+        """
+            Approximate footprint: the key strings, the list and the rows dict.
+        """
+        with self._lock:
+            return sys.getsizeof(self.keys) + sys.getsizeof(self.rows) + self._entries_bytes
+
+
+KINDS = {
+    'book': (Book, Book.title, Book.author_count),
+    'author': (Author, Author.name, Author.book_count),
+}
+
+
+class Autocomplete:
+    def __init__(self, app, sync_interval: float = 30, rebuild_interval: float = 3600, sync_overlap: float = 300,
+                 batch_size: int = 10000):
+        self.app = app
+        self.sync_interval = sync_interval
+        self.sync_overlap = sync_overlap
+        self.rebuild_interval = rebuild_interval
+        self.batch_size = batch_size
+        self.indexes = {}  # kind -> PrefixIndex, missing while cold
+        self._watermark = None
+        self._thread = None
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._rebuild_requested = False
+        self._pending = {'author': set(), 'book': set()}
+
+    def search(self, kind: str, q: str, limit: int = 10, session=None) -> dict:
+        self.ensure_started()
+        index = self.indexes.get(kind)
+        if index is not None:
+            items, source = index.search(q, limit), 'index'
+        else:
+            items, source = self._search_database(kind, q, limit, session or db.session), 'database'
+        return {
+            'items': [{'id': row_id, 'label': label, 'popularity': popularity} for row_id, label, popularity in items],
+            'source': source,
+        }
+
+    @staticmethod
+    def _search_database(kind, q, limit, session):
+        """
+            Cold path: case insensitive regex on the word starts, split like the index
+            (after anything that is not a letter or a digit). The pg_trgm GIN index
+            serves it on postgres.
+        """
+        model, label, popularity = KINDS[kind]
+        words = NON_WORD.sub(' ', q).replace('_', ' ').split()
+        if not words:
+            return []
+        # (?i) in the pattern, sqlite ignores the flags argument. \W and _ rather than a
+        # bracket, postgres doesn't take \W inside one
+        pattern = r'(?i)(^|\W|_)' + r'(\W|_)+'.join(re.escape(word) for word in words)
+        stmt = select(model.id, label, popularity).where(label.regexp_match(pattern))\
+            .order_by(popularity.desc(), label, model.id).limit(limit)
+        return [tuple(row) for row in session.execute(stmt)]
+
+    # Updates
+
+    def apply_changes(self, changes):
+        """
+            Listener of on_catalog_commit. The deleted rows leave the index right away,
+            the touched ones are reloaded by the background thread (one query per kind),
+            the commit doesn't wait for it.
+        """
+        if not self.indexes:
+            return
+        if changes.bulk:
+            self.request_rebuild()
+            return
+        for kind, deleted in (('author', changes.authors_deleted), ('book', changes.books_deleted)):
+            for row_id in deleted:
+                self.indexes[kind].remove(row_id)
+        links = changes.links | changes.links_deleted
+        with self._lock:
+            self._pending['author'] |= (set(changes.authors) | {a for a, _ in links}) - changes.authors_deleted
+            self._pending['book'] |= (set(changes.books) | {b for _, b in links}) - changes.books_deleted
+        self._wakeup.set()
+
+    def reload_pending(self):
+        with self._lock:
+            pending, self._pending = self._pending, {'author': set(), 'book': set()}
+        with self.app.app_context():
+            for kind, ids in pending.items():
+                index = self.indexes.get(kind)
+                if index is not None and ids:
+                    self._reload(kind, index, list(ids))
+            db.session.remove()
+
+    def _reload(self, kind, index, ids):
+        model, label, popularity = KINDS[kind]
+        found = set()
+        for start in range(0, len(ids), 1000):
+            stmt = select(model.id, label, popularity).where(model.id.in_(ids[start:start + 1000]))
+            for row_id, text, count in db.session.execute(stmt):
+                index.upsert(row_id, text, count)
+                found.add(row_id)
+        for row_id in set(ids) - found:
+            index.remove(row_id)
+
+    def sync(self):
+        """
+            Rows changed by the other workers since the last sync.
+        """
+        watermark = self._watermark
+        self._watermark = self._next_watermark()
+        with self.app.app_context():
+            for kind, (model, label, popularity) in KINDS.items():
+                index = self.indexes.get(kind)
+                if index is None:
+                    continue
+                stmt = select(model.id, label, popularity).where(model.updated_at >= watermark)\
+                    .execution_options(yield_per=self.batch_size)
+                for row_id, text, count in db.session.execute(stmt):
+                    index.upsert(row_id, text, count)
+            db.session.remove()
+
+    def rebuild(self):
+        """
+            Build every index from a streamed scan, then swap them in.
+        """
+        # Before the scan, the rows written during it are synced again
+        watermark = self._next_watermark()
+        started = time.perf_counter()
+        with self.app.app_context():
+            indexes = {}
+            for kind, (model, label, popularity) in KINDS.items():
+                stmt = select(model.id, label, popularity).execution_options(yield_per=self.batch_size)
+                indexes[kind] = PrefixIndex.build(tuple(row) for row in db.session.execute(stmt))
+            db.session.remove()
+        self.indexes = indexes
+        self._watermark = watermark
+        logger.info("Autocomplete index built in %.1fs: %s", time.perf_counter() - started, self.stats())
+
+    def _next_watermark(self):
+        return datetime.now(tz=timezone.utc).replace(tzinfo=None) - timedelta(seconds=self.sync_overlap)
+
+    def request_rebuild(self):
+        self._rebuild_requested = True
+        self._wakeup.set()
+
+    def stats(self) -> dict:
+        return {kind: {'labels': len(index.rows), 'keys': len(index.keys), 'bytes': index.memory_bytes()}
+                for kind, index in self.indexes.items()}
+
+    def metric_lines(self):
+        """
+            Collector of the /metrics endpoint.
+        """
+        from metrics import gauge_lines
+        indexes = list(self.indexes.items())
+        yield from gauge_lines('autocomplete_labels', 'Labels in the autocomplete index.',
+                               [((kind,), len(index.rows)) for kind, index in indexes], ('kind',))
+        yield from gauge_lines('autocomplete_memory_bytes', 'Approximate memory of the autocomplete index.',
+                               [((kind,), index.memory_bytes()) for kind, index in indexes], ('kind',))
+
+    # Background thread
+
+    def ensure_started(self):
+        """
+            Started by the first query or at startup, not by the cli commands.
+        """
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name='autocomplete', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        last_rebuild = last_sync = None
+        while True:
+            try:
+                now = time.monotonic()
+                if last_rebuild is None or self._rebuild_requested or now - last_rebuild >= self.rebuild_interval:
+                    self._rebuild_requested = False
+                    self.rebuild()
+                    last_rebuild = last_sync = time.monotonic()
+                else:
+                    self.reload_pending()
+                    if now - last_sync >= self.sync_interval:
+                        self.sync()
+                        last_sync = now
+            except Exception:
+                logger.exception("Autocomplete index refresh failed")
+            self._wakeup.wait(self.sync_interval)
+            self._wakeup.clear()
@@ -0,0 +1,405 @@
+"""
+    Response cache of the catalog read endpoints, LRU with a size bound and a TTL.
+    Every entry is tagged with the authors and books its body shows (author:<id>,
+    book:<id>) and listings also with list:<kind>. After a commit only the entries of
+    the touched rows are evicted: an author changed evicts its own entry, the lists of
+    authors and every related entry where it appears (the books linked to it); a link
+    evicts the entries of both ends. Bulk writes clear everything.
+
+    Backends:
+    - 'memory': per process, the invalidation only reaches the worker that committed,
+      the others see the change after the TTL. Use it with one worker or a short TTL.
+    - 'file' (default): a sqlite file shared by the workers of the host, every worker
+      sees the evictions. The other hosts see them after the TTL.
+    Every eviction bumps a version kept by the backend (in the file for 'file', so it
+    is shared by the workers). A miss reads it before running the view and the entry
+    is only stored if no eviction happened meanwhile: a body read before another
+    worker's commit is never stored after that commit evicted its tags.
+    A miss read from a lagging replica can store a stale entry, the TTL bounds it.
+"""
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from flask import Response, current_app, request
+from werkzeug.http import unquote_etag
+
+logger = logging.getLogger(__name__)
+# Headers kept with the body, the validators make the cached 304 possible
+KEPT_HEADERS = ('Content-Type', 'ETag', 'Last-Modified', 'Cache-Control')
+
+
+class MemoryBackend:
+    def __init__(self, max_entries: int = 10000):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key -> (expires_at, value, tags)
+        self._tags = {}  # tag -> set of keys
+        self._lock = threading.Lock()
+        self.evictions = 0
+        self._version = 0  # Bumped by every invalidation
+
+    def version(self) -> int:
+        return self._version
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time.time():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, value, tags, ttl, version=None) -> bool:
+        """
+            Store the entry unless an invalidation happened after `version` was read.
+        """
+        with self._lock:
+            if version is not None and version != self._version:
+                return False
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (time.time() + ttl, value, tags)
+            for tag in tags:
+                self._tags.setdefault(tag, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))  # Least recently used
+                self.evictions += 1
+        return True
+
+    def delete_tags(self, tags) -> int:
+        with self._lock:
+            self._version += 1
+            keys = set()
+            for tag in tags:
+                keys.update(self._tags.get(tag, ()))
+            for key in keys:
+                self._remove(key)
+        return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._version += 1
+            self._entries.clear()
+            self._tags.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _remove(self, key):
+        # The caller holds the lock
+        _, _, tags = self._entries.pop(key)
+        for tag in tags:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+
+class FileBackend:
+    """
+        sqlite in WAL mode, one connection per thread. The access time of an entry is
+        written at most once per `touch_interval` seconds to keep the hits read only.
+    """
+    def __init__(self, path: str, max_entries: int = 10000, touch_interval: float = 1):
+        self.path = path
+        self.max_entries = max_entries
+        self.touch_interval = touch_interval
+        self._local = threading.local()
+        self.evictions = 0
+        self._sets = 0
+        self._lock = threading.Lock()  # Counters only, sqlite locks the file
+        conn = self._conn()
+        with conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, value BLOB NOT NULL, "
+                         "expires_at REAL NOT NULL, accessed_at REAL NOT NULL)")
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_entries_accessed_at ON entries (accessed_at)")
+            conn.execute("CREATE TABLE IF NOT EXISTS tags (tag TEXT NOT NULL, key TEXT NOT NULL, "
+                         "PRIMARY KEY (tag, key)) WITHOUT ROWID")
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_tags_key ON tags (key)")
+            conn.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+            conn.execute("INSERT OR IGNORE INTO meta (name, value) VALUES ('version', 0)")
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")  # A lost entry is only a miss
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        conn = self._conn()
+        row = conn.execute("SELECT value, expires_at, accessed_at FROM entries WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        now = time.time()
+        if row[1] <= now:
+            self._delete_keys(conn, [key])
+            return None
+        if now - row[2] >= self.touch_interval:
+            conn.execute("UPDATE entries SET accessed_at = ? WHERE key = ?", (now, key))
+        return json.loads(row[0])
+
+    def version(self) -> int:
+        return self._conn().execute("SELECT value FROM meta WHERE name = 'version'").fetchone()[0]
+
+    @staticmethod
+    def _bump(conn):
+        conn.execute("UPDATE meta SET value = value + 1 WHERE name = 'version'")
+
+    def set(self, key, value, tags, ttl, version=None) -> bool:
+        """
+            Store the entry unless a worker invalidated after `version` was read.
+        """
+        conn = self._conn()
+        now = time.time()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            if version is not None and version != conn.execute(
+                    "SELECT value FROM meta WHERE name = 'version'").fetchone()[0]:
+                return False
+            conn.execute("DELETE FROM tags WHERE key = ?", (key,))
+            conn.execute("INSERT OR REPLACE INTO entries (key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?)",
+                         (key, json.dumps(value), now + ttl, now))
+            conn.executemany("INSERT OR IGNORE INTO tags (tag, key) VALUES (?, ?)", [(tag, key) for tag in tags])
+        with self._lock:
+            self._sets += 1
+            evict = self._sets % 100 == 0
+        if evict:
+            self._evict(conn)
+        return True
+
+    def _evict(self, conn):
+        """
+            Expired entries, then the least recently used ones over the bound.
+        """
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            keys = [row[0] for row in conn.execute("SELECT key FROM entries WHERE expires_at <= ?", (time.time(),))]
+            over = conn.execute("SELECT count(*) FROM entries").fetchone()[0] - len(keys) - self.max_entries
+            if over > 0:
+                keys += [row[0] for row in conn.execute(
+                    "SELECT key FROM entries WHERE expires_at > ? ORDER BY accessed_at LIMIT ?", (time.time(), over))]
+                with self._lock:
+                    self.evictions += over
+            self._delete_keys(conn, keys)
+
+    def delete_tags(self, tags) -> int:
+        conn = self._conn()
+        tags = list(tags)
+        keys = set()
+        with conn:
+            # Read in the write transaction, no entry can be stored in between
+            conn.execute("BEGIN IMMEDIATE")
+            self._bump(conn)
+            for start in range(0, len(tags), 500):
+                chunk = tags[start:start + 500]
+                marks = ','.join('?' * len(chunk))
+                keys.update(row[0] for row in conn.execute(f"SELECT key FROM tags WHERE tag IN ({marks})", chunk))
+            self._delete_keys(conn, list(keys))
+        return len(keys)
+
+    @staticmethod
+    def _delete_keys(conn, keys):
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            marks = ','.join('?' * len(chunk))
+            conn.execute(f"DELETE FROM entries WHERE key IN ({marks})", chunk)
+            conn.execute(f"DELETE FROM tags WHERE key IN ({marks})", chunk)
+
+    def clear(self):
+        conn = self._conn()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            self._bump(conn)
+            conn.execute("DELETE FROM entries")
+            conn.execute("DELETE FROM tags")
+
+    def __len__(self):
+        return self._conn().execute("SELECT count(*) FROM entries").fetchone()[0]
+
+
+def body_tags(kind: str, body) -> set:
+    """
+        author:<id> and book:<id> of every row shown in the body, with the related ones.
+    """
+    other = 'book' if kind == 'author' else 'author'
+    items = body.get('items', []) if isinstance(body, dict) and 'items' in body else [body]
+    tags = set()
+    for item in items:
+        if not isinstance(item, dict) or 'id' not in item:
+            continue
+        tags.add(f'{kind}:{item["id"]}')
+        for related in item.get(f'{other}s') or ():
+            tags.add(f'{other}:{related["id"]}')
+    return tags
+
+
+def change_tags(changes) -> set:
+    """
+        Tags to evict for a CatalogChanges.
+    """
+    tags = set()
+    authors = changes.authors | changes.authors_deleted
+    books = changes.books | changes.books_deleted
+    tags.update(f'author:{author_id}' for author_id in authors)
+    tags.update(f'book:{book_id}' for book_id in books)
+    for author_id, book_id in changes.links | changes.links_deleted:
+        tags.add(f'author:{author_id}')
+        tags.add(f'book:{book_id}')
+    # A row added, removed or renamed moves the pages of its kind
+    if authors:
+        tags.add('list:author')
+    if books:
+        tags.add('list:book')
+    # A link moves the counters, so the order by popularity
+    if changes.links or changes.links_deleted:
+        tags.update(('list:author:popularity', 'list:book:popularity'))
+    return tags
+
+
+class ResponseCache:
+    def __init__(self, backend, ttl: float = 60):
+        self.backend = backend
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._lock = threading.Lock()  # Counters, += is not atomic between threads
+
+    def key(self) -> str:
+        # Same response for every user, the token is checked before the cache
+        args = '&'.join(f'{name}={value}' for name, value in sorted(request.args.items(multi=True)))
+        return f'{request.path}?{args}'
+
+    def invalidate(self, changes):
+        """
+            Listener of on_catalog_commit.
+        """
+        try:
+            if changes.bulk:
+                self.backend.clear()
+                self._count('invalidations')
+                return
+            tags = change_tags(changes)
+            if tags:
+                self._count('invalidations', self.backend.delete_tags(tags))
+        except Exception:
+            # A stale entry lives at most the TTL, don't fail the commit listeners
+            logger.exception("Could not invalidate the catalog cache")
+
+    def lookup(self, key):
+        try:
+            value = self.backend.get(key)
+        except Exception:
+            logger.exception("Catalog cache read failed")
+            value = None
+        self._count('misses' if value is None else 'hits')
+        return value
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + amount)
+
+    def version(self):
+        """
+            Read before running the view, given back to store().
+        """
+        try:
+            return self.backend.version()
+        except Exception:
+            logger.exception("Catalog cache read failed")
+            return None
+
+    def store(self, key, kind: str, list_kind: bool, response, version):
+        body = response.get_data()
+        tags = body_tags(kind, json.loads(body))
+        if list_kind:
+            tags.add(f'list:{kind}')
+            tags.add(f"list:{kind}:{request.args.get('sort', 'created_at')}")
+        headers = [(name, response.headers[name]) for name in KEPT_HEADERS if name in response.headers]
+        try:
+            self.backend.set(key, {'body': body.decode(), 'headers': headers}, tags, self.ttl, version)
+        except Exception:
+            logger.exception("Catalog cache write failed")
+
+    def stats(self) -> dict:
+        with self._lock:
+            hits, misses, invalidations = self.hits, self.misses, self.invalidations
+        lookups = hits + misses
+        return {
+            'hits': hits,
+            'misses': misses,
+            'hit_ratio': hits / lookups if lookups else 0.0,
+            'evictions': self.backend.evictions,
+            'invalidations': invalidations,
+            'entries': len(self.backend),
+        }
+
+    def metric_lines(self):
+        """
+            Collector of the /metrics endpoint.
+        """
+        from metrics import gauge_lines
+        stats = self.stats()
+        for name in ('hits', 'misses', 'evictions', 'invalidations'):
+            yield f'# HELP catalog_cache_{name}_total Catalog response cache {name}.'
+            yield f'# TYPE catalog_cache_{name}_total counter'
+            yield f'catalog_cache_{name}_total {stats[name]}'
+        yield from gauge_lines('catalog_cache_hit_ratio', 'Hits over lookups of this process.', [((), stats['hit_ratio'])])
+        yield from gauge_lines('catalog_cache_entries', 'Entries in the cache.', [((), stats['entries'])])
+
+
+def create_cache(config):
+    """
+        ResponseCache from CATALOG_CACHE_*, None when disabled.
+    """
+    backend = config.get('CATALOG_CACHE_BACKEND', 'file')
+    max_entries = config.get('CATALOG_CACHE_MAX_ENTRIES', 10000)
+    if backend == 'none':
+        return None
+    if backend == 'memory':
+        return ResponseCache(MemoryBackend(max_entries), ttl=config.get('CATALOG_CACHE_TTL', 60))
+    if backend == 'file':
+        return ResponseCache(FileBackend(config.get('CATALOG_CACHE_PATH', '/tmp/author_books_cache.sqlite'),
+                                         max_entries), ttl=config.get('CATALOG_CACHE_TTL', 60))
+    raise ValueError(f"Unknown catalog cache backend {backend}")
+
+
+def cached(kind: str, listing: bool = False):
+    """
+        Serve the GET from the response cache of the app. Put it below jwt_required,
+        the token is checked on every request. If-None-Match is answered from the
+        cached ETag, without the database.
+    """
+    def decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            cache = current_app.catalog_cache
+            if cache is None or request.method != 'GET':
+                return f(*args, **kwargs)
+            key = cache.key()
+            value = cache.lookup(key)
+            if value is not None:
+                headers = dict(value['headers'])
+                etag = headers.get('ETag')
+                if etag and request.if_none_match and request.if_none_match.contains_weak(unquote_etag(etag)[0]):
+                    headers.pop('Content-Type', None)
+                    return Response(status=304, headers=headers)
+                return Response(value['body'], headers=headers)
+            version = cache.version()
+            response = current_app.make_response(f(*args, **kwargs))
+            # Not when a commit (of any worker sharing the backend) invalidated while we were reading
+            if response.status_code == 200 and version is not None:
+                cache.store(key, kind, listing, response, version)
+            return response
+        return wrapper
+    return decorator
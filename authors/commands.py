@@ -0,0 +1,82 @@
+"""
+    Cli commands for the authors schema. Run them with `flask catalog <command>`.
+"""
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from authors.importer import CatalogImporter, read_records, KINDS, FORMATS
+from authors.export import export_chunks, export_lines
+from authors.counters import reconcile_counts
+
+catalog_cli = AppGroup('catalog', help='Manage the authors and books catalog.')
+
+@catalog_cli.command('import')
+@click.argument('kind', type=click.Choice(KINDS))
+@click.argument('file', type=click.File('r', encoding='utf-8'))
+@click.option('--format', 'fmt', type=click.Choice(FORMATS), default=None,
+              help='Format of the file, taken from the extension when missing.')
+@click.option('--chunk-size', type=int, default=None, help='Records per chunk.')
+@click.option('--on-conflict', type=click.Choice(['skip', 'update']), default='skip',
+              help='What to do with books whose slug already exists.')
+def import_catalog(kind, file, fmt, chunk_size, on_conflict):
+    """
+        Import authors, books or links (author-book) from a csv or jsonl FILE.
+    """
+    if fmt is None:
+        fmt = 'csv' if file.name.endswith('.csv') else 'jsonl'
+
+    def progress(report):
+        click.echo(f"chunk {report['chunk']}: {report['rows']} rows, {report['inserted']} inserted, "
+                   f"{report['updated']} updated, {report['skipped']} skipped, {report['failed']} failed")
+        for error in report['errors']:
+            click.echo(f"    line {error['line']}: {error['error']}", err=True)
+
+    importer = CatalogImporter(
+        kind,
+        chunk_size=chunk_size or current_app.config.get('IMPORT_CHUNK_SIZE', 5000),
+        on_conflict=on_conflict,
+        progress=progress,
+    )
+    summary = importer.run(read_records(file, fmt))
+    click.echo(f"Imported {summary['inserted']} of {summary['rows']} {kind}: {summary['updated']} updated, "
+               f"{summary['skipped']} skipped, {summary['failed']} failed in {summary['chunks']} chunks")
+
+@catalog_cli.command('export')
+@click.option('--output', '-o', type=click.File('wb'), default='-', help='File to write, stdout by default.')
+@click.option('--gzip', 'compress', is_flag=True, help='Gzip the output.')
+@click.option('--batch-size', type=int, default=1000, help='Rows fetched per round trip.')
+def export_catalog(output, compress, batch_size):
+    """
+        Export the whole catalog as ndjson: authors with their book ids, then books.
+    """
+    for chunk in export_chunks(export_lines(batch_size), compress):
+        output.write(chunk)
+
+@catalog_cli.command('reconcile-counts')
+@click.option('--dry-run', is_flag=True, help='Only report the drift.')
+@click.option('--chunk-size', type=int, default=10000, help='Rows checked per transaction.')
+def reconcile_link_counts(dry_run, chunk_size):
+    """
+        Repair author.book_count and book.author_count from the links.
+    """
+    drift = reconcile_counts(chunk_size=chunk_size, fix=not dry_run)
+    verb = 'drifted' if dry_run else 'fixed'
+    click.echo(f"{drift['author']} authors and {drift['book']} books {verb}")
+
+@catalog_cli.command('similar-books')
+@click.option('--full', is_flag=True, help='Build everything again instead of the changed books only.')
+@click.option('--batch-size', type=int, default=2048, help='Books compared per matrix product.')
+def build_similar_books(full, batch_size):
+    """
+        Build the similar books file read by the workers, run it from a cron job.
+    """
+    from authors.similar import SimilarityBuilder
+    config = current_app.config
+    builder = SimilarityBuilder(config.get('SIMILAR_BOOKS_PATH', '/tmp/author_books_similar'),
+                                k=config.get('SIMILAR_BOOKS_K', 20),
+                                author_weight=config.get('SIMILAR_BOOKS_AUTHOR_WEIGHT', 0.3),
+                                batch_size=batch_size,
+                                sync_overlap=config.get('CATALOG_SYNC_OVERLAP', 300))
+    report = builder.build() if full else builder.update(config.get('SIMILAR_BOOKS_MAX_CHANGED', 0.2))
+    kind = 'Full build' if report['full'] else f"{report['changed']} changed books"
+    click.echo(f"{kind} of {report['books']} books in {report['seconds']}s")
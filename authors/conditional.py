@@ -0,0 +1,131 @@
+"""
+    Conditional GET for the catalog. The validators (ETag, Last-Modified) come from
+    the ids and updated_at of the rows a response would show, read with a narrow
+    query, so an unchanged resource is answered with a 304 before anything is loaded
+    or serialized. The links of ?related=true are part of the version, a link added
+    or removed doesn't touch updated_at.
+    Lists get weak ETags: their total may be an estimate that moves on its own. An
+    exact total (count=exact, or no estimate on the database) is part of the version,
+    a row added or deleted on another page changes it.
+    asgi.py applies the same validators to the listings it serves natively.
+"""
+import hashlib
+from datetime import timezone
+from flask import Response, request
+from sqlalchemy import select
+from extension import db
+from authors.models import Author, AuthorBook, Book
+from authors.pagination import PageRequest, page_statement, total_count
+
+
+class Version:
+    """
+        Validators of a response.
+    """
+    def __init__(self, etag: str, last_modified, weak: bool = False, total=None):
+        self.etag = etag
+        self.last_modified = last_modified
+        self.weak = weak
+        self.total = total  # (total, is_estimate) of a page, reused by its body
+
+
+def _utc(value):
+    if value is None:
+        return None
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)  # Stored as naive utc
+    return value.astimezone(timezone.utc).replace(microsecond=0)
+
+
+def compute_version(rows, links=(), salt: str = '', weak: bool = False) -> Version:
+    """
+        rows and links are (ids..., updated_at) tuples, the last item is the timestamp.
+    """
+    digest = hashlib.blake2b(salt.encode(), digest_size=16)
+    last_modified = None
+    for group in (rows, links):
+        digest.update(b'|')
+        for row in group:
+            digest.update(repr(tuple(row)).encode())
+            stamp = row[-1]
+            if stamp is not None and (last_modified is None or stamp > last_modified):
+                last_modified = stamp
+    return Version(digest.hexdigest(), _utc(last_modified), weak)
+
+
+def version_columns(model):
+    # The counters too, in case a trigger was bypassed and reconcile-counts didn't run yet
+    counter = model.book_count if model is Author else model.author_count
+    return [model.id, counter, model.updated_at]
+
+
+def links_statement(model, ids):
+    """
+        (id, linked id, linked updated_at) of the related rows, what ?related=true shows.
+    """
+    if model is Author:
+        return select(AuthorBook.author_id, AuthorBook.book_id, Book.updated_at)\
+            .join(Book, Book.id == AuthorBook.book_id).where(AuthorBook.author_id.in_(ids))\
+            .order_by(AuthorBook.author_id, AuthorBook.book_id)
+    return select(AuthorBook.book_id, AuthorBook.author_id, Author.updated_at)\
+        .join(Author, Author.id == AuthorBook.author_id).where(AuthorBook.book_id.in_(ids))\
+        .order_by(AuthorBook.book_id, AuthorBook.author_id)
+
+
+def resource_version(model, row_id: int, related: bool = False, session=None):
+    """
+        Version of one row, None when it doesn't exist.
+    """
+    session = session or db.session
+    row = session.execute(select(*version_columns(model)).where(model.id == row_id)).first()
+    if row is None:
+        return None
+    links = session.execute(links_statement(model, [row_id])).all() if related else ()
+    return compute_version([row], links, salt=f'{model.__tablename__}:{int(related)}')
+
+
+def page_version(model, page: PageRequest, related: bool = False, session=None) -> Version:
+    """
+        Version of a page: the same keyset query as the listing (with its extra row,
+        it decides next_cursor) selecting only id and updated_at, plus the total
+        when it is exact. The total is kept in the version, pass it to the body.
+    """
+    session = session or db.session
+    rows = session.execute(page_statement(model, page, version_columns(model))).all()
+    links = session.execute(links_statement(model, [row[0] for row in rows])).all() if related and rows else ()
+    total, is_estimate = total_count(model, page, session)
+    version = compute_version(rows, links, salt=page_salt(model, page, related, None if is_estimate else total),
+                              weak=True)
+    version.total = (total, is_estimate)
+    return version
+
+
+def page_salt(model, page: PageRequest, related: bool, total: int = None) -> str:
+    # Two pages with the same rows are still different bodies
+    salt = f'{model.__tablename__}:{page.sort}:{page.order}:{page.limit}:{page.cursor}:{int(related)}:{int(page.exact_count)}'
+    return salt if total is None else f'{salt}:{total}'
+
+
+def is_not_modified(version: Version) -> bool:
+    """
+        If-None-Match wins over If-Modified-Since (RFC 9110), weak comparison for GET.
+    """
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(version.etag)
+    # A row deleted from a page doesn't move the date, so lists only trust the ETag
+    if request.if_modified_since and version.last_modified is not None and not version.weak:
+        return version.last_modified <= request.if_modified_since
+    return False
+
+
+def with_validators(response, version: Version):
+    response.set_etag(version.etag, weak=version.weak)
+    if version.last_modified is not None:
+        response.last_modified = version.last_modified
+    # Behind a token, caches must revalidate and not share it
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+def not_modified(version: Version):
+    return with_validators(Response(status=304), version)
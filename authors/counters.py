@@ -0,0 +1,115 @@
+"""
+    Denormalized link counts: author.book_count and book.author_count. They are kept
+    by triggers on authors.author_book, so the ORM, the bulk import and any Core or
+    raw sql write keep them right. A link added or removed also moves updated_at of
+    both ends, their representation (and ETag) changed.
+    On postgres the triggers are per statement with transition tables, a bulk insert
+    of links runs one grouped UPDATE per table instead of one per row.
+    reconcile_counts repairs any drift (rows written with the triggers disabled, a
+    restore, ...): `flask catalog reconcile-counts`.
+"""
+from sqlalchemy import DDL, event, func, select, update
+from extension import db
+
+POSTGRES_TRIGGERS = [
+    """
+    CREATE OR REPLACE FUNCTION authors.author_book_counts() RETURNS trigger LANGUAGE plpgsql AS $body$
+    BEGIN
+        IF TG_OP IN ('DELETE', 'UPDATE') THEN
+            UPDATE authors.author AS a SET book_count = a.book_count - d.n, updated_at = timezone('utc', now())
+            FROM (SELECT author_id, count(*) AS n FROM old_links GROUP BY author_id) AS d WHERE a.id = d.author_id;
+            UPDATE authors.book AS b SET author_count = b.author_count - d.n, updated_at = timezone('utc', now())
+            FROM (SELECT book_id, count(*) AS n FROM old_links GROUP BY book_id) AS d WHERE b.id = d.book_id;
+        END IF;
+        IF TG_OP IN ('INSERT', 'UPDATE') THEN
+            UPDATE authors.author AS a SET book_count = a.book_count + d.n, updated_at = timezone('utc', now())
+            FROM (SELECT author_id, count(*) AS n FROM new_links GROUP BY author_id) AS d WHERE a.id = d.author_id;
+            UPDATE authors.book AS b SET author_count = b.author_count + d.n, updated_at = timezone('utc', now())
+            FROM (SELECT book_id, count(*) AS n FROM new_links GROUP BY book_id) AS d WHERE b.id = d.book_id;
+        END IF;
+        RETURN NULL;
+    END
+    $body$
+    """,
+    # Transition tables need one trigger per event
+    """
+    CREATE TRIGGER author_book_counts_insert AFTER INSERT ON authors.author_book
+    REFERENCING NEW TABLE AS new_links FOR EACH STATEMENT EXECUTE FUNCTION authors.author_book_counts()
+    """,
+    """
+    CREATE TRIGGER author_book_counts_delete AFTER DELETE ON authors.author_book
+    REFERENCING OLD TABLE AS old_links FOR EACH STATEMENT EXECUTE FUNCTION authors.author_book_counts()
+    """,
+    """
+    CREATE TRIGGER author_book_counts_update AFTER UPDATE ON authors.author_book
+    REFERENCING OLD TABLE AS old_links NEW TABLE AS new_links
+    FOR EACH STATEMENT EXECUTE FUNCTION authors.author_book_counts()
+    """,
+]
+
+# sqlite has no schemas nor statement triggers, one update per row
+SQLITE_TRIGGERS = [
+    """
+    CREATE TRIGGER IF NOT EXISTS author_book_counts_insert AFTER INSERT ON author_book BEGIN
+        UPDATE author SET book_count = book_count + 1, updated_at = CURRENT_TIMESTAMP WHERE id = NEW.author_id;
+        UPDATE book SET author_count = author_count + 1, updated_at = CURRENT_TIMESTAMP WHERE id = NEW.book_id;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS author_book_counts_delete AFTER DELETE ON author_book BEGIN
+        UPDATE author SET book_count = book_count - 1, updated_at = CURRENT_TIMESTAMP WHERE id = OLD.author_id;
+        UPDATE book SET author_count = author_count - 1, updated_at = CURRENT_TIMESTAMP WHERE id = OLD.book_id;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS author_book_counts_update AFTER UPDATE OF author_id, book_id ON author_book BEGIN
+        UPDATE author SET book_count = book_count - 1, updated_at = CURRENT_TIMESTAMP WHERE id = OLD.author_id;
+        UPDATE book SET author_count = author_count - 1, updated_at = CURRENT_TIMESTAMP WHERE id = OLD.book_id;
+        UPDATE author SET book_count = book_count + 1, updated_at = CURRENT_TIMESTAMP WHERE id = NEW.author_id;
+        UPDATE book SET author_count = author_count + 1, updated_at = CURRENT_TIMESTAMP WHERE id = NEW.book_id;
+    END
+    """,
+]
+
+
+def install_triggers(table):
+    """
+        Create the triggers with the table in db.create_all(), the databases managed by
+        alembic get them from the migration.
+    """
+    for statement in POSTGRES_TRIGGERS:
+        event.listen(table, 'after_create', DDL(statement).execute_if(dialect='postgresql'))
+    for statement in SQLITE_TRIGGERS:
+        event.listen(table, 'after_create', DDL(statement).execute_if(dialect='sqlite'))
+
+
+def reconcile_counts(session=None, chunk_size: int = 10000, fix: bool = True) -> dict:
+    """
+        Compare the counters with the links, by id ranges of `chunk_size` rows each
+        in its own transaction. Return the rows that drifted per table, fixed unless
+        `fix` is false.
+    """
+    from authors.models import Author, AuthorBook, Book
+    session = session or db.session
+    drift = {}
+    targets = (
+        ('author', Author, Author.book_count, AuthorBook.author_id),
+        ('book', Book, Book.author_count, AuthorBook.book_id),
+    )
+    for name, model, counter, link_column in targets:
+        actual = select(func.count()).where(link_column == model.id).scalar_subquery()
+        last_id = session.scalar(select(func.max(model.id))) or 0
+        drift[name] = 0
+        for start in range(0, last_id + 1, chunk_size):
+            in_range = model.id.between(start, start + chunk_size - 1)
+            if fix:
+                # updated_at moves (onupdate): the validators of the row and the
+                # updated_at syncs of the indexes see the new number
+                stmt = update(model).where(in_range, counter != actual)\
+                    .values({counter: actual})\
+                    .execution_options(synchronize_session=False)
+                drift[name] += session.execute(stmt).rowcount
+                session.commit()
+            else:
+                drift[name] += session.scalar(select(func.count()).where(in_range, counter != actual))
+    return drift
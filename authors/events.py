@@ -0,0 +1,107 @@
+"""
+    Catalog change notifications. The Author, Book and AuthorBook rows touched by a
+    flush are collected on the session and handed to the listeners only after the
+    commit, so a rollback never reaches them. Writes done with Core statements (bulk
+    import, batch links) are recorded by hand with record_changes.
+"""
+import logging
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+logger = logging.getLogger(__name__)
+_listeners = []
+_listening = False
+INFO_KEY = 'catalog_changes'
+
+
+class CatalogChanges:
+    """
+        Ids touched by one transaction. `bulk` means rows were written without
+        knowing their ids, listeners should drop whatever they derived from the tables.
+    """
+    def __init__(self):
+        self.authors = set()
+        self.authors_deleted = set()
+        self.books = set()
+        self.books_deleted = set()
+        self.links = set()  # (author_id, book_id) added
+        self.links_deleted = set()
+        self.bulk = False
+
+    def __bool__(self):
+        return self.bulk or any((self.authors, self.authors_deleted, self.books,
+                                 self.books_deleted, self.links, self.links_deleted))
+
+    def __repr__(self):
+        return (f'<CatalogChanges authors={len(self.authors)}/{len(self.authors_deleted)} '
+                f'books={len(self.books)}/{len(self.books_deleted)} '
+                f'links={len(self.links)}/{len(self.links_deleted)} bulk={self.bulk}>')
+
+
+def on_catalog_commit(fn):
+    """
+        Register fn(changes: CatalogChanges), called after every commit that touched the catalog.
+    """
+    _listeners.append(fn)
+    return fn
+
+
+def pending_changes(session) -> CatalogChanges:
+    if INFO_KEY not in session.info:
+        session.info[INFO_KEY] = CatalogChanges()
+    return session.info[INFO_KEY]
+
+
+def record_changes(session, authors=(), books=(), links=(), links_deleted=(), bulk=False):
+    """
+        For the writes made with Core statements, the ORM doesn't see them.
+    """
+    changes = pending_changes(session)
+    changes.authors.update(authors)
+    changes.books.update(books)
+    changes.links.update(links)
+    changes.links_deleted.update(links_deleted)
+    changes.bulk = changes.bulk or bulk
+
+
+def _after_flush(session, flush_context):
+    from authors.models import Author, Book, AuthorBook
+    changes = None
+    for instances, deleted in ((session.new, False), (session.dirty, False), (session.deleted, True)):
+        for obj in instances:
+            if not isinstance(obj, (Author, Book, AuthorBook)):
+                continue
+            if not deleted and obj in session.dirty and not session.is_modified(obj):
+                continue
+            changes = changes or pending_changes(session)
+            if isinstance(obj, Author):
+                (changes.authors_deleted if deleted else changes.authors).add(obj.id)
+            elif isinstance(obj, Book):
+                (changes.books_deleted if deleted else changes.books).add(obj.id)
+            else:
+                (changes.links_deleted if deleted else changes.links).add((obj.author_id, obj.book_id))
+
+
+def _after_commit(session):
+    changes = session.info.pop(INFO_KEY, None)
+    if not changes:
+        return
+    for listener in _listeners:
+        try:
+            listener(changes)
+        except Exception:
+            logger.exception("Catalog listener %s failed", getattr(listener, '__name__', listener))
+
+
+def _after_rollback(session):
+    session.info.pop(INFO_KEY, None)
+
+
+def init_catalog_events():
+    global _listening
+    if _listening:
+        return
+    event.listen(Session, 'after_flush', _after_flush)
+    event.listen(Session, 'after_commit', _after_commit)
+    event.listen(Session, 'after_rollback', _after_rollback)  # Not called for savepoints
+    _listening = True
@@ -0,0 +1,78 @@
+"""
+    Streaming export of the whole catalog as ndjson. Rows are read from a server
+    side cursor in batches, so the memory stays constant and the first line is sent
+    as soon as the first row arrives, whatever the size of the tables.
+"""
+import zlib
+from sqlalchemy import select
+from extension import db
+from db_routing import read_engine
+from authors.models import Author, Book, AuthorBook
+from fast_json import dumps_line
+
+# Bytes buffered before sending a piece of the body
+CHUNK_BYTES = 64 * 1024
+
+
+def author_lines(conn):
+    """
+        One line per author with the ids of its books inline. The outer join is
+        ordered by author, so the links of an author arrive together.
+    """
+    columns = [Author.id, Author.name, Author.biography, Author.birthdate,
+               Author.created_at, Author.updated_at]
+    keys = [column.key for column in columns]
+    stmt = select(*columns, AuthorBook.book_id)\
+        .outerjoin(AuthorBook, AuthorBook.author_id == Author.id)\
+        .order_by(Author.id, AuthorBook.book_id)
+    current = None
+    for row in conn.execute(stmt):
+        if current is None or current['id'] != row[0]:
+            if current is not None:
+                yield dumps_line(current)
+            current = {'type': 'author', **dict(zip(keys, row)), 'book_ids': []}
+        if row[-1] is not None:
+            current['book_ids'].append(row[-1])
+    if current is not None:
+        yield dumps_line(current)
+
+
+def book_lines(conn):
+    columns = [Book.id, Book.title, Book.description, Book.slug_book,
+               Book.created_at, Book.updated_at]
+    keys = [column.key for column in columns]
+    for row in conn.execute(select(*columns).order_by(Book.id)):
+        yield dumps_line({'type': 'book', **dict(zip(keys, row))})
+
+
+def export_lines(batch_size: int = 1000):
+    """
+        Every ndjson line of the catalog, authors first and then books.
+    """
+    with read_engine(db).connect() as conn:
+        conn = conn.execution_options(stream_results=True, yield_per=batch_size)
+        yield from author_lines(conn)
+        yield from book_lines(conn)
+
+
+def export_chunks(lines, compress: bool = False):
+    """
+        Group the lines in pieces of CHUNK_BYTES, gzip compressed if asked. The first
+        line goes out alone so the client gets the first byte right away.
+    """
+    gzip = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+    buffer, size, first = [], 0, True
+    for line in lines:
+        buffer.append(line)
+        size += len(line)
+        if first or size >= CHUNK_BYTES:
+            data = b''.join(buffer)
+            if gzip is not None:
+                data = gzip.compress(data) + gzip.flush(zlib.Z_SYNC_FLUSH)
+            yield data
+            buffer, size, first = [], 0, False
+    data = b''.join(buffer)
+    if gzip is not None:
+        data = gzip.compress(data) + gzip.flush()
+    if data:
+        yield data
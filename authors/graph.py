@@ -0,0 +1,513 @@
+"""
+    Co-authorship graph in memory. The author_book links are the edges of a bipartite
+    graph (authors on one side, books on the other) kept as two CSR adjacencies in
+    numpy arrays: author -> books and its transpose book -> authors, indexed by the
+    row ids. Two authors are co-authors when they share a book, so a hop is two array
+    gathers and a whole BFS frontier moves at once, no recursive sql.
+
+    The arrays are built from one streamed scan of authors.author_book. The links
+    written afterwards go to a small overlay (pairs added, pairs removed) applied on
+    every gather; compact() merges it into new arrays once it grows. The commits of
+    this worker reach the overlay through the catalog events, the links written by
+    the other workers through the updated_at of their authors and books (the counter
+    triggers move it; each sync reads again the last `sync_overlap` seconds, for the
+    transactions still open at the previous one), and a periodic rebuild starts again
+    from the table.
+"""
+import logging
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import select
+from extension import db
+from authors.models import Author, AuthorBook, Book
+
+try:
+    import numpy as np
+except ImportError:  # Optional, the graph endpoints answer 503 without it
+    np = None
+
+logger = logging.getLogger(__name__)
+AUTHOR, BOOK = 'author', 'book'
+
+
+class GraphUnavailable(Exception):
+    """
+        The graph is not built yet, or numpy (scipy for the components) is missing.
+    """
+
+
+def _keys(authors, books):
+    return (authors.astype(np.int64) << 32) | books.astype(np.int64)
+
+
+def _csr(sources, targets, size):
+    order = np.argsort(_keys(sources, targets))  # By source then target, faster than a lexsort
+    indptr = np.zeros(size + 1, dtype=np.int64)
+    np.cumsum(np.bincount(sources, minlength=size), out=indptr[1:])
+    return indptr, targets[order].astype(np.int32)
+
+
+def _distinct(keys, values, size):
+    """
+        The distinct keys, sorted, with one of their values. A mask over the id space
+        when the keys are many (no sort), np.unique otherwise.
+    """
+    if len(keys) * 16 < size:
+        keys, first = np.unique(keys, return_index=True)
+        return keys, values[first]
+    mapped = np.full(size, -1, dtype=np.int64)
+    mapped[keys] = values
+    keys = np.flatnonzero(mapped >= 0)
+    return keys, mapped[keys]
+
+
+def _gather(indptr, indices, nodes):
+    """
+        (source, target) of every edge of the nodes, vectorized over the slices.
+    """
+    nodes = nodes[nodes < len(indptr) - 1]
+    starts = indptr[nodes]
+    lengths = indptr[nodes + 1] - starts
+    total = int(lengths.sum())
+    if not total:
+        return np.empty(0, dtype=np.int32), np.empty(0, dtype=np.int32)
+    sources = np.repeat(nodes, lengths)
+    offsets = np.arange(total) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    return sources, indices[np.repeat(starts, lengths) + offsets]
+
+
+class CsrGraph:
+    """
+        Adjacencies of both sides plus the overlay of the links changed since the build.
+        Not thread safe, CoauthorGraph serializes the access.
+    """
+    def __init__(self, authors, books):
+        authors, books = np.asarray(authors, dtype=np.int32), np.asarray(books, dtype=np.int32)
+        self.edges = len(authors)
+        self.author_indptr, self.author_books = _csr(authors, books, int(authors.max()) + 1 if len(authors) else 0)
+        self.book_indptr, self.book_authors = _csr(books, authors, int(books.max()) + 1 if len(books) else 0)
+        self.author_size = len(self.author_indptr) - 1
+        self.book_size = len(self.book_indptr) - 1
+        self.added = {AUTHOR: {}, BOOK: {}}  # node -> nodes of the other side
+        self.removed = set()  # author << 32 | book
+        self.journal = None  # Overlay changes during a compaction, list of (method, author, book)
+        self._cache = {}  # Arrays derived from the overlay, and the components
+
+    def _changed(self):
+        self._cache.clear()
+
+    def _removed_keys(self):
+        if 'removed' not in self._cache:
+            self._cache['removed'] = np.fromiter(self.removed, dtype=np.int64, count=len(self.removed))
+        return self._cache['removed']
+
+    def _added_nodes(self, side):
+        if side not in self._cache:
+            self._cache[side] = np.fromiter(self.added[side], dtype=np.int64, count=len(self.added[side]))
+        return self._cache[side]
+
+    @property
+    def overlay_size(self) -> int:
+        return len(self.removed) + sum(len(books) for books in self.added[AUTHOR].values())
+
+    def expand(self, side: str, nodes):
+        """
+            (node, neighbor) pairs of the nodes of one side, overlay applied.
+        """
+        nodes = np.asarray(nodes, dtype=np.int64)
+        if side == AUTHOR:
+            sources, targets = _gather(self.author_indptr, self.author_books, nodes)
+        else:
+            sources, targets = _gather(self.book_indptr, self.book_authors, nodes)
+        if self.removed and len(sources):
+            keys = _keys(sources, targets) if side == AUTHOR else _keys(targets, sources)
+            keep = ~np.isin(keys, self._removed_keys())
+            sources, targets = sources[keep], targets[keep]
+        if self.added[side]:
+            extra = [(node, other) for node in np.intersect1d(nodes, self._added_nodes(side)).tolist()
+                     for other in self.added[side][node]]
+            if extra:
+                extra = np.array(extra, dtype=np.int64)
+                sources = np.concatenate([sources.astype(np.int64), extra[:, 0]])
+                targets = np.concatenate([targets.astype(np.int64), extra[:, 1]])
+        return sources, targets
+
+    def neighbors(self, side: str, node: int) -> set:
+        return set(self.expand(side, [node])[1].tolist())
+
+    def _in_base(self, author_id, book_id) -> bool:
+        if author_id >= len(self.author_indptr) - 1:
+            return False
+        start, end = self.author_indptr[author_id], self.author_indptr[author_id + 1]
+        books = self.author_books[start:end]  # Sorted by the build
+        position = np.searchsorted(books, book_id)
+        return bool(position < len(books) and books[position] == book_id)
+
+    # Overlay
+
+    def link(self, author_id: int, book_id: int):
+        key = author_id << 32 | book_id
+        if key in self.removed:
+            self.removed.discard(key)
+        elif not self._in_base(author_id, book_id):
+            self.added[AUTHOR].setdefault(author_id, set()).add(book_id)
+            self.added[BOOK].setdefault(book_id, set()).add(author_id)
+            self.author_size = max(self.author_size, author_id + 1)
+            self.book_size = max(self.book_size, book_id + 1)
+        self._changed()
+        if self.journal is not None:
+            self.journal.append(('link', author_id, book_id))
+
+    def unlink(self, author_id: int, book_id: int):
+        books = self.added[AUTHOR].get(author_id)
+        if books is not None and book_id in books:
+            books.discard(book_id)
+            self.added[BOOK][book_id].discard(author_id)
+            for side, node in ((AUTHOR, author_id), (BOOK, book_id)):
+                if not self.added[side][node]:
+                    del self.added[side][node]
+        elif self._in_base(author_id, book_id):
+            self.removed.add(author_id << 32 | book_id)
+        self._changed()
+        if self.journal is not None:
+            self.journal.append(('unlink', author_id, book_id))
+
+    def replace(self, side: str, node: int, current: set):
+        """
+            Set the links of one node to `current` (read from the table).
+        """
+        known = self.neighbors(side, node)
+        pair = (lambda other: (node, other)) if side == AUTHOR else (lambda other: (other, node))
+        for other in known - current:
+            self.unlink(*pair(other))
+        for other in current - known:
+            self.link(*pair(other))
+
+    def drop(self, side: str, node: int):
+        self.replace(side, node, set())
+
+    def overlay(self):
+        """
+            Copy of the overlay, for compact() outside of the lock.
+        """
+        return set(self.removed), [(author_id, book_id) for author_id, book_ids in self.added[AUTHOR].items()
+                                   for book_id in book_ids]
+
+    def compact(self, overlay=None) -> 'CsrGraph':
+        """
+            A new graph with the overlay (or a copy taken earlier) merged into the arrays.
+            Only reads the arrays, which never change, when given the copy.
+        """
+        removed, added = overlay or self.overlay()
+        authors = np.repeat(np.arange(len(self.author_indptr) - 1, dtype=np.int32), np.diff(self.author_indptr))
+        books = self.author_books
+        if removed:
+            keep = ~np.isin(_keys(authors, books), np.fromiter(removed, dtype=np.int64, count=len(removed)))
+            authors, books = authors[keep], books[keep]
+        extra = np.array(added, dtype=np.int32).reshape(-1, 2)
+        return CsrGraph(np.concatenate([authors, extra[:, 0]]), np.concatenate([books, extra[:, 1]]))
+
+    # Queries, over authors
+
+    def coauthors(self, author_id: int, limit: int = None) -> list:
+        """
+            [(author id, shared books)], the most shared first.
+        """
+        _, books = self.expand(AUTHOR, [author_id])
+        _, authors = self.expand(BOOK, np.unique(books))
+        ids, shared = np.unique(authors[authors != author_id], return_counts=True)
+        order = np.lexsort((ids, -shared))[:limit]
+        return list(zip(ids[order].tolist(), shared[order].tolist()))
+
+    def _step(self, frontier):
+        """
+            Authors one co-authorship away from the frontier, once each, with the book
+            and the frontier author that reached them.
+        """
+        sources, books = self.expand(AUTHOR, frontier)
+        books, book_sources = _distinct(books, sources, self.book_size)
+        via, reached = self.expand(BOOK, books)
+        reached, via = _distinct(reached, via, self.author_size)
+        return reached, via, book_sources[np.searchsorted(books, via)]
+
+    def k_hop(self, author_id: int, k: int) -> list:
+        """
+            Arrays of the authors first reached at 1..k hops.
+        """
+        if author_id >= self.author_size:
+            return []
+        seen = np.zeros(self.author_size, dtype=bool)
+        seen[author_id] = True
+        frontier, levels = np.array([author_id]), []
+        for _ in range(k):
+            reached = self._step(frontier)[0]
+            reached = reached[~seen[reached]]
+            if not len(reached):
+                break
+            seen[reached] = True
+            levels.append(reached)
+            frontier = reached
+        return levels
+
+    def shortest_path(self, source: int, target: int, max_hops: int):
+        """
+            [(AUTHOR, id), (BOOK, id), (AUTHOR, id), ...] from source to target, None
+            when they are more than max_hops co-authorships apart.
+        """
+        if source == target:
+            return [(AUTHOR, source)]
+        if source >= self.author_size or target >= self.author_size:
+            return None
+        parent = np.full(self.author_size, -1, dtype=np.int64)
+        via = np.full(self.author_size, -1, dtype=np.int64)
+        parent[source] = source
+        frontier = np.array([source])
+        for _ in range(max_hops):
+            reached, books, sources = self._step(frontier)
+            new = parent[reached] < 0
+            reached, books, sources = reached[new], books[new], sources[new]
+            if not len(reached):
+                return None
+            parent[reached], via[reached] = sources, books
+            if parent[target] >= 0:
+                path, node = [(AUTHOR, target)], target
+                while node != source:
+                    path += [(BOOK, int(via[node])), (AUTHOR, int(parent[node]))]
+                    node = int(parent[node])
+                return path[::-1]
+            frontier = reached
+        return None
+
+    def components(self):
+        """
+            (label of every author id, size of every label, sizes of the components
+            with at least one link), cached until the next change.
+        """
+        if 'components' not in self._cache:
+            try:
+                from scipy.sparse import csr_matrix
+                from scipy.sparse.csgraph import connected_components
+            except ImportError:
+                raise GraphUnavailable("The components need scipy")
+            graph = self.compact() if self.overlay_size else self
+            authors, books = len(graph.author_indptr) - 1, len(graph.book_indptr) - 1
+            # One square matrix, author i -> node `authors + book id`
+            indptr = np.concatenate([graph.author_indptr, np.full(books, graph.author_indptr[-1])])
+            matrix = csr_matrix((np.ones(graph.edges, dtype=bool), graph.author_books + authors, indptr),
+                                shape=(authors + books, authors + books))
+            _, labels = connected_components(matrix, directed=True, connection='weak')
+            labels = labels[:authors]
+            # The ids without links (no books, or no such author) are components of their own
+            linked = np.bincount(labels[np.diff(graph.author_indptr) > 0])
+            self._cache['components'] = (labels, np.bincount(labels), linked[linked > 0])
+        return self._cache['components']
+
+    def memory_bytes(self) -> int:
+        return sum(array.nbytes for array in (self.author_indptr, self.author_books,
+                                              self.book_indptr, self.book_authors))
+
+
+class CoauthorGraph:
+    def __init__(self, app, sync_interval: float = 30, rebuild_interval: float = 3600, sync_overlap: float = 300,
+                 compact_after: int = 50000, batch_size: int = 50000):
+        self.app = app
+        self.sync_interval = sync_interval
+        self.sync_overlap = sync_overlap
+        self.rebuild_interval = rebuild_interval
+        self.compact_after = compact_after
+        self.batch_size = batch_size
+        self.graph = None  # CsrGraph, None while cold
+        self._watermark = None
+        self._thread = None
+        self._lock = threading.RLock()
+        self._wakeup = threading.Event()
+        self._rebuild_requested = False
+
+    def _ready(self) -> CsrGraph:
+        if np is None:
+            raise GraphUnavailable("The co-author graph needs numpy")
+        self.ensure_started()
+        if self.graph is None:
+            raise GraphUnavailable("The co-author graph is being built")
+        return self.graph
+
+    # Queries
+
+    def coauthors(self, author_id: int, limit: int) -> dict:
+        with self._lock:
+            pairs = self._ready().coauthors(author_id, limit)
+        return {'author_id': author_id, 'coauthors': [{'id': other, 'shared_books': shared} for other, shared in pairs]}
+
+    def hops(self, author_id: int, k: int, limit: int) -> dict:
+        with self._lock:
+            levels = self._ready().k_hop(author_id, k)
+        return {
+            'author_id': author_id,
+            'count': sum(len(level) for level in levels),
+            'levels': [{'hops': hops, 'count': len(level), 'authors': level[:limit].tolist()}
+                       for hops, level in enumerate(levels, start=1)],
+        }
+
+    def path(self, source: int, target: int, max_hops: int):
+        with self._lock:
+            path = self._ready().shortest_path(source, target, max_hops)
+        if path is None:
+            return None
+        return {'hops': len(path) // 2, 'path': [{'type': kind, 'id': node} for kind, node in path]}
+
+    def components(self, author_id: int = None, limit: int = 10) -> dict:
+        with self._lock:
+            labels, sizes, linked = self._ready().components()
+        body = {'count': int(len(linked)), 'largest': np.sort(linked)[::-1][:limit].tolist()}
+        if author_id is not None:
+            body['author'] = {'id': author_id,
+                              'size': int(sizes[labels[author_id]]) if author_id < len(labels) else 1}
+        return body
+
+    # Updates
+
+    def apply_changes(self, changes):
+        """
+            Listener of on_catalog_commit, the pairs are known: no query.
+        """
+        if self.graph is None:
+            return
+        if changes.bulk:
+            self.request_rebuild()
+            return
+        with self._lock:
+            graph = self.graph
+            for author_id, book_id in changes.links_deleted:
+                graph.unlink(author_id, book_id)
+            for author_id, book_id in changes.links:
+                graph.link(author_id, book_id)
+            # Their links went with them (ON DELETE CASCADE)
+            for author_id in changes.authors_deleted:
+                graph.drop(AUTHOR, author_id)
+            for book_id in changes.books_deleted:
+                graph.drop(BOOK, book_id)
+            if graph.overlay_size >= self.compact_after:
+                self._wakeup.set()
+
+    def sync(self):
+        """
+            Links of the authors and books changed since the last sync, the other
+            workers' writes (a link moves updated_at of both ends, see counters.py).
+        """
+        watermark = self._watermark
+        self._watermark = self._next_watermark()
+        with self.app.app_context():
+            for side, model, column in ((AUTHOR, Author, AuthorBook.author_id), (BOOK, Book, AuthorBook.book_id)):
+                changed = db.session.scalars(select(model.id).where(model.updated_at >= watermark)).all()
+                for start in range(0, len(changed), 1000):
+                    ids = changed[start:start + 1000]
+                    current = {node: set() for node in ids}
+                    other = AuthorBook.book_id if side == AUTHOR else AuthorBook.author_id
+                    for node, linked in db.session.execute(select(column, other).where(column.in_(ids))):
+                        current[node].add(linked)
+                    with self._lock:
+                        for node, linked in current.items():
+                            self.graph.replace(side, node, linked)
+            db.session.remove()
+
+    def rebuild(self):
+        """
+            Arrays from one streamed scan of the links, then swapped in.
+        """
+        watermark = self._next_watermark()
+        started = time.perf_counter()
+        with self.app.app_context():
+            stmt = select(AuthorBook.author_id, AuthorBook.book_id)\
+                .where(AuthorBook.author_id.isnot(None), AuthorBook.book_id.isnot(None))\
+                .execution_options(yield_per=self.batch_size)
+            chunks = [np.array(partition, dtype=np.int32).reshape(-1, 2)
+                      for partition in db.session.execute(stmt).partitions()]
+            db.session.remove()
+        edges = np.concatenate(chunks) if chunks else np.empty((0, 2), dtype=np.int32)
+        graph = CsrGraph(edges[:, 0], edges[:, 1])
+        with self._lock:
+            self.graph = graph
+            self._watermark = watermark
+        logger.info("Co-author graph built in %.1fs: %s", time.perf_counter() - started, self.stats())
+
+    def compact(self):
+        """
+            Merge the overlay into new arrays. The sort runs outside of the lock, the
+            changes made meanwhile are journaled and replayed on the new graph.
+        """
+        with self._lock:
+            graph = self.graph
+            if graph is None or graph.overlay_size < self.compact_after:
+                return
+            overlay = graph.overlay()
+            graph.journal = []
+        try:
+            fresh = graph.compact(overlay)
+            with self._lock:
+                if self.graph is graph:  # Not replaced by a rebuild meanwhile
+                    for method, author_id, book_id in graph.journal:
+                        getattr(fresh, method)(author_id, book_id)
+                    self.graph = fresh
+        finally:
+            graph.journal = None
+
+    def _next_watermark(self):
+        # updated_at is set before the commit, read again the transactions open at the last sync
+        return datetime.now(tz=timezone.utc).replace(tzinfo=None) - timedelta(seconds=self.sync_overlap)
+
+    def request_rebuild(self):
+        self._rebuild_requested = True
+        self._wakeup.set()
+
+    def stats(self) -> dict:
+        graph = self.graph
+        if graph is None:
+            return {}
+        return {'edges': graph.edges, 'overlay': graph.overlay_size, 'bytes': graph.memory_bytes()}
+
+    def metric_lines(self):
+        """
+            Collector of the /metrics endpoint.
+        """
+        from metrics import gauge_lines
+        stats = self.stats()
+        yield from gauge_lines('coauthor_graph_edges', 'Links in the co-author graph arrays.',
+                               [((), stats['edges'])] if stats else [], ())
+        yield from gauge_lines('coauthor_graph_overlay_links', 'Links changed since the last compaction.',
+                               [((), stats['overlay'])] if stats else [], ())
+        yield from gauge_lines('coauthor_graph_memory_bytes', 'Memory of the co-author graph arrays.',
+                               [((), stats['bytes'])] if stats else [], ())
+
+    # Background thread
+
+    def ensure_started(self):
+        """
+            Started by the first query or at startup, not by the cli commands.
+        """
+        if self._thread is not None or np is None:
+            return
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name='coauthor-graph', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        last_rebuild = last_sync = None
+        while True:
+            try:
+                now = time.monotonic()
+                if last_rebuild is None or self._rebuild_requested or now - last_rebuild >= self.rebuild_interval:
+                    self._rebuild_requested = False
+                    self.rebuild()
+                    last_rebuild = last_sync = time.monotonic()
+                else:
+                    self.compact()
+                    if now - last_sync >= self.sync_interval:
+                        self.sync()
+                        last_sync = now
+            except Exception:
+                logger.exception("Co-author graph refresh failed")
+            self._wakeup.wait(self.sync_interval)
+            self._wakeup.clear()
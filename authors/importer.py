@@ -0,0 +1,324 @@
+"""
+    Bulk import of the catalog from csv or jsonl files.
+    Records are streamed, validated and written by chunks, so the memory stays flat
+    whatever the size of the file. Each chunk is written with multi-row INSERTs and
+    committed on its own, a bad chunk doesn't roll back the previous ones.
+"""
+import csv
+import json
+from datetime import datetime
+from sqlalchemy import insert, select
+from extension import db
+from authors.models import Author, Book, get_current_time
+from authors.slugs import allocate_slugs, base_slug
+from authors.events import record_changes
+from authors.links import link_pairs
+
+KINDS = ('authors', 'books', 'links')
+FORMATS = ('csv', 'jsonl')
+# Errors kept per chunk in the report, the rest are only counted
+MAX_ERRORS_PER_CHUNK = 20
+# Errors kept in the summary of the whole import, same
+MAX_ERRORS = 1000
+# New allocations of the slugs taken by a concurrent insert
+SLUG_RETRIES = 3
+
+
+class RowError(ValueError):
+    """
+        A record that can't be imported, the rest of the chunk goes on.
+    """
+
+
+def read_records(stream, fmt: str):
+    """
+        Yield (line_number, record) from a text stream.
+    """
+    if fmt == 'csv':
+        reader = csv.DictReader(stream)
+        for record in reader:
+            yield reader.line_num, record
+    elif fmt == 'jsonl':
+        for line_number, line in enumerate(stream, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield line_number, json.loads(line)
+            except ValueError:
+                yield line_number, RowError("Not valid json")
+    else:
+        raise ValueError(f"Format not valid, use one of {', '.join(FORMATS)}")
+
+
+def dialect_insert(table, session=None):
+    """
+        INSERT with ON CONFLICT support when the database has it.
+    """
+    session = session or db.session
+    name = session.get_bind().dialect.name
+    if name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert as pg_insert
+        return pg_insert(table)
+    if name == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+        return sqlite_insert(table)
+    return insert(table)
+
+
+def _text(record, field, max_length=None, required=False):
+    value = record.get(field)
+    if value is not None and not isinstance(value, str):
+        value = str(value)
+    if value is not None:
+        value = value.strip() or None
+    if value is None and required:
+        raise RowError(f"{field} is required")
+    if value is not None and max_length is not None and len(value) > max_length:
+        raise RowError(f"{field} is longer than {max_length}")
+    return value
+
+
+def _int(record, field):
+    value = record.get(field)
+    if value in (None, ''):
+        return None
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise RowError(f"{field} must be an integer")
+
+
+class CatalogImporter:
+    """
+        Import one kind of record: 'authors', 'books' or 'links' (AuthorBook).
+        - authors: name, biography, birthdate (YYYY-MM-DD)
+        - books: title, description, slug. Books with a slug are upserted on it, the
+          ones without get a new slug allocated from the title and are always inserted.
+        - links: author_id or author (name), book_id or book (slug)
+        `progress` is called with the report of every chunk.
+    """
+    def __init__(self, kind: str, session=None, chunk_size: int = 5000,
+                 on_conflict: str = 'skip', progress=None):
+        if kind not in KINDS:
+            raise ValueError(f"Kind not valid, use one of {', '.join(KINDS)}")
+        if on_conflict not in ('skip', 'update'):
+            raise ValueError("on_conflict must be skip or update")
+        self.kind = kind
+        self.session = session or db.session
+        self.chunk_size = chunk_size
+        self.on_conflict = on_conflict
+        self.progress = progress
+
+    def run(self, records) -> dict:
+        """
+            Import the (line_number, record) pairs, return the summary of the import.
+        """
+        summary = {'kind': self.kind, 'rows': 0, 'inserted': 0, 'updated': 0, 'skipped': 0,
+                   'failed': 0, 'chunks': 0, 'errors': [], 'errors_dropped': 0}
+        chunk = []
+        for item in records:
+            chunk.append(item)
+            if len(chunk) >= self.chunk_size:
+                self._import_chunk(chunk, summary)
+                chunk = []
+        if chunk:
+            self._import_chunk(chunk, summary)
+        return summary
+
+    def _import_chunk(self, chunk, summary):
+        summary['chunks'] += 1
+        report = {'chunk': summary['chunks'], 'rows': len(chunk), 'inserted': 0, 'updated': 0,
+                  'skipped': 0, 'failed': 0, 'errors': []}
+        valid = []
+        for line_number, record in chunk:
+            try:
+                if isinstance(record, RowError):
+                    raise record
+                if not isinstance(record, dict):
+                    raise RowError("Record must be an object")
+                valid.append((line_number, getattr(self, f'_validate_{self.kind}')(record)))
+            except RowError as e:
+                self._fail(report, line_number, e)
+        try:
+            inserted = getattr(self, f'_write_{self.kind}')(valid, report)
+            if inserted:
+                # Core inserts are not seen by the ORM, tell the catalog listeners
+                record_changes(self.session, bulk=True)
+            self.session.commit()
+        except Exception as e:
+            self.session.rollback()
+            report['failed'] = len(chunk)
+            report['errors'].append({'line': None, 'error': f"Chunk not written: {e}"})
+            inserted = report['updated'] = 0
+        report['inserted'] = inserted
+        report['skipped'] = len(chunk) - inserted - report['updated'] - report['failed']
+        for key in ('rows', 'inserted', 'updated', 'skipped', 'failed'):
+            summary[key] += report[key]
+        if report['errors']:
+            kept = sum(len(group['errors']) for group in summary['errors'])
+            errors = report['errors'][:max(0, MAX_ERRORS - kept)]
+            summary['errors_dropped'] += len(report['errors']) - len(errors)
+            if errors:
+                summary['errors'].append({'chunk': report['chunk'], 'failed': report['failed'],
+                                          'errors': errors})
+        if self.progress is not None:
+            self.progress(report)
+
+    @staticmethod
+    def _fail(report, line_number, error):
+        report['failed'] += 1
+        if len(report['errors']) < MAX_ERRORS_PER_CHUNK:
+            report['errors'].append({'line': line_number, 'error': str(error)})
+
+    # Validation, one record at a time
+
+    def _validate_authors(self, record):
+        birthdate = _text(record, 'birthdate')
+        if birthdate is not None:
+            try:
+                birthdate = datetime.strptime(birthdate, "%Y-%m-%d")
+            except ValueError:
+                raise RowError("Not a valid date format is YYYY-MM-DD")
+        return {
+            'name': _text(record, 'name', max_length=100, required=True),
+            'biography': _text(record, 'biography'),
+            'birthdate': birthdate,
+        }
+
+    def _validate_books(self, record):
+        slug = _text(record, 'slug', max_length=200)
+        return {
+            'title': _text(record, 'title', max_length=150, required=True),
+            'description': _text(record, 'description'),
+            'slug_book': base_slug(slug) if slug else None,
+        }
+
+    def _validate_links(self, record):
+        author_id, author = _int(record, 'author_id'), _text(record, 'author')
+        book_id, book = _int(record, 'book_id'), _text(record, 'book')
+        if author_id is None and author is None:
+            raise RowError("author_id or author is required")
+        if book_id is None and book is None:
+            raise RowError("book_id or book is required")
+        return {'author_id': author_id, 'author': author, 'book_id': book_id, 'book': book}
+
+    # Writes, one multi-row statement per chunk
+
+    def _write_authors(self, valid, report):
+        if not valid:
+            return 0
+        now = get_current_time()
+        rows = [dict(row, created_at=now, updated_at=now) for _, row in valid]
+        self.session.execute(insert(Author).values(rows))
+        return len(rows)
+
+    def _write_books(self, valid, report):
+        if not valid:
+            return 0
+        now = get_current_time()
+        given, missing, seen = [], [], set()
+        for line_number, row in valid:
+            row = dict(row, created_at=now, updated_at=now)
+            if row['slug_book'] is None:
+                missing.append((line_number, row))
+            elif row['slug_book'] in seen:
+                self._fail(report, line_number, RowError(f"Duplicated slug {row['slug_book']} in the chunk"))
+            else:
+                seen.add(row['slug_book'])
+                given.append(row)
+        inserted = self._upsert_books(given, report) if given else 0
+        # After the upsert, so the allocation sees the slugs of the file
+        return inserted + (self._insert_new_books(missing, report) if missing else 0)
+
+    def _upsert_books(self, rows, report):
+        """
+            Books with a slug in the file: the slug is the key, on_conflict decides.
+        """
+        stmt = dialect_insert(Book.__table__, self.session).values(rows)
+        if not hasattr(stmt, 'on_conflict_do_nothing'):
+            return self.session.execute(stmt).rowcount
+        if self.on_conflict == 'update':
+            # The rowcount has the updated rows too, the slugs already there are updates
+            slugs = [row['slug_book'] for row in rows]
+            report['updated'] = len(self.session.scalars(select(Book.id).where(Book.slug_book.in_(slugs))).all())
+            stmt = stmt.on_conflict_do_update(
+                index_elements=['slug_book'],
+                set_={'title': stmt.excluded.title, 'description': stmt.excluded.description,
+                      'updated_at': stmt.excluded.updated_at}
+            )
+            return self.session.execute(stmt).rowcount - report['updated']
+        stmt = stmt.on_conflict_do_nothing(index_elements=['slug_book'])
+        return self.session.execute(stmt).rowcount
+
+    def _insert_new_books(self, missing, report):
+        """
+            Books without a slug are always new books (there is nothing to match them on,
+            importing the file twice adds them twice). Their slugs are allocated from the
+            title; a concurrent insert may take one before ours, those rows get a fresh
+            slug and go again, never over the other book.
+        """
+        inserted = 0
+        for attempt in range(SLUG_RETRIES + 1):
+            slugs = allocate_slugs([row['title'] for _, row in missing], self.session)
+            for (_, row), slug in zip(missing, slugs):
+                row['slug_book'] = slug
+            stmt = dialect_insert(Book.__table__, self.session).values([row for _, row in missing])
+            if not hasattr(stmt, 'on_conflict_do_nothing'):
+                return inserted + self.session.execute(stmt).rowcount
+            stmt = stmt.on_conflict_do_nothing(index_elements=['slug_book']).returning(Book.__table__.c.slug_book)
+            written = set(self.session.scalars(stmt))
+            inserted += len(written)
+            missing = [(line_number, row) for line_number, row in missing if row['slug_book'] not in written]
+            if not missing:
+                return inserted
+        for line_number, row in missing:
+            self._fail(report, line_number, RowError(f"No free slug for {row['title']}, try again"))
+        return inserted
+
+    def _write_links(self, valid, report):
+        if not valid:
+            return 0
+        authors = self._resolve(Author, Author.name,
+                                {row['author_id'] for _, row in valid if row['author_id'] is not None},
+                                {row['author'] for _, row in valid if row['author_id'] is None})
+        books = self._resolve(Book, Book.slug_book,
+                              {row['book_id'] for _, row in valid if row['book_id'] is not None},
+                              {row['book'] for _, row in valid if row['book_id'] is None})
+        pairs = {}
+        for line_number, row in valid:
+            try:
+                author_id = self._lookup(authors, row['author_id'], row['author'], 'author')
+                book_id = self._lookup(books, row['book_id'], row['book'], 'book')
+            except RowError as e:
+                self._fail(report, line_number, e)
+                continue
+            pairs.setdefault((author_id, book_id), line_number)
+        # The pairs already linked are skipped by the unique index
+        return len(link_pairs(list(pairs), self.session))
+
+    def _resolve(self, model, key_column, ids, keys):
+        """
+            Map the ids and natural keys of the chunk to ids with one query each.
+            Returns {'ids': set of existing ids, 'keys': {key: [ids]}}.
+        """
+        resolved = {'ids': set(), 'keys': {}}
+        if ids:
+            resolved['ids'] = set(self.session.scalars(select(model.id).where(model.id.in_(ids))))
+        if keys:
+            for row_id, key in self.session.execute(select(model.id, key_column).where(key_column.in_(keys))):
+                resolved['keys'].setdefault(key, []).append(row_id)
+        return resolved
+
+    @staticmethod
+    def _lookup(resolved, row_id, key, name):
+        if row_id is not None:
+            if row_id not in resolved['ids']:
+                raise RowError(f"{name} {row_id} not found")
+            return row_id
+        found = resolved['keys'].get(key, [])
+        if not found:
+            raise RowError(f"{name} {key} not found")
+        if len(found) > 1:
+            raise RowError(f"{name} {key} is ambiguous, use {name}_id")
+        return found[0]
@@ -0,0 +1,71 @@
+"""
+    Set based writes of author-book links. One statement links or unlinks a whole
+    batch: on postgres the pairs travel as two arrays (unnest), so the statement is
+    the same whatever the number of pairs, with INSERT ... ON CONFLICT DO NOTHING
+    over the unique (author_id, book_id) index and DELETE ... USING.
+    Both return the pairs really written, for the catalog events.
+"""
+from sqlalchemy import ARRAY, Integer, bindparam, delete, func, select, tuple_
+from extension import db
+from authors.models import Author, AuthorBook, Book
+
+PAIR_COLUMNS = ['author_id', 'book_id']
+
+
+def _unnest(pairs):
+    authors = [author_id for author_id, _ in pairs]
+    books = [book_id for _, book_id in pairs]
+    return func.unnest(bindparam('author_ids', authors, type_=ARRAY(Integer)),
+                       bindparam('book_ids', books, type_=ARRAY(Integer)))\
+        .table_valued('author_id', 'book_id').render_derived(name='pairs')
+
+
+def existing_pairs(pairs, session=None) -> set:
+    """
+        The pairs whose author and book both exist.
+    """
+    session = session or db.session
+    authors = set(session.scalars(select(Author.id).where(Author.id.in_({a for a, _ in pairs}))))
+    books = set(session.scalars(select(Book.id).where(Book.id.in_({b for _, b in pairs}))))
+    return {(a, b) for a, b in pairs if a in authors and b in books}
+
+
+def link_pairs(pairs, session=None) -> list:
+    """
+        Insert the (author_id, book_id) pairs that are not linked yet, return them.
+        The caller checks that the authors and books exist.
+    """
+    from authors.importer import dialect_insert  # The importer uses this module
+    session = session or db.session
+    pairs = list(dict.fromkeys(pairs))
+    if not pairs:
+        return []
+    table = AuthorBook.__table__
+    returning = (table.c.author_id, table.c.book_id)
+    if session.get_bind().dialect.name == 'postgresql':
+        source = _unnest(pairs)
+        stmt = dialect_insert(table, session)\
+            .from_select(PAIR_COLUMNS, select(source.c.author_id, source.c.book_id))
+    else:
+        stmt = dialect_insert(table, session).values([dict(zip(PAIR_COLUMNS, pair)) for pair in pairs])
+    stmt = stmt.on_conflict_do_nothing(index_elements=PAIR_COLUMNS).returning(*returning)
+    return [tuple(row) for row in session.execute(stmt)]
+
+
+def unlink_pairs(pairs, session=None) -> list:
+    """
+        Delete the links of the pairs, return the ones that existed.
+    """
+    session = session or db.session
+    pairs = list(dict.fromkeys(pairs))
+    if not pairs:
+        return []
+    table = AuthorBook.__table__
+    if session.get_bind().dialect.name == 'postgresql':
+        source = _unnest(pairs)
+        # Rendered as DELETE ... USING unnest(...) AS pairs
+        stmt = delete(table).where(table.c.author_id == source.c.author_id, table.c.book_id == source.c.book_id)
+    else:
+        stmt = delete(table).where(tuple_(table.c.author_id, table.c.book_id).in_(pairs))
+    stmt = stmt.returning(table.c.author_id, table.c.book_id)
+    return [tuple(row) for row in session.execute(stmt)]
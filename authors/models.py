@@ -3,17 +3,24 @@
 """
 # models/authors.py
 from datetime import datetime, timezone
-from slugify import slugify
 from sqlalchemy.ext.associationproxy import association_proxy
+from sqlalchemy.orm import selectinload
 from extension import db
+from authors.slugs import allocate_slug, init_slug_allocation
+from authors.counters import install_triggers
 
 def get_current_time():
     return datetime.now(tz=timezone.utc)
 
 class AuthorBook(db.Model):
     __tablename__ = 'author_book'
-    __table_args__ = {'schema': 'authors'}  # This auxiliary model lives in the authors schema
-    id = db.Column(db.Integer, unique = True,primary_key = True)
+    __table_args__ = (
+        # One link per pair, also serves author -> books; the second one serves book -> authors
+        db.Index('ix_author_book_author_id_book_id', 'author_id', 'book_id', unique=True),
+        db.Index('ix_author_book_book_id', 'book_id'),
+        {'schema': 'authors'}  # This auxiliary model lives in the authors schema
+    )
+    id = db.Column(db.Integer, primary_key = True)
     # Composite primary key from both foreign keys
     author_id = db.Column(db.Integer, db.ForeignKey('authors.author.id', ondelete='CASCADE'))
     book_id = db.Column(db.Integer, db.ForeignKey('authors.book.id', ondelete='CASCADE'))
@@ -31,12 +38,21 @@ class AuthorBook(db.Model):
 
 class Author(db.Model):
     __tablename__ = 'author'
-    __table_args__ = {'schema': 'authors'}
+    __table_args__ = (
+        # Keyset pagination indexes, sort column plus id as tie breaker
+        db.Index('ix_author_created_at_id', 'created_at', 'id'),
+        db.Index('ix_author_name_id', 'name', 'id'),
+        db.Index('ix_author_book_count_id', 'book_count', 'id'),
+        db.Index('ix_author_updated_at', 'updated_at'),
+        {'schema': 'authors'}
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
     biography = db.Column(db.Text)
     birthdate = db.Column(db.DateTime, nullable = True)
+    # Links of the author, kept by the triggers of author_book (authors/counters.py)
+    book_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     # Relationship to the association object
     created_at = db.Column(db.DateTime, default=get_current_time)
     updated_at = db.Column(db.DateTime, default=get_current_time, onupdate=get_current_time)
@@ -49,6 +65,21 @@ class Author(db.Model):
 
     def __repr__(self):
         return f'<Author {self.name}>'
+
+    @staticmethod
+    def related_options():
+        """
+            Loader options for to_dict(related=True): the links and their books are
+            loaded for the whole result in two extra queries, instead of two per author.
+        """
+        return [selectinload(Author.author_books).selectinload(AuthorBook.book)]
+
+    @staticmethod
+    def list_columns():
+        """
+            Columns of to_dict(), to select row tuples instead of instances.
+        """
+        return [Author.id, Author.name, Author.biography, Author.birthdate, Author.book_count]
     
     def to_dict(self, related=False):
         """
@@ -58,7 +89,8 @@ class Author(db.Model):
             'id': self.id,
             'name': self.name,
             'biography': self.biography,
-            'birthdate': self.birthdate
+            'birthdate': self.birthdate,
+            'book_count': self.book_count
         }
         if related:
             resp['books'] = [book.to_dict() for book in self.books]
@@ -66,12 +98,20 @@ class Author(db.Model):
 
 class Book(db.Model):
     __tablename__ = 'book'
-    __table_args__ = {'schema': 'authors'}
+    __table_args__ = (
+        db.Index('ix_book_created_at_id', 'created_at', 'id'),
+        db.Index('ix_book_title_id', 'title', 'id'),
+        db.Index('ix_book_author_count_id', 'author_count', 'id'),
+        db.Index('ix_book_updated_at', 'updated_at'),
+        {'schema': 'authors'}
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(150), nullable=False)
     description = db.Column(db.Text)
     slug_book = db.Column(db.String(200), unique = True, nullable = False)
+    # Links of the book, kept by the triggers of author_book (authors/counters.py)
+    author_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     created_at = db.Column(db.DateTime, default=get_current_time)
     updated_at = db.Column(db.DateTime, default=get_current_time, onupdate=get_current_time)
 
@@ -82,21 +122,33 @@ class Book(db.Model):
                                                         # Look  for the author property.
 
     def __repr__(self):
-        return f'<Book {self.title}> has this amount of authors {len(self.authors)}'
+        return f'<Book {self.title}> has this amount of authors {self.author_count}'
     
     def __init__(self, title, slug:str = None):
         self.title = title
-        self.slug_book = self.generate_unique_slug(slug if slug else title)
+        self.slug_source = slug if slug else title # The slug is allocated from it at the flush
 
     def generate_unique_slug(self, title):
-        base_slug = slugify(title)
-        slug = base_slug
-        counter = 1
-        while Book.query.filter_by(slug_book=slug).first() is not None:
-            slug = f"{base_slug}-{counter}"
-            counter += 1
-        return slug
+        """
+            Next free slug for the title, one query whatever the number of duplicates.
+            The flush does it for the new books (authors.slugs.allocate_pending_slugs).
+        """
+        return allocate_slug(title)
     
+    @staticmethod
+    def related_options():
+        """
+            Loader options for to_dict(add_related=True), two extra queries for the whole result.
+        """
+        return [selectinload(Book.author_books).selectinload(AuthorBook.author)]
+
+    @staticmethod
+    def list_columns():
+        """
+            Columns of to_dict(), to select row tuples instead of instances.
+        """
+        return [Book.id, Book.title, Book.slug_book, Book.created_at, Book.updated_at, Book.author_count]
+
     def to_dict(self, add_related = False):
         """
             Convert a dict for this object.
@@ -106,8 +158,12 @@ class Book(db.Model):
             'title': self.title,
             'slug_book': self.slug_book,
             'created_at': self.created_at,
-            'updated_at': self.updated_at
+            'updated_at': self.updated_at,
+            'author_count': self.author_count
         }
         if add_related:
             resp['authors'] = [author.to_dict() for author in self.authors]
         return resp
+
+install_triggers(AuthorBook.__table__)
+init_slug_allocation()
@@ -0,0 +1,180 @@
+"""
+    Keyset pagination for the catalog listings.
+    Pages are read with `WHERE (sort_column, id) > (last_value, last_id) ORDER BY
+    sort_column, id LIMIT n` over a composite index, so a deep page costs the same
+    as the first one. The position travels in an opaque cursor.
+"""
+import base64
+import json
+from datetime import datetime
+from sqlalchemy import func, select, text, tuple_
+from extension import db
+from fast_json import rows_to_dicts
+
+ORDERS = ('asc', 'desc')
+
+
+class PaginationError(ValueError):
+    """
+        Bad pagination parameters, answered with a 422.
+    """
+
+
+def encode_cursor(sort: str, order: str, value, row_id: int) -> str:
+    if isinstance(value, datetime):
+        value = {'dt': value.isoformat()}
+    raw = json.dumps({'s': sort, 'o': order, 'v': value, 'id': row_id}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str, sort: str, order: str):
+    """
+        Return (value, id) of the last row of the previous page.
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        data = json.loads(raw)
+        value, row_id = data['v'], int(data['id'])
+        if isinstance(value, dict):
+            value = datetime.fromisoformat(value['dt'])
+    except (ValueError, KeyError, TypeError):
+        raise PaginationError("Cursor not valid")
+    if data.get('s') != sort or data.get('o') != order:
+        raise PaginationError("The cursor belongs to another sort, start again without cursor")
+    return value, row_id
+
+
+class PageRequest:
+    """
+        Pagination parameters read from the query string:
+        ?sort=<column>&order=asc|desc&limit=<n>&cursor=<token>&count=exact
+    """
+    def __init__(self, args, sorts: dict, default_sort: str, default_limit: int = 50, max_limit: int = 200):
+        self.sort = args.get('sort', default_sort)
+        if self.sort not in sorts:
+            raise PaginationError(f"Sort not valid, use one of {', '.join(sorts)}")
+        self.order = args.get('order', 'asc')
+        if self.order not in ORDERS:
+            raise PaginationError("Order must be asc or desc")
+        try:
+            self.limit = int(args.get('limit', default_limit))
+        except ValueError:
+            raise PaginationError("Limit must be an integer")
+        if self.limit < 1:
+            raise PaginationError("Limit must be positive")
+        self.limit = min(self.limit, max_limit)  # Capped page size
+        self.cursor = args.get('cursor')
+        self.exact_count = args.get('count') == 'exact'
+        self.column = sorts[self.sort]
+
+
+def page_statement(model, page: PageRequest, entities=None):
+    """
+        SELECT of the page, one extra row to know if there is a next page.
+    """
+    column, id_column = page.column, model.id
+    stmt = select(*(entities or [model]))
+    if page.cursor:
+        value, row_id = decode_cursor(page.cursor, page.sort, page.order)
+        position = tuple_(column, id_column)
+        bound = tuple_(value, row_id)
+        stmt = stmt.where(position > bound if page.order == 'asc' else position < bound)
+    if page.order == 'asc':
+        stmt = stmt.order_by(column.asc(), id_column.asc())
+    else:
+        stmt = stmt.order_by(column.desc(), id_column.desc())
+    return stmt.limit(page.limit + 1)
+
+
+def next_cursor(rows, page: PageRequest, value_of, id_of):
+    """
+        Trim the extra row and return the cursor of the next page or None.
+    """
+    if len(rows) <= page.limit:
+        return rows, None
+    rows = rows[:page.limit]
+    last = rows[-1]
+    return rows, encode_cursor(page.sort, page.order, value_of(last), id_of(last))
+
+
+def estimate_count(model, session=None):
+    """
+        Rows of the table from the planner statistics on postgres (no scan).
+        Return None when there is no estimate.
+    """
+    session = session or db.session
+    if session.get_bind().dialect.name != 'postgresql':
+        return None
+    return valid_estimate(session.execute(estimate_statement(model)).scalar())
+
+
+def estimate_statement(model):
+    table = model.__table__
+    return text("SELECT reltuples::bigint FROM pg_class WHERE oid = CAST(:name AS regclass)")\
+        .bindparams(name=f"{table.schema}.{table.name}")
+
+
+def valid_estimate(estimate):
+    if estimate is None or estimate < 0:  # Never analyzed
+        return None
+    return estimate
+
+
+def count_statement(model):
+    return select(func.count()).select_from(model)
+
+
+def total_count(model, page: PageRequest, session=None):
+    """
+        Return (total, is_estimate). Exact count only when asked with count=exact
+        or when the database has no estimate.
+    """
+    session = session or db.session
+    if not page.exact_count:
+        estimate = estimate_count(model, session)
+        if estimate is not None:
+            return estimate, True
+    return session.execute(count_statement(model)).scalar(), False
+
+
+def paginate(model, page: PageRequest, serialize, session=None, options=None, total=None) -> dict:
+    """
+        Read one page of ORM instances of `model` and build the response body.
+        `options` are loader options, use them to eager load what `serialize` reads.
+        `total` is (total, is_estimate) when already counted (Version.total), else it is counted.
+    """
+    session = session or db.session
+    stmt = page_statement(model, page)
+    if options:
+        stmt = stmt.options(*options)
+    rows = list(session.scalars(stmt))
+    rows, cursor = next_cursor(rows, page, lambda row: getattr(row, page.column.key), lambda row: row.id)
+    return page_body(model, page, [serialize(row) for row in rows], cursor, session, total)
+
+
+def paginate_rows(model, page: PageRequest, columns, session=None, total=None) -> dict:
+    """
+        Fast path of paginate: select only `columns` as row tuples, no ORM instances.
+        The items have the keys of the columns.
+    """
+    session = session or db.session
+    keys = [column.key for column in columns]
+    entities = list(columns)
+    if page.column.key not in keys:
+        entities.append(page.column)  # Needed for the cursor, dropped from the items
+    sort_index = [entity.key for entity in entities].index(page.column.key)
+    id_index = keys.index('id')
+    rows = session.execute(page_statement(model, page, entities)).all()
+    rows, cursor = next_cursor(rows, page, lambda row: row[sort_index], lambda row: row[id_index])
+    return page_body(model, page, rows_to_dicts(keys, rows), cursor, session, total)
+
+
+def page_body(model, page: PageRequest, items, cursor, session, total=None) -> dict:
+    total, is_estimate = total if total is not None else total_count(model, page, session)
+    return {
+        'items': items,
+        'next_cursor': cursor,
+        'limit': page.limit,
+        'total': total,
+        'total_is_estimate': is_estimate,
+    }
@@ -1,8 +1,10 @@
 """
     Router for handle crud of books and authors.
 """
+import io
 from datetime import datetime
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, Response, request, jsonify, current_app, stream_with_context
+from sqlalchemy import select
 from flask_jwt_extended import (
     jwt_required,
     get_jwt_identity,
@@ -10,14 +12,59 @@ from flask_jwt_extended import (
     current_user
 )
 from extension import db
-from authors.models import Author
-author_blueprint = Blueprint('authors', __name__, url_prefix='author-books')
+from authors.models import Author, Book
+from authors.pagination import PageRequest, PaginationError, paginate, paginate_rows
+from authors.importer import CatalogImporter, read_records, KINDS, FORMATS
+from authors.export import export_chunks, export_lines
+from authors.cache import cached
+from authors.events import record_changes
+from authors.links import existing_pairs, link_pairs, unlink_pairs
+from authors.graph import GraphUnavailable
+from authors.similar import SimilarUnavailable
+from authors.conditional import is_not_modified, not_modified, page_version, resource_version, with_validators
+from permissions import admin_required
+from query_budget import query_budget
+from fast_json import listing_response
+from db_routing import read_only
+author_blueprint = Blueprint('authors', __name__, url_prefix='/author-books')
 
-@author_blueprint.routes('author', methods = ['GET', 'POST'])
-@jwt_required
-def handle_authors(self):
+# Columns allowed in ?sort=, each one has an index together with the id.
+# popularity is the number of links, use order=desc for the most linked first
+AUTHOR_SORTS = {'created_at': Author.created_at, 'name': Author.name, 'popularity': Author.book_count}
+BOOK_SORTS = {'created_at': Book.created_at, 'title': Book.title, 'popularity': Book.author_count}
+
+def page_request(sorts, default_sort):
+    """
+        Read the pagination parameters of the request.
+    """
+    return PageRequest(request.args, sorts, default_sort,
+                       default_limit=current_app.config.get('PAGE_SIZE_DEFAULT', 50),
+                       max_limit=current_app.config.get('PAGE_SIZE_MAX', 200))
+
+def search_request():
+    """
+        Read the search parameters: (type, q, limit, cursor). The rank orders the results, no ?sort.
+    """
+    try:
+        limit = int(request.args.get('limit', current_app.config.get('PAGE_SIZE_DEFAULT', 50)))
+    except ValueError:
+        raise PaginationError("Limit must be an integer")
+    if limit < 1:
+        raise PaginationError("Limit must be positive")
+    limit = min(limit, current_app.config.get('PAGE_SIZE_MAX', 200))
+    return request.args.get('type', 'book'), request.args.get('q'), limit, request.args.get('cursor')
+
+@author_blueprint.route('/author', methods = ['GET', 'POST'])
+@query_budget(10)
+@jwt_required()
+@read_only
+@cached('author', listing=True)
+def handle_authors():
     """
-        Create and show list of authors.
+        Create and show list of authors. The list is keyset paginated:
+        ?sort=created_at|name|popularity&order=asc|desc&limit=50&cursor=<next_cursor>&count=exact
+        ?related=true adds the books of each author, eager loaded.
+        Answers 304 to If-None-Match / If-Modified-Since when the page didn't change.
     """
     if request.method == 'POST':
         data = request.get_json()
@@ -37,4 +84,304 @@ def handle_authors(self):
         db.session.commit()
         return jsonify(author.to_dict()), 201
     else:
-        return jsonify("something")
\ No newline at end of file
+        related = request.args.get('related') == 'true'
+        try:
+            page = page_request(AUTHOR_SORTS, 'created_at')
+            version = page_version(Author, page, related)
+            if is_not_modified(version):
+                return not_modified(version)
+            if related:
+                body = paginate(Author, page, lambda author: author.to_dict(related=True),
+                                options=Author.related_options(), total=version.total)
+            else:
+                body = paginate_rows(Author, page, Author.list_columns(), total=version.total)
+        except PaginationError as e:
+            return jsonify(str(e)), 422
+        return with_validators(listing_response(body), version)
+
+@author_blueprint.route('/author/<int:author_id>', methods = ['GET'])
+@query_budget(10)
+@jwt_required()
+@read_only
+@cached('author')
+def get_author(author_id):
+    """
+        One author, ?related=true adds its books. Supports conditional GET.
+    """
+    related = request.args.get('related') == 'true'
+    version = resource_version(Author, author_id, related)
+    if version is None:
+        return jsonify("Author not found"), 404
+    if is_not_modified(version):
+        return not_modified(version)
+    stmt = select(Author).where(Author.id == author_id)
+    if related:
+        stmt = stmt.options(*Author.related_options())
+    author = db.session.scalars(stmt).first()
+    if author is None:
+        return jsonify("Author not found"), 404  # Deleted in between
+    return with_validators(jsonify(author.to_dict(related=related)), version)
+
+@author_blueprint.route('/book', methods = ['GET'])
+@query_budget(10)
+@jwt_required()
+@read_only
+@cached('book', listing=True)
+def list_books():
+    """
+        Show list of books, keyset paginated like the authors.
+        ?related=true adds the authors of each book, eager loaded.
+        Answers 304 to If-None-Match / If-Modified-Since when the page didn't change.
+    """
+    related = request.args.get('related') == 'true'
+    try:
+        page = page_request(BOOK_SORTS, 'created_at')
+        version = page_version(Book, page, related)
+        if is_not_modified(version):
+            return not_modified(version)
+        if related:
+            body = paginate(Book, page, lambda book: book.to_dict(add_related=True),
+                            options=Book.related_options(), total=version.total)
+        else:
+            body = paginate_rows(Book, page, Book.list_columns(), total=version.total)
+    except PaginationError as e:
+        return jsonify(str(e)), 422
+    return with_validators(listing_response(body), version)
+
+@author_blueprint.route('/book/<int:book_id>', methods = ['GET'])
+@query_budget(10)
+@jwt_required()
+@read_only
+@cached('book')
+def get_book(book_id):
+    """
+        One book, ?related=true adds its authors. Supports conditional GET.
+    """
+    related = request.args.get('related') == 'true'
+    version = resource_version(Book, book_id, related)
+    if version is None:
+        return jsonify("Book not found"), 404
+    if is_not_modified(version):
+        return not_modified(version)
+    stmt = select(Book).where(Book.id == book_id)
+    if related:
+        stmt = stmt.options(*Book.related_options())
+    book = db.session.scalars(stmt).first()
+    if book is None:
+        return jsonify("Book not found"), 404  # Deleted in between
+    return with_validators(jsonify(book.to_dict(add_related=related)), version)
+
+def int_arg(name, default, low, high):
+    """
+        Integer query parameter between low and high, ValueError otherwise.
+    """
+    value = request.args.get(name, default)
+    if not str(value).isdigit() or not low <= int(value) <= high:
+        raise ValueError(f"{name} must be an integer between {low} and {high}")
+    return int(value)
+
+def read_pairs(items, field):
+    """
+        [[author_id, book_id], ...] or [{"author_id": .., "book_id": ..}, ...] to a list of int pairs.
+    """
+    pairs = []
+    for item in items or []:
+        if isinstance(item, dict):
+            item = (item.get('author_id'), item.get('book_id'))
+        if not isinstance(item, (list, tuple)) or len(item) != 2 \
+                or not all(isinstance(value, int) and not isinstance(value, bool) for value in item):
+            raise ValueError(f"{field} must be a list of [author_id, book_id] pairs")
+        pairs.append(tuple(item))
+    return pairs
+
+@author_blueprint.route('/links', methods = ['POST'])
+@jwt_required()
+@admin_required
+def batch_links():
+    """
+        Link and unlink many authors and books in one request:
+        {"link": [[author_id, book_id], ...], "unlink": [[author_id, book_id], ...]}
+        One set based statement each, the pairs already linked are skipped.
+    """
+    data = request.get_json(silent=True) or {}
+    try:
+        to_link, to_unlink = read_pairs(data.get('link'), 'link'), read_pairs(data.get('unlink'), 'unlink')
+    except ValueError as e:
+        return jsonify(str(e)), 422
+    limit = current_app.config.get('LINKS_BATCH_MAX', 10000)
+    if len(to_link) + len(to_unlink) > limit:
+        return jsonify(f"At most {limit} pairs per request"), 422
+    valid = existing_pairs(to_link) if to_link else set()
+    missing = [pair for pair in dict.fromkeys(to_link) if pair not in valid]
+    linked = link_pairs([pair for pair in to_link if pair in valid])
+    unlinked = unlink_pairs(to_unlink)
+    # Core statements, the ORM doesn't see them
+    record_changes(db.session, links=linked, links_deleted=unlinked)
+    db.session.commit()
+    return jsonify(
+        linked=len(linked),
+        already_linked=len(valid) - len(linked),
+        unlinked=len(unlinked),
+        not_linked=len(set(to_unlink)) - len(unlinked),
+        not_found=[list(pair) for pair in missing[:100]],
+    ), 200
+
+@author_blueprint.route('/import/<kind>', methods = ['POST'])
+@jwt_required()
+@admin_required
+def import_catalog(kind):
+    """
+        Bulk import of authors, books or links from a csv or jsonl file.
+        The file goes in the multipart field 'file' or as the raw body,
+        ?format=csv|jsonl and ?on_conflict=skip|update for the books.
+    """
+    if kind not in KINDS:
+        return jsonify(f"Kind not valid, use one of {', '.join(KINDS)}"), 422
+    upload = request.files.get('file')
+    fmt = request.args.get('format')
+    if fmt is None:
+        fmt = 'csv' if upload is not None and upload.filename.endswith('.csv') else 'jsonl'
+    if fmt not in FORMATS:
+        return jsonify(f"Format not valid, use one of {', '.join(FORMATS)}"), 422
+    on_conflict = request.args.get('on_conflict', 'skip')
+    if on_conflict not in ('skip', 'update'):
+        return jsonify("on_conflict must be skip or update"), 422
+    raw = upload.stream if upload is not None else request.stream
+    stream = io.TextIOWrapper(raw, encoding='utf-8', newline='')
+    importer = CatalogImporter(kind, chunk_size=current_app.config.get('IMPORT_CHUNK_SIZE', 5000),
+                               on_conflict=on_conflict)
+    summary = importer.run(read_records(stream, fmt))
+    return jsonify(summary), 200
+
+@author_blueprint.route('/export', methods = ['GET'])
+@jwt_required()
+@admin_required
+def export_catalog():
+    """
+        Stream the whole catalog as ndjson, ?gzip=true to compress it.
+    """
+    compress = request.args.get('gzip') == 'true'
+    body = stream_with_context(export_chunks(export_lines(), compress))
+    response = Response(body, mimetype='application/x-ndjson')
+    if compress:
+        response.headers['Content-Encoding'] = 'gzip'
+    return response
+
+@author_blueprint.route('/search', methods = ['GET'])
+@query_budget(10)
+@jwt_required()
+@read_only
+def search_catalog():
+    """
+        Ranked full text search: ?q=<text>&type=author|book&limit=<n>&cursor=<next_cursor>
+    """
+    try:
+        body = current_app.catalog_search.search(*search_request())
+    except PaginationError as e:
+        return jsonify(str(e)), 422
+    return listing_response(body)
+
+@author_blueprint.route('/autocomplete', methods = ['GET'])
+@query_budget(2)
+@jwt_required()
+@read_only
+def autocomplete():
+    """
+        Type-ahead: ?q=<prefix>&type=book|author&limit=<n>, the most linked first.
+    """
+    kind = request.args.get('type', 'book')
+    if kind not in ('book', 'author'):
+        return jsonify("type must be 'book' or 'author'"), 422
+    try:
+        limit = int_arg('limit', 10, 1, current_app.config.get("AUTOCOMPLETE_LIMIT_MAX", 50))
+    except ValueError as e:
+        return jsonify(str(e)), 422
+    return jsonify(current_app.autocomplete.search(kind, request.args.get('q', ''), limit))
+
+@author_blueprint.errorhandler(GraphUnavailable)
+@author_blueprint.errorhandler(SimilarUnavailable)
+def index_not_built(e):
+    """
+        The co-author graph or the similar books are not built yet (or can't be), try again later.
+    """
+    return jsonify(str(e)), 503, {'Retry-After': str(current_app.config.get("GRAPH_RETRY_AFTER", 5))}
+
+# The graph endpoints are served from memory, no sql
+@author_blueprint.route('/graph/author/<int:author_id>/coauthors', methods = ['GET'])
+@jwt_required()
+def coauthors(author_id):
+    """
+        Authors sharing a book with the author, the most shared books first: ?limit=<n>
+    """
+    try:
+        limit = int_arg('limit', 50, 1, current_app.config.get("GRAPH_LIMIT_MAX", 1000))
+    except ValueError as e:
+        return jsonify(str(e)), 422
+    return jsonify(current_app.coauthor_graph.coauthors(author_id, limit))
+
+@author_blueprint.route('/graph/author/<int:author_id>/hops', methods = ['GET'])
+@jwt_required()
+def coauthor_hops(author_id):
+    """
+        Authors within k co-authorships, per distance: ?k=<hops>&limit=<authors per level>
+    """
+    try:
+        k = int_arg('k', 2, 1, current_app.config.get("GRAPH_MAX_HOPS", 3))
+        limit = int_arg('limit', 50, 1, current_app.config.get("GRAPH_LIMIT_MAX", 1000))
+    except ValueError as e:
+        return jsonify(str(e)), 422
+    return jsonify(current_app.coauthor_graph.hops(author_id, k, limit))
+
+@author_blueprint.route('/graph/path', methods = ['GET'])
+@jwt_required()
+def coauthor_path():
+    """
+        Shortest co-authorship chain: ?from=<author_id>&to=<author_id>&max_hops=<n>
+    """
+    max_hops = current_app.config.get("GRAPH_MAX_PATH_HOPS", 6)
+    try:
+        source, target = int_arg('from', None, 0, 2**31 - 1), int_arg('to', None, 0, 2**31 - 1)
+        max_hops = int_arg('max_hops', max_hops, 1, max_hops)
+    except ValueError as e:
+        return jsonify(str(e)), 422
+    body = current_app.coauthor_graph.path(source, target, max_hops)
+    if body is None:
+        return jsonify(f"No path within {max_hops} hops"), 404
+    return jsonify(body)
+
+@author_blueprint.route('/graph/components', methods = ['GET'])
+@jwt_required()
+def coauthor_components():
+    """
+        Connected components of the co-authorship graph: ?limit=<largest sizes>&author_id=<id>
+    """
+    try:
+        limit = int_arg('limit', 10, 1, current_app.config.get("GRAPH_LIMIT_MAX", 1000))
+        author_id = int_arg('author_id', None, 0, 2**31 - 1) if 'author_id' in request.args else None
+    except ValueError as e:
+        return jsonify(str(e)), 422
+    return jsonify(current_app.coauthor_graph.components(author_id, limit))
+
+@author_blueprint.route('/book/<int:book_id>/similar', methods = ['GET'])
+@query_budget(2)
+@jwt_required()
+@read_only
+def similar_books(book_id):
+    """
+        Books with close titles, descriptions and authors, the closest first: ?limit=<n>
+    """
+    try:
+        limit = int_arg('limit', 10, 1, current_app.config.get("SIMILAR_BOOKS_K", 20))
+    except ValueError as e:
+        return jsonify(str(e)), 422
+    neighbors = current_app.similar_books.similar(book_id, limit)
+    # The file may be older than a deletion, only the books still there
+    rows = {row.id: row for row in db.session.execute(
+        select(Book.id, Book.title, Book.slug_book).where(Book.id.in_([other for other, _ in neighbors]))
+    )} if neighbors else {}
+    return jsonify(
+        book_id=book_id,
+        built_at=current_app.similar_books.built_at(),
+        similar=[{'id': other, 'title': rows[other].title, 'slug_book': rows[other].slug_book, 'score': round(score, 4)}
+                 for other, score in neighbors if other in rows],
+    )
@@ -0,0 +1,148 @@
+"""
+    Full text search over authors (name, biography) and books (title, description).
+    On postgres it uses the generated tsvector column `search_vector` and its GIN
+    index. Other databases (sqlite in the tests) use an in memory inverted index with
+    the same api, rebuilt after the catalog changes.
+    Results are ranked and keyset paginated over (rank, id).
+"""
+import re
+import threading
+from sqlalchemy import Double, and_, cast, func, literal_column, or_, select
+from extension import db
+from authors.models import Author, Book
+from authors.pagination import PaginationError, decode_cursor, encode_cursor
+from fast_json import rows_to_dicts
+
+KINDS = {'author': Author, 'book': Book}
+# Text search configuration of the generated columns, see the migration
+SEARCH_CONFIG = 'english'
+# Same weights as the postgres defaults of ts_rank for the A and B labels
+WEIGHT_A, WEIGHT_B = 1.0, 0.4
+TOKEN = re.compile(r'\w+')
+
+
+def _fields(model):
+    """
+        (weight A column, weight B column) of the model.
+    """
+    if model is Author:
+        return Author.name, Author.biography
+    return Book.title, Book.description
+
+
+def _page(rows, keys, limit, kind, q):
+    """
+        rows are (*columns, rank), one more than the limit when there is a next page.
+    """
+    cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        cursor = encode_cursor(f'{kind}:{q}', 'desc', rows[-1][-1], rows[-1][0])
+    items = rows_to_dicts(keys + ['rank'], rows)
+    return {'items': items, 'next_cursor': cursor, 'limit': limit}
+
+
+class PostgresSearch:
+    """
+        websearch_to_tsquery over the GIN indexed search_vector, ranked with ts_rank_cd.
+    """
+    @staticmethod
+    def statement(kind, q, limit, cursor=None):
+        model = KINDS[kind]
+        vector = literal_column('search_vector')
+        query = func.websearch_to_tsquery(SEARCH_CONFIG, q)
+        # ts_rank_cd is a real, the cursor carries a python float: compare both as
+        # double precision or the rows tied with the last one of a page are skipped
+        rank = cast(func.ts_rank_cd(vector, query), Double)
+        stmt = select(*model.list_columns(), rank.label('rank')).where(vector.op('@@')(query))
+        if cursor:
+            last_rank, last_id = decode_cursor(cursor, f'{kind}:{q}', 'desc')
+            stmt = stmt.where(or_(rank < last_rank, and_(rank == last_rank, model.id > last_id)))
+        return stmt.order_by(rank.desc(), model.id.asc()).limit(limit + 1)
+
+    def search(self, kind, q, limit, cursor=None, session=None):
+        session = session or db.session
+        rows = session.execute(self.statement(kind, q, limit, cursor)).all()
+        keys = [column.key for column in KINDS[kind].list_columns()]
+        return _page(rows, keys, limit, kind, q)
+
+
+class InvertedIndexSearch:
+    """
+        Pure python fallback: token -> {id: score} per kind. All the tokens of the
+        query must match (like websearch_to_tsquery), the score is the sum of the
+        weights of the fields where each token appears.
+    """
+    def __init__(self):
+        self._indexes = {}  # kind -> (postings, rows)
+        self._lock = threading.Lock()
+
+    def invalidate(self, changes=None):
+        with self._lock:
+            self._indexes = {}
+
+    def _build(self, kind, session):
+        model = KINDS[kind]
+        field_a, field_b = _fields(model)
+        columns = model.list_columns()
+        postings, rows = {}, {}
+        stmt = select(*columns, field_a, field_b).execution_options(yield_per=1000)
+        for row in session.execute(stmt):
+            row_id = row[0]
+            rows[row_id] = tuple(row[:len(columns)])
+            for text, weight in ((row[-2], WEIGHT_A), (row[-1], WEIGHT_B)):
+                for token in set(tokenize(text)):
+                    scores = postings.setdefault(token, {})
+                    scores[row_id] = scores.get(row_id, 0) + weight
+        return postings, rows
+
+    def _index(self, kind, session):
+        index = self._indexes.get(kind)
+        if index is None:
+            index = self._build(kind, session)
+            with self._lock:
+                self._indexes[kind] = index
+        return index
+
+    def search(self, kind, q, limit, cursor=None, session=None):
+        session = session or db.session
+        postings, rows = self._index(kind, session)
+        tokens = set(tokenize(q))
+        scores = None
+        for token in tokens:
+            matches = postings.get(token, {})
+            if scores is None:
+                scores = dict(matches)
+            else:
+                scores = {row_id: score + matches[row_id] for row_id, score in scores.items() if row_id in matches}
+        ranked = sorted((scores or {}).items(), key=lambda item: (-item[1], item[0]))
+        if cursor:
+            last_rank, last_id = decode_cursor(cursor, f'{kind}:{q}', 'desc')
+            ranked = [(row_id, score) for row_id, score in ranked
+                      if score < last_rank or (score == last_rank and row_id > last_id)]
+        page = [rows[row_id] + (score,) for row_id, score in ranked[:limit + 1]]
+        keys = [column.key for column in KINDS[kind].list_columns()]
+        return _page(page, keys, limit, kind, q)
+
+
+def tokenize(text):
+    return TOKEN.findall(text.lower()) if text else []
+
+
+class CatalogSearch:
+    """
+        Pick the backend from the dialect of the database.
+    """
+    def __init__(self):
+        self.postgres = PostgresSearch()
+        self.fallback = InvertedIndexSearch()
+
+    def search(self, kind, q, limit, cursor=None, session=None):
+        if kind not in KINDS:
+            raise PaginationError(f"Type not valid, use one of {', '.join(KINDS)}")
+        if not q or not q.strip():
+            raise PaginationError("q is required")
+        session = session or db.session
+        if session.get_bind().dialect.name == 'postgresql':
+            return self.postgres.search(kind, q, limit, cursor, session)
+        return self.fallback.search(kind, q, limit, cursor, session)
@@ -0,0 +1,405 @@
+"""
+    "Similar books" from the titles, the descriptions and the shared authors. Every
+    book is a TF-IDF vector (hashed terms, so the columns don't depend on the corpus
+    and a single book can be vectorized again later) and a row of the book x author
+    matrix; both are L2 normalized, the similarity of two books is
+
+        (1 - author_weight) * text cosine + author_weight * author cosine
+
+    The top-k neighbors of every book are computed ahead, by batches of rows with
+    sparse matrix products, and written to one .npy file indexed by the book id:
+    the workers memory map it (the pages are shared by the OS) and reopen it when a
+    build swaps it (os.replace, the old mapping stays valid until it is closed).
+
+    `flask catalog similar-books` builds it, a full build the first time and then
+    only the books whose updated_at moved (a link moves it too, see counters.py)
+    since `sync_overlap` seconds before the previous run: their rows are computed
+    again and merged into the lists of the other books.
+    The matrices are kept next to the file for that.
+"""
+import json
+import logging
+import math
+import os
+import threading
+import time
+import zlib
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import select
+from extension import db
+from authors.models import AuthorBook, Book
+from authors.autocomplete import normalize
+
+try:
+    import numpy as np
+    from scipy import sparse
+except ImportError:  # Optional, the similar books endpoint answers 503 without them
+    np = sparse = None
+
+logger = logging.getLogger(__name__)
+NEIGHBORS_FILE = 'neighbors.npy'
+TEXT_FILE = 'text.npz'
+AUTHORS_FILE = 'authors.npz'
+IDF_FILE = 'idf.npy'
+META_FILE = 'meta.json'
+
+FEATURES = 2 ** 18
+TITLE_WEIGHT = 2  # Title terms count twice
+TERMS_PER_BOOK = 64  # Highest weighted terms kept per book, keeps the products sparse
+MAX_DF = 0.5  # Terms in more books than this fraction carry nothing
+MIN_SCORE = 0.05
+STOP_WORDS = frozenset("""
+    a an and are as at be but by for from has have he her his in is it its of on or
+    she that the their they this to was were which who will with you your
+""".split())
+
+
+class SimilarUnavailable(Exception):
+    """
+        No similar books file yet, or numpy/scipy are missing.
+    """
+
+
+def terms(text: str) -> list:
+    return [word for word in normalize(text).split()
+            if len(word) > 1 and not word.isdigit() and word not in STOP_WORDS]
+
+
+def term_counts(title: str, description: str) -> dict:
+    """
+        {hashed feature: count}, crc32 is stable between processes (hash() is not).
+    """
+    counts = {}
+    for weight, text in ((TITLE_WEIGHT, title), (1, description)):
+        for term in terms(text):
+            feature = zlib.crc32(term.encode()) % FEATURES
+            counts[feature] = counts.get(feature, 0) + weight
+    return counts
+
+
+def top_per_row(matrix, k: int):
+    """
+        The k largest values of every row of a csr matrix, in decreasing order.
+    """
+    matrix = matrix.tocsr()
+    lengths = np.diff(matrix.indptr)
+    rows = np.repeat(np.arange(matrix.shape[0]), lengths)
+    order = np.lexsort((-matrix.data, rows))
+    rank = np.arange(len(order)) - np.repeat(matrix.indptr[:-1], lengths)
+    keep = order[rank < k]
+    indptr = np.concatenate([[0], np.cumsum(np.minimum(lengths, k))])
+    return sparse.csr_matrix((matrix.data[keep], matrix.indices[keep], indptr), shape=matrix.shape)
+
+
+def normalize_rows(matrix):
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+    norms[norms == 0] = 1
+    return sparse.diags(1 / norms) @ matrix
+
+
+def neighbors_dtype(k: int):
+    return np.dtype([('ids', np.int32, (k,)), ('scores', np.float32, (k,))])
+
+
+def _resize(matrix, rows: int, columns: int = None):
+    """
+        csr copy of matrix grown to at least rows x columns.
+    """
+    matrix = matrix.tocsr(copy=True)
+    shape = (max(rows, matrix.shape[0]), max(columns or 0, matrix.shape[1]))
+    if shape != matrix.shape:
+        matrix.resize(shape)
+    return matrix
+
+
+def _replace_rows(matrix, ids, rows):
+    """
+        matrix with the rows `ids` replaced by the rows of `rows`.
+    """
+    keep = np.ones(matrix.shape[0])
+    keep[ids] = 0
+    rows = rows.tocoo()
+    moved = sparse.csr_matrix((rows.data, (ids[rows.row], rows.col)), shape=matrix.shape)
+    return (sparse.diags(keep) @ matrix + moved).tocsr()
+
+
+class SimilarityBuilder:
+    """
+        Builds the files of `path`, see the module doc.
+    """
+    def __init__(self, path: str, k: int = 20, author_weight: float = 0.3, batch_size: int = 2048,
+                 read_batch: int = 10000, sync_overlap: float = 300, session=None):
+        self.path = path
+        self.k = k
+        self.author_weight = author_weight
+        self.batch_size = batch_size
+        self.read_batch = read_batch
+        self.sync_overlap = sync_overlap
+        self.session = session or db.session
+
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    def meta(self):
+        try:
+            with open(self._file(META_FILE)) as fh:
+                return json.load(fh)
+        except (OSError, ValueError):
+            return None
+
+    def _next_watermark(self):
+        # updated_at is set before the commit: the next update reads again the books of
+        # the transactions still open during this run
+        return datetime.now(tz=timezone.utc).replace(tzinfo=None) - timedelta(seconds=self.sync_overlap)
+
+    # Reading the catalog
+
+    def _vectorize(self, stmt):
+        """
+            (book ids, raw term counts csr) of the books of stmt, streamed.
+        """
+        ids, rows, columns, values = [], [], [], []
+        for book_id, title, description in self.session.execute(stmt.execution_options(yield_per=self.read_batch)):
+            counts = term_counts(title, description)
+            rows.extend([len(ids)] * len(counts))
+            columns.extend(counts)
+            values.extend(1 + math.log(count) for count in counts.values())  # Sublinear tf
+            ids.append(book_id)
+        counts = sparse.csr_matrix((np.array(values, dtype=np.float32), (rows, columns)),
+                                   shape=(len(ids), FEATURES))
+        return np.array(ids, dtype=np.int64), counts
+
+    def _text(self, counts, idf):
+        return normalize_rows(top_per_row(counts @ sparse.diags(idf), TERMS_PER_BOOK)).astype(np.float32)
+
+    def _authors(self, book_ids=None):
+        """
+            Normalized book x author matrix, for all the books or some.
+        """
+        stmt = select(AuthorBook.book_id, AuthorBook.author_id)\
+            .where(AuthorBook.book_id.isnot(None), AuthorBook.author_id.isnot(None))
+        pairs = []
+        if book_ids is None:
+            pairs = [tuple(row) for row in self.session.execute(stmt.execution_options(yield_per=self.read_batch))]
+        else:
+            for start in range(0, len(book_ids), 1000):
+                chunk = book_ids[start:start + 1000].tolist()
+                pairs.extend(tuple(row) for row in self.session.execute(stmt.where(AuthorBook.book_id.in_(chunk))))
+        pairs = np.array(pairs, dtype=np.int64).reshape(-1, 2)
+        columns = int(pairs[:, 1].max()) + 1 if len(pairs) else 1
+        matrix = sparse.csr_matrix((np.ones(len(pairs), dtype=np.float32), (pairs[:, 0], pairs[:, 1])),
+                                   shape=(int(pairs[:, 0].max()) + 1 if len(pairs) else 1, columns))
+        return normalize_rows(matrix).astype(np.float32)
+
+    # Similarities
+
+    def _scores(self, text, authors, rows):
+        """
+            Blended similarity of the books `rows` with all the books, self excluded.
+        """
+        scores = text[rows] @ text.T
+        if self.author_weight:
+            scores = (1 - self.author_weight) * scores + self.author_weight * (authors[rows] @ authors.T)
+        scores = scores.tocsr()
+        lengths = np.diff(scores.indptr)
+        scores.data[scores.indices == np.repeat(rows, lengths)] = 0
+        scores.data[scores.data < MIN_SCORE] = 0
+        scores.eliminate_zeros()
+        return scores
+
+    def _write_rows(self, neighbors, rows, top):
+        lengths = np.diff(top.indptr)
+        positions = np.arange(top.nnz) - np.repeat(top.indptr[:-1], lengths)
+        targets = np.repeat(rows, lengths)
+        neighbors['ids'][rows] = -1
+        neighbors['scores'][rows] = 0
+        neighbors['ids'][targets, positions] = top.indices
+        neighbors['scores'][targets, positions] = top.data
+
+    @staticmethod
+    def _aligned(text, authors):
+        # One row per book id in both
+        size = max(text.shape[0], authors.shape[0])
+        return _resize(text, size), _resize(authors, size)
+
+    # Builds
+
+    def build(self) -> dict:
+        """
+            Everything from the tables.
+        """
+        started, watermark = time.perf_counter(), self._next_watermark()
+        ids, counts = self._vectorize(select(Book.id, Book.title, Book.description))
+        df = np.bincount(counts.indices, minlength=FEATURES)
+        idf = (np.log((1 + len(ids)) / (1 + df)) + 1).astype(np.float32)
+        idf[df > MAX_DF * max(len(ids), 1)] = 0
+        rows = self._text(counts, idf)
+        size = int(ids.max()) + 1 if len(ids) else 1
+        text = _replace_rows(sparse.csr_matrix((size, FEATURES), dtype=np.float32), ids, rows)
+        text, authors = self._aligned(text, self._authors())
+        size = text.shape[0]
+
+        os.makedirs(self.path, exist_ok=True)
+        tmp = self._file(f'.{NEIGHBORS_FILE}.{os.getpid()}')
+        neighbors = np.lib.format.open_memmap(tmp, mode='w+', dtype=neighbors_dtype(self.k), shape=(size,))
+        for start in range(0, size, self.batch_size):
+            rows = np.arange(start, min(size, start + self.batch_size))
+            self._write_rows(neighbors, rows, top_per_row(self._scores(text, authors, rows), self.k))
+        return self._publish(neighbors, tmp, text, authors, idf, watermark, started, books=len(ids), full=True)
+
+    def update(self, max_fraction: float = 0.2) -> dict:
+        """
+            Only the books changed since the last build, a full build when there is no
+            build yet or more than max_fraction of the books changed. The lists of the
+            other books lose their entries of the changed books and get the new scores;
+            a list that lost entries isn't refilled from farther books until the next
+            full build.
+        """
+        meta = self.meta()
+        if meta is None or meta.get('k') != self.k or meta.get('author_weight') != self.author_weight:
+            return self.build()
+        started, watermark = time.perf_counter(), self._next_watermark()
+        since = datetime.fromisoformat(meta['watermark'])
+        text = sparse.load_npz(self._file(TEXT_FILE)).tocsr()
+        authors = sparse.load_npz(self._file(AUTHORS_FILE)).tocsr()
+        idf = np.load(self._file(IDF_FILE))
+        current = np.load(self._file(NEIGHBORS_FILE), mmap_mode='r')
+
+        ids, counts = self._vectorize(select(Book.id, Book.title, Book.description).where(Book.updated_at >= since))
+        built = np.flatnonzero(np.diff(text.indptr) > 0)
+        existing = np.array(self.session.scalars(select(Book.id)).all(), dtype=np.int64)
+        deleted = np.setdiff1d(built, existing)
+        if len(ids) + len(deleted) > max_fraction * max(len(existing), 1):
+            return self.build()
+        changed = np.union1d(ids, deleted)
+        size = max(text.shape[0], int(ids.max()) + 1 if len(ids) else 0)
+        text = _replace_rows(_resize(text, size), ids, self._text(counts, idf))
+        text = _replace_rows(text, deleted, sparse.csr_matrix((len(deleted), FEATURES), dtype=np.float32))
+        fresh = self._authors(ids)
+        columns = max(authors.shape[1], fresh.shape[1])
+        authors, fresh = _resize(authors, size, columns), _resize(fresh, size, columns)
+        authors = _replace_rows(authors, changed, fresh[changed])
+        text, authors = self._aligned(text, authors)
+        size = text.shape[0]
+
+        tmp = self._file(f'.{NEIGHBORS_FILE}.{os.getpid()}')
+        neighbors = np.lib.format.open_memmap(tmp, mode='w+', dtype=neighbors_dtype(self.k), shape=(size,))
+        neighbors['ids'] = -1
+        neighbors[:len(current)] = current
+        # The entries of the changed books go, their new scores come back below
+        stale = np.isin(neighbors['ids'], changed)
+        neighbors['ids'][stale], neighbors['scores'][stale] = -1, 0
+        touched = set(np.flatnonzero(stale.any(axis=1)).tolist())
+        others = []
+        for start in range(0, len(changed), self.batch_size):
+            rows = changed[start:start + self.batch_size]
+            scores = self._scores(text, authors, rows)
+            self._write_rows(neighbors, rows, top_per_row(scores, self.k))
+            scores = scores.tocoo()  # Symmetric: the (other book, changed book) scores
+            others.append(sparse.csr_matrix((scores.data, (scores.col, rows[scores.row])), shape=(size, size)))
+        if others:
+            merged = sum(others[1:], others[0]).tocsr()
+            # The rows of the changed books are already written
+            merged = (sparse.diags((~np.isin(np.arange(size), changed)).astype(np.float32)) @ merged).tocsr()
+            merged.eliminate_zeros()
+            touched |= set(np.flatnonzero(np.diff(merged.indptr) > 0).tolist())
+            touched = np.array(sorted(touched), dtype=np.int64)
+            touched = touched[~np.isin(touched, changed)]
+            # Existing list + new candidates of every touched book, top-k again
+            kept = neighbors['ids'][touched] >= 0
+            rows = np.repeat(touched, kept.sum(axis=1))
+            candidates = sparse.csr_matrix(
+                (neighbors['scores'][touched][kept], (rows, neighbors['ids'][touched][kept])), shape=(size, size)
+            ) + merged
+            self._write_rows(neighbors, touched, top_per_row(candidates[touched], self.k))
+        return self._publish(neighbors, tmp, text, authors, idf, watermark, started,
+                             books=int(len(existing)), changed=int(len(changed)), full=False)
+
+    def _publish(self, neighbors, tmp, text, authors, idf, watermark, started, **report):
+        neighbors.flush()
+        del neighbors
+        # The matrices first: a crash between the two leaves a build that update() can redo
+        sparse.save_npz(self._file(f'.{TEXT_FILE}'), text)
+        sparse.save_npz(self._file(f'.{AUTHORS_FILE}'), authors)
+        np.save(self._file(f'.{IDF_FILE}'), idf)
+        for name in (TEXT_FILE, AUTHORS_FILE, IDF_FILE):
+            os.replace(self._file(f'.{name}'), self._file(name))
+        os.replace(tmp, self._file(NEIGHBORS_FILE))
+        report.update(seconds=round(time.perf_counter() - started, 3))
+        meta = {'k': self.k, 'author_weight': self.author_weight, 'watermark': watermark.isoformat(),
+                'built_at': datetime.now(tz=timezone.utc).isoformat(), **report}
+        with open(self._file(f'.{META_FILE}'), 'w') as fh:
+            json.dump(meta, fh)
+        os.replace(self._file(f'.{META_FILE}'), self._file(META_FILE))
+        return meta
+
+
+class SimilarBooks:
+    """
+        Reader of the workers: the neighbors file memory mapped, reopened when a build
+        replaced it (checked at most every `check_interval` seconds).
+    """
+    def __init__(self, path: str, check_interval: float = 5):
+        self.path = path
+        self.check_interval = check_interval
+        self._neighbors = None
+        self._meta = None
+        self._signature = None
+        self._checked = 0.0
+        self._lock = threading.Lock()
+
+    def _current(self):
+        if np is None:
+            raise SimilarUnavailable("Similar books need numpy and scipy")
+        now = time.monotonic()
+        if now - self._checked >= self.check_interval:
+            with self._lock:
+                self._checked = now
+                try:
+                    stat = os.stat(os.path.join(self.path, NEIGHBORS_FILE))
+                except FileNotFoundError:
+                    stat = None
+                signature = (stat.st_ino, stat.st_mtime_ns) if stat else None
+                if signature != self._signature:
+                    self._reopen(signature)
+        if self._neighbors is None:
+            raise SimilarUnavailable("Similar books are not built yet (flask catalog similar-books)")
+        return self._neighbors, self._meta
+
+    def _reopen(self, signature):
+        if signature is None:
+            self._neighbors = self._meta = None
+        else:
+            self._neighbors = np.load(os.path.join(self.path, NEIGHBORS_FILE), mmap_mode='r')
+            try:
+                with open(os.path.join(self.path, META_FILE)) as fh:
+                    self._meta = json.load(fh)
+            except (OSError, ValueError):
+                self._meta = {}
+        self._signature = signature
+
+    def similar(self, book_id: int, limit: int = 10) -> list:
+        """
+            [(book id, score)], the most similar first.
+        """
+        neighbors, _ = self._current()
+        if book_id >= len(neighbors):
+            return []
+        row = neighbors[book_id]
+        found = row['ids'] >= 0
+        return list(zip(row['ids'][found][:limit].tolist(), row['scores'][found][:limit].tolist()))
+
+    def built_at(self):
+        return self._current()[1].get('built_at')
+
+    def metric_lines(self):
+        """
+            Collector of the /metrics endpoint.
+        """
+        from metrics import gauge_lines
+        try:
+            built_at = datetime.fromisoformat(self.built_at())
+            samples = [((), (datetime.now(tz=timezone.utc) - built_at).total_seconds())]
+        except (SimilarUnavailable, TypeError, ValueError):
+            samples = []
+        yield from gauge_lines('similar_books_age_seconds', 'Age of the similar books build.', samples)
@@ -0,0 +1,104 @@
+"""
+    Slug allocation for books. The next free suffix of a slug is found with one
+    prefix query over the unique index of slug_book, instead of one query per
+    candidate. The books added through the ORM get theirs when they are flushed,
+    all the new books of a flush in one query.
+"""
+import re
+from slugify import slugify
+from sqlalchemy import and_, event, or_, select
+from sqlalchemy.orm import Session
+from extension import db
+
+SUFFIX = re.compile(r'^(.*)-(\d+)$')
+# Bases per statement in batch mode, keeps the statement size bounded
+BATCH_SIZE = 1000
+
+
+def base_slug(text: str) -> str:
+    return slugify(text or '') or 'book'
+
+
+def _taken(bases, session):
+    """
+        Return {base: [base_is_taken, taken suffixes]} reading every slug that is the
+        base or base-<n>. `slug_book LIKE 'base-%'` is served by the index on slug_book
+        (ix_book_slug_book_pattern on postgres) and the regex drops on the server the
+        slugs that only start with the base (base-and-more-words).
+    """
+    from authors.models import Book
+    taken = {base: [False, set()] for base in bases}
+    bases = list(taken)
+    for start in range(0, len(bases), BATCH_SIZE):
+        chunk = bases[start:start + BATCH_SIZE]
+        stmt = select(Book.slug_book).where(or_(
+            Book.slug_book.in_(chunk),
+            *[and_(Book.slug_book.like(f'{base}-%'), Book.slug_book.regexp_match(f'^{re.escape(base)}-[0-9]+$'))
+              for base in chunk]
+        ))
+        for slug in session.scalars(stmt):
+            if slug in taken:
+                taken[slug][0] = True
+            match = SUFFIX.match(slug)
+            if match and match.group(1) in taken:
+                taken[match.group(1)][1].add(int(match.group(2)))
+    return taken
+
+
+def _next_suffix(state):
+    """
+        Next suffix after the ones we allocated. They are dense from 1, so only the
+        suffixes up to the number of taken ones count: an unrelated slug like harry-2023
+        (the title "Harry 2023") doesn't push harry to harry-2024.
+    """
+    suffixes = state[1]
+    if len(state) == 2:
+        state.append(max((n for n in suffixes if n <= len(suffixes) + 1), default=0))
+    state[2] += 1
+    while state[2] in suffixes:
+        state[2] += 1
+    suffixes.add(state[2])
+    return state[2]
+
+
+def allocate_slugs(texts, session=None) -> list:
+    """
+        Batch mode: allocate one unique slug per text (title or wanted slug), also unique
+        among themselves. One round trip for up to BATCH_SIZE distinct bases.
+    """
+    session = session or db.session
+    bases = [base_slug(text) for text in texts]
+    taken = _taken(set(bases), session)
+    slugs = []
+    for base in bases:
+        state = taken[base]
+        if not state[0]:
+            state[0] = True
+            slugs.append(base)
+        else:
+            slugs.append(f"{base}-{_next_suffix(state)}")
+    return slugs
+
+
+def allocate_slug(text: str, session=None) -> str:
+    return allocate_slugs([text], session)[0]
+
+
+def allocate_pending_slugs(session, flush_context=None, instances=None):
+    """
+        before_flush: slugs of the new books without one, one query for the whole flush.
+        A concurrent insert of the same slug fails the flush on the unique constraint;
+        the bulk import allocates again and retries (CatalogImporter._insert_new_books).
+    """
+    from authors.models import Book
+    books = [obj for obj in session.new if isinstance(obj, Book) and obj.slug_book is None]
+    if books:
+        with session.no_autoflush:
+            slugs = allocate_slugs([getattr(book, 'slug_source', None) or book.title for book in books], session)
+        for book, slug in zip(books, slugs):
+            book.slug_book = slug
+
+
+def init_slug_allocation():
+    if not event.contains(Session, 'before_flush', allocate_pending_slugs):
+        event.listen(Session, 'before_flush', allocate_pending_slugs)
@@ -0,0 +1,3 @@
+"""
+    Benchmarks, run them from the root of the project: python -m benchmarks.<name>
+"""
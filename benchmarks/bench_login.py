@@ -0,0 +1,66 @@
+"""
+    Latency of the login lookup (User.find_for_login) as the user table grows.
+    It inserts users named bench-user-<n> in the database of DATABASE_URL, use a
+    scratch database. With the unique indexes on the lookup keys the latency must
+    stay flat.
+
+    DATABASE_URL=sqlite:///bench.db python -m benchmarks.bench_login --sizes 1000 10000 100000
+"""
+import argparse
+import random
+import statistics
+import time
+from sqlalchemy import insert
+from app import create_app
+from extension import db
+from admin.models import User, normalize_login
+
+
+def seed_users(start, stop, batch=5000):
+    for first in range(start, stop, batch):
+        rows = []
+        for n in range(first, min(first + batch, stop)):
+            username, email = f"bench-user-{n}", f"Bench-User-{n}@example.com"
+            rows.append({'username': username, 'email': email, 'username_key': normalize_login(username),
+                         'email_key': normalize_login(email), 'first_name': 'Bench', 'last_name': str(n),
+                         'password': None})
+        db.session.execute(insert(User), rows)
+        db.session.commit()
+
+
+def measure(size, lookups):
+    timings = []
+    for _ in range(lookups):
+        n = random.randrange(size)
+        login = f"BENCH-USER-{n}@EXAMPLE.COM" if n % 2 else f"Bench-User-{n}"
+        start = time.perf_counter()
+        user = User.find_for_login(login)
+        timings.append(time.perf_counter() - start)
+        assert user is not None
+        db.session.expunge_all()
+    timings.sort()
+    return statistics.median(timings), timings[int(len(timings) * 0.99) - 1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--lookups', type=int, default=2000)
+    parser.add_argument('--create', action='store_true', help='Create the tables first (scratch sqlite)')
+    args = parser.parse_args()
+
+    app = create_app()
+    with app.app_context():
+        if args.create:
+            db.create_all()
+        seeded = User.query.filter(User.username_key.like('bench-user-%')).count()
+        for size in sorted(args.sizes):
+            if size > seeded:
+                seed_users(seeded, size)
+                seeded = size
+            p50, p99 = measure(size, args.lookups)
+            print(f"{size:>10} users  p50 {p50 * 1e3:7.3f} ms  p99 {p99 * 1e3:7.3f} ms")
+
+
+if __name__ == '__main__':
+    main()
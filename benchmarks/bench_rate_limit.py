@@ -0,0 +1,38 @@
+"""
+    Overhead per request of the rate limit storage: the mmap storage shared by the
+    workers against the in memory storage of limits. A hit of the limiter is one
+    incr plus one get_expiry when it is over the limit.
+
+    python -m benchmarks.bench_rate_limit --keys 10000 --hits 200000
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+from limits.storage import MemoryStorage
+from ratelimit_storage import MmapStorage
+
+
+def measure(storage, keys, hits):
+    names = [f"LIMITER/10.0.{n // 256}.{n % 256}/30/1/minute" for n in range(keys)]
+    start = time.perf_counter()
+    for _ in range(hits):
+        storage.incr(random.choice(names), 60)
+    return (time.perf_counter() - start) / hits
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--keys', type=int, default=10000, help='Distinct clients')
+    parser.add_argument('--hits', type=int, default=200000)
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), 'ratelimit.bin')
+    for name, storage in (('memory', MemoryStorage()), ('mmap', MmapStorage(f'mmap://{path}'))):
+        per_hit = measure(storage, args.keys, args.hits)
+        print(f"{name:<8} {per_hit * 1e6:8.2f} us/incr")
+
+
+if __name__ == '__main__':
+    main()
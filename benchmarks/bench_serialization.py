@@ -0,0 +1,51 @@
+"""
+    Per row cost of the listing serialization: to_dict() of ORM instances through
+    the default jsonify, against row tuples encoded with orjson.
+    No database needed, the rows are built in memory.
+
+    python -m benchmarks.bench_serialization --rows 50 --repeat 2000
+"""
+import argparse
+import timeit
+from datetime import datetime, timezone
+from flask.json.provider import DefaultJSONProvider
+from app import create_app
+from authors.models import Book
+from fast_json import OrjsonProvider, orjson, rows_to_dicts
+
+
+def make_books(count):
+    now = datetime.now(tz=timezone.utc).replace(tzinfo=None)
+    books, rows = [], []
+    for i in range(count):
+        book = Book.__mapper__.class_manager.new_instance()  # Skip __init__, it allocates a slug
+        book.id, book.title, book.slug_book = i, f"Book number {i}", f"book-number-{i}"
+        book.created_at = book.updated_at = now
+        books.append(book)
+        rows.append((book.id, book.title, book.slug_book, book.created_at, book.updated_at))
+    return books, rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, default=50, help='Rows per page')
+    parser.add_argument('--repeat', type=int, default=2000, help='Pages serialized per measure')
+    args = parser.parse_args()
+
+    app = create_app()
+    books, rows = make_books(args.rows)
+    keys = [column.key for column in Book.list_columns()]
+    cases = {'to_dict + default jsonify': (DefaultJSONProvider(app), lambda: [b.to_dict() for b in books])}
+    if orjson is not None:
+        cases['to_dict + orjson'] = (OrjsonProvider(app), lambda: [b.to_dict() for b in books])
+        cases['row tuples + orjson'] = (OrjsonProvider(app), lambda: rows_to_dicts(keys, rows))
+    with app.app_context():
+        for name, (provider, build) in cases.items():
+            seconds = min(timeit.repeat(lambda: provider.response({'items': build()}),
+                                        number=args.repeat, repeat=3))
+            per_row = seconds / (args.repeat * args.rows) * 1e6
+            print(f"{name:<28} {per_row:8.3f} us/row")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+"""
+    Helpers shared by the benchmarks: timing, the app under test and the result files.
+    Every benchmark can save its results as json (--output) to be compared with
+    benchmarks.compare.
+"""
+import json
+import os
+import platform
+import statistics
+import subprocess
+import time
+from datetime import datetime, timezone
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def measure(fn, repeat: int = 1000, warmup: int = 50) -> dict:
+    """
+        Call fn() `repeat` times, latencies in microseconds.
+    """
+    for _ in range(warmup):
+        fn()
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+    return {
+        'calls': repeat,
+        'mean_us': statistics.fmean(timings) * 1e6,
+        'p50_us': percentile(timings, 0.50) * 1e6,
+        'p95_us': percentile(timings, 0.95) * 1e6,
+        'p99_us': percentile(timings, 0.99) * 1e6,
+        'ops_per_sec': repeat / sum(timings) if sum(timings) else 0.0,
+    }
+
+
+def bench_app():
+    """
+        The app of create_app(), configured by the environment like in production
+        (DATABASE_URL=sqlite:///bench.db for a scratch database).
+    """
+    from app import create_app
+    return create_app()
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def save_results(path: str, benchmark: str, results: list, params: dict = None):
+    """
+        results is a list of {'name': ..., <metric>: <number>}, see benchmarks.compare.
+    """
+    document = {
+        'benchmark': benchmark,
+        'created_at': datetime.now(tz=timezone.utc).isoformat(),
+        'git_commit': git_commit(),
+        'python': platform.python_version(),
+        'host': platform.node(),
+        'params': params or {},
+        'results': results,
+    }
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    with open(path, 'w') as fh:
+        json.dump(document, fh, indent=2, default=str)
+    return document
+
+
+def print_results(results: list):
+    for result in results:
+        metrics = '  '.join(f"{key} {value:.2f}" if isinstance(value, float) else f"{key} {value}"
+                            for key, value in result.items() if key != 'name')
+        print(f"{result['name']:<28} {metrics}")
@@ -0,0 +1,62 @@
+"""
+    Compare two result files of the same benchmark and flag the regressions, the
+    exit code is 1 when one metric got worse by more than --threshold percent.
+
+    python -m benchmarks.compare results/base.json results/head.json --threshold 10
+"""
+import argparse
+import json
+import sys
+
+# Metrics where a bigger number is better, the rest are latencies or costs
+HIGHER_IS_BETTER = {'throughput', 'ops_per_sec'}
+IGNORED = {'calls', 'requests', 'concurrency', 'errors', 'throttled'}
+
+
+def load(path):
+    with open(path) as fh:
+        document = json.load(fh)
+    return document, {result['name']: result for result in document['results']}
+
+
+def compare(base, head, threshold):
+    """
+        Rows of (name, metric, base, head, change %, regression).
+    """
+    rows = []
+    for name, result in head.items():
+        if name not in base:
+            continue
+        for metric, value in result.items():
+            old = base[name].get(metric)
+            if metric == 'name' or metric in IGNORED or not isinstance(value, (int, float)) \
+                    or not isinstance(old, (int, float)) or not old:
+                continue
+            change = (value - old) / old * 100
+            worse = -change if metric in HIGHER_IS_BETTER else change
+            rows.append((name, metric, old, value, change, worse > threshold))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('base')
+    parser.add_argument('head')
+    parser.add_argument('--threshold', type=float, default=10, help='Percent of change flagged as regression')
+    args = parser.parse_args()
+
+    base_doc, base = load(args.base)
+    head_doc, head = load(args.head)
+    if base_doc['benchmark'] != head_doc['benchmark']:
+        raise SystemExit(f"Different benchmarks: {base_doc['benchmark']} and {head_doc['benchmark']}")
+    print(f"{base_doc.get('git_commit')} -> {head_doc.get('git_commit')}")
+    regressions = 0
+    for name, metric, old, new, change, regression in compare(base, head, args.threshold):
+        regressions += regression
+        flag = '  REGRESSION' if regression else ''
+        print(f"{name:<28} {metric:<20} {old:12.2f} {new:12.2f} {change:+8.1f}%{flag}")
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
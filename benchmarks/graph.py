@@ -0,0 +1,84 @@
+"""
+    Benchmarks of the co-author graph (authors.graph) at millions of links: the build
+    of the CSR arrays, coauthors, k-hop, shortest path, components, the overlay updates
+    and the compaction. The links are random by default (a few prolific authors, like
+    a real catalog), --database builds the graph from the author_book table of
+    DATABASE_URL instead (seeded with benchmarks.seed).
+
+    python -m benchmarks.graph --edges 5000000 --output results/graph.json
+"""
+import argparse
+import time
+import numpy as np
+from authors.graph import CoauthorGraph, CsrGraph
+from benchmarks.common import bench_app, measure, print_results, save_results
+
+
+def random_links(authors: int, books: int, edges: int, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    # Pareto author ids: most authors have one or two books, a few have thousands
+    author_ids = (rng.pareto(1.2, edges) * 1000).astype(np.int64) % authors
+    book_ids = rng.integers(0, books, edges)
+    pairs = np.unique((author_ids << 32) | book_ids)
+    return (pairs >> 32).astype(np.int32), (pairs & 0xffffffff).astype(np.int32)
+
+
+def timed(name, fn):
+    start = time.perf_counter()
+    value = fn()
+    return value, {'name': name, 'seconds': time.perf_counter() - start}
+
+
+def bench_graph(graph: CsrGraph, repeat: int, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    linked = np.flatnonzero(np.diff(graph.author_indptr) > 0)
+    sample = rng.choice(linked, size=min(len(linked), 1000))
+    authors = iter(np.resize(sample, repeat * 2 + 200).tolist())
+    results = [
+        {'name': 'graph.coauthors', **measure(lambda: graph.coauthors(next(authors), 50), repeat)},
+        {'name': 'graph.k_hop.2', **measure(lambda: graph.k_hop(next(authors), 2), max(1, repeat // 10), 5)},
+        {'name': 'graph.shortest_path.6', **measure(
+            lambda: graph.shortest_path(next(authors), next(authors), 6), max(1, repeat // 10), 5)},
+    ]
+    _, result = timed('graph.components', graph.components)
+    results.append(result)
+
+    # Overlay: link then unlink random pairs, then merge a full overlay
+    books = graph.book_size
+    pairs = iter(zip(rng.choice(linked, size=repeat * 2 + 100).tolist(),
+                     rng.integers(0, books, size=repeat * 2 + 100).tolist()))
+    results.append({'name': 'graph.link', **measure(lambda: graph.link(*next(pairs)), repeat)})
+    results.append({'name': 'graph.coauthors.overlay', **measure(lambda: graph.coauthors(next(authors), 50), repeat)})
+    _, result = timed('graph.compact', graph.compact)
+    results.append({**result, 'overlay': graph.overlay_size})
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--authors', type=int, default=1_000_000)
+    parser.add_argument('--books', type=int, default=2_000_000)
+    parser.add_argument('--edges', type=int, default=5_000_000)
+    parser.add_argument('--database', action='store_true', help='Build from the author_book table of DATABASE_URL')
+    parser.add_argument('--repeat', type=int, default=1000)
+    parser.add_argument('--output', help='Save the results as json')
+    args = parser.parse_args()
+
+    if args.database:
+        service = CoauthorGraph(bench_app())
+        _, build = timed('graph.build.database', service.rebuild)
+        graph = service.graph
+    else:
+        authors, books = random_links(args.authors, args.books, args.edges)
+        graph, build = timed('graph.build', lambda: CsrGraph(authors, books))
+    results = [{**build, 'edges': graph.edges, 'bytes': graph.memory_bytes()}] + bench_graph(graph, args.repeat)
+    print_results(results)
+    if args.output:
+        params = {'repeat': args.repeat, 'database': args.database, 'edges': graph.edges}
+        if not args.database:
+            params.update(authors=args.authors, books=args.books)
+        save_results(args.output, 'graph', results, params)
+
+
+if __name__ == '__main__':
+    main()
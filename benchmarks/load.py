@@ -0,0 +1,177 @@
+"""
+    Concurrent HTTP load driver. Every target is hit by `--concurrency` threads for
+    `--duration` seconds and reports latency percentiles, throughput and the sql
+    statements per request (X-SQL-Statements header, start the server with
+    SQL_COUNT_HEADER=True and RATELIMIT_ENABLED=False).
+
+    A target is name=url or a scenario of the api with --base-url:
+    - login: POST /auth/login with the bench user of benchmarks.seed
+    - refresh: POST /auth/refresh, each thread rotates its own refresh token
+    - authors, books: first page of the listings
+    - who-i-am: GET /auth/who-i-am
+
+    python -m benchmarks.load --base-url http://localhost:8000 --concurrency 50 login refresh authors
+    python -m benchmarks.load --token <access token> --concurrency 200 \\
+        sync=http://localhost:8000/author-books/author asgi=http://localhost:8001/author-books/author
+"""
+import argparse
+import json
+import threading
+import time
+import urllib.error
+import urllib.request
+from benchmarks.common import percentile, print_results, save_results
+from benchmarks.seed import BENCH_PASSWORD, BENCH_USER
+
+SQL_HEADER = 'X-SQL-Statements'
+
+
+def call(url, method='GET', body=None, token=None, timeout=30):
+    """
+        (status, json body or None, sql statements or None)
+    """
+    headers = {'Content-Type': 'application/json'}
+    if token:
+        headers['Authorization'] = f'Bearer {token}'
+    data = json.dumps(body).encode() if body is not None else None
+    request = urllib.request.Request(url, data=data, headers=headers, method=method)
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            status, payload, sql = response.status, response.read(), response.headers.get(SQL_HEADER)
+    except urllib.error.HTTPError as e:
+        status, payload, sql = e.code, e.read(), e.headers.get(SQL_HEADER)
+    try:
+        payload = json.loads(payload) if payload else None
+    except ValueError:
+        payload = None
+    return status, payload, int(sql) if sql is not None else None
+
+
+def login(base_url):
+    status, payload, _ = call(f'{base_url}/auth/login', 'POST', {'username': BENCH_USER, 'password': BENCH_PASSWORD})
+    if status != 200:
+        raise SystemExit(f"Could not log in the bench user ({status}), run benchmarks.seed first")
+    return payload
+
+
+class Scenario:
+    """
+        One request of the scenario per call of run(state), `state` is per thread.
+    """
+    def __init__(self, name, path, method='GET', needs_login=True):
+        self.name, self.path, self.method, self.needs_login = name, path, method, needs_login
+
+    def setup(self, base_url, token=None):
+        state = {'access_token': token}
+        if self.needs_login and not token:
+            state.update(login(base_url))
+        return state
+
+    def run(self, base_url, state):
+        return call(f'{base_url}{self.path}', self.method, token=state.get('access_token'))
+
+
+class LoginScenario(Scenario):
+    def run(self, base_url, state):
+        return call(f'{base_url}{self.path}', 'POST', {'username': BENCH_USER, 'password': BENCH_PASSWORD})
+
+
+class RefreshScenario(Scenario):
+    def run(self, base_url, state):
+        # The used refresh token is revoked, continue with the new one
+        status, payload, sql = call(f'{base_url}{self.path}', 'POST', token=state['refresh_token'])
+        if status == 200:
+            state.update(payload)
+        return status, payload, sql
+
+
+SCENARIOS = {
+    'login': LoginScenario('login', '/auth/login', 'POST', needs_login=False),
+    'refresh': RefreshScenario('refresh', '/auth/refresh', 'POST'),
+    'authors': Scenario('authors', '/author-books/author'),
+    'books': Scenario('books', '/author-books/book'),
+    'who-i-am': Scenario('who-i-am', '/auth/who-i-am'),
+}
+
+
+def run_load(scenario, base_url, concurrency, duration, token=None):
+    """
+        Run the scenario from `concurrency` threads, return the summary of the run.
+    """
+    latencies, statements, lock = [], [], threading.Lock()
+    counts = {'errors': 0, 'throttled': 0}
+    states = [scenario.setup(base_url, token) for _ in range(concurrency)]
+    deadline = time.perf_counter() + duration
+
+    def worker(state):
+        local, sql_counts, errors, throttled = [], [], 0, 0
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            try:
+                status, _, sql = scenario.run(base_url, state)
+            except (urllib.error.URLError, OSError):
+                errors += 1
+                continue
+            if status == 429:
+                throttled += 1
+                continue
+            if status >= 400:
+                errors += 1
+                continue
+            local.append(time.perf_counter() - start)
+            if sql is not None:
+                sql_counts.append(sql)
+        with lock:
+            latencies.extend(local)
+            statements.extend(sql_counts)
+            counts['errors'] += errors
+            counts['throttled'] += throttled
+
+    threads = [threading.Thread(target=worker, args=(state,)) for state in states]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        'name': scenario.name,
+        'concurrency': concurrency,
+        'requests': len(latencies),
+        'errors': counts['errors'],
+        'throttled': counts['throttled'],
+        'throughput': len(latencies) / elapsed,
+        'p50_ms': percentile(latencies, 0.50) * 1e3,
+        'p95_ms': percentile(latencies, 0.95) * 1e3,
+        'p99_ms': percentile(latencies, 0.99) * 1e3,
+        'queries_per_request': sum(statements) / len(statements) if statements else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('targets', nargs='+', help=f"Scenario ({', '.join(SCENARIOS)}) or name=url")
+    parser.add_argument('--base-url', default='http://localhost:5000')
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--duration', type=float, default=30)
+    parser.add_argument('--token', help='Access token sent as Bearer, instead of logging in the bench user')
+    parser.add_argument('--output', help='Save the results as json')
+    args = parser.parse_args()
+
+    results = []
+    for target in args.targets:
+        if '=' in target:
+            name, url = target.split('=', 1)
+            scenario, base_url = Scenario(name, '', needs_login=False), url
+        else:
+            scenario, base_url = SCENARIOS[target], args.base_url.rstrip('/')
+        results.append(run_load(scenario, base_url, args.concurrency, args.duration, args.token))
+    print_results(results)
+    if args.output:
+        save_results(args.output, 'load', results, {'concurrency': args.concurrency, 'duration': args.duration,
+                                                     'base_url': args.base_url})
+
+
+if __name__ == '__main__':
+    main()
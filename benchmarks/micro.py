@@ -0,0 +1,88 @@
+"""
+    Micro benchmarks of the hot functions: to_dict of the models, the slug allocation
+    (Book.generate_unique_slug) and the JWT loaders run by every authenticated request
+    (identity and claims when a token is issued, blocklist and user lookup when one
+    is verified). The database of DATABASE_URL must be seeded (benchmarks.seed).
+
+    DATABASE_URL=sqlite:///bench.db python -m benchmarks.micro --repeat 2000 --output results/micro.json
+"""
+import argparse
+import itertools
+from datetime import datetime, timezone
+from flask_jwt_extended import create_access_token, get_current_user, verify_jwt_in_request
+from sqlalchemy import select
+from extension import db
+from admin.models import User
+from authors.models import Author, Book
+from benchmarks.common import bench_app, measure, print_results, save_results
+from benchmarks.seed import BENCH_USER
+
+
+def make_instances(count):
+    now = datetime.now(tz=timezone.utc).replace(tzinfo=None)
+    authors, books = [], []
+    for i in range(count):
+        author = Author(id=i, name=f"Author {i}", biography="Biography " * 20, birthdate=now)
+        book = Book.__mapper__.class_manager.new_instance()  # Skip __init__, set the slug by hand
+        book.id, book.title, book.slug_book = i, f"Book number {i}", f"book-number-{i}"
+        book.created_at = book.updated_at = now
+        authors.append(author)
+        books.append(book)
+    return authors, books
+
+
+def bench_to_dict(repeat):
+    authors, books = make_instances(100)
+    author_cycle, book_cycle = itertools.cycle(authors), itertools.cycle(books)
+    return [
+        {'name': 'author.to_dict', **measure(lambda: next(author_cycle).to_dict(), repeat)},
+        {'name': 'book.to_dict', **measure(lambda: next(book_cycle).to_dict(), repeat)},
+    ]
+
+
+def bench_slugs(repeat):
+    book = Book.__mapper__.class_manager.new_instance()
+    taken = db.session.scalars(select(Book.title).limit(100)).all() or ['Bench slug']
+    taken_cycle = itertools.cycle(taken)
+    fresh = (f"Fresh bench title {n}" for n in itertools.count())
+    return [
+        # The base exists, the next suffix has to be found
+        {'name': 'generate_unique_slug.taken', **measure(lambda: book.generate_unique_slug(next(taken_cycle)), repeat)},
+        {'name': 'generate_unique_slug.fresh', **measure(lambda: book.generate_unique_slug(next(fresh)), repeat)},
+    ]
+
+
+def bench_jwt(app, repeat):
+    user = User.find_for_login(BENCH_USER)
+    if user is None:
+        raise SystemExit("Run benchmarks.seed first, the bench user is missing")
+    token = create_access_token(identity=user)
+    headers = {'Authorization': f'Bearer {token}'}
+
+    def verify():
+        with app.test_request_context(headers=headers):
+            verify_jwt_in_request()  # Blocklist loader
+            get_current_user()  # User lookup loader
+
+    return [
+        {'name': 'jwt.create_access_token', **measure(lambda: create_access_token(identity=user), repeat)},
+        {'name': 'jwt.verify_and_lookup', **measure(verify, repeat)},
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=2000)
+    parser.add_argument('--output', help='Save the results as json')
+    args = parser.parse_args()
+
+    app = bench_app()
+    with app.app_context():
+        results = bench_to_dict(args.repeat) + bench_slugs(args.repeat) + bench_jwt(app, args.repeat)
+    print_results(results)
+    if args.output:
+        save_results(args.output, 'micro', results, {'repeat': args.repeat, 'jwt_claims_mode': app.config.get('JWT_CLAIMS_MODE')})
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,162 @@
+"""
+    Seed the catalog with synthetic authors, books and links for the benchmarks, from
+    10k up to 10M rows. Use a scratch database, it writes to the one of DATABASE_URL.
+    On postgres the rows are generated by the server (generate_series), elsewhere they
+    are sent in batches of multi-row inserts. It also creates the user of the load
+    driver (bench-load / bench-load-password).
+
+    DATABASE_URL=sqlite:///bench.db python -m benchmarks.seed --create --authors 10000 --books 100000
+"""
+import argparse
+import time
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import func, insert, select, text
+from extension import db
+from admin.models import User
+from authors.models import Author, AuthorBook, Book
+from authors.slugs import base_slug
+from benchmarks.common import bench_app
+
+BENCH_USER = 'bench-load'
+BENCH_PASSWORD = 'bench-load-password'
+WORDS = ('river', 'shadow', 'garden', 'winter', 'empire', 'silent', 'glass', 'north',
+         'stone', 'letters', 'harbor', 'iron', 'summer', 'crown', 'night', 'paper')
+BATCH = 10000
+# Distinct titles, book n has the title of n % TITLES: every title is shared by
+# books / TITLES books, their slugs are numbered like the allocation does
+TITLES = 1000
+
+
+def title_of(n):
+    # Repeated titles, so the slugs collide and the search has something to rank
+    k = n % TITLES
+    return f"The {WORDS[k % len(WORDS)]} {WORDS[(k // len(WORDS)) % len(WORDS)]} {k}"
+
+
+def slug_of(n):
+    # base, base-1, base-2... as authors.slugs.allocate_slugs hands them out
+    repeat = n // TITLES
+    return base_slug(title_of(n)) + (f"-{repeat}" if repeat else '')
+
+
+def _batches(start, stop, batch=BATCH):
+    for first in range(start, stop, batch):
+        yield first, min(first + batch, stop)
+
+
+def seed_authors(start, stop, epoch):
+    for first, last in _batches(start, stop):
+        rows = [{'name': f"Author {WORDS[n % len(WORDS)].title()} {n}",
+                 'biography': f"Writes about {WORDS[n % len(WORDS)]} and {WORDS[(n * 7) % len(WORDS)]}.",
+                 'created_at': epoch + timedelta(seconds=n), 'updated_at': epoch + timedelta(seconds=n)}
+                for n in range(first, last)]
+        db.session.execute(insert(Author), rows)
+        db.session.commit()
+
+
+def seed_books(start, stop, epoch):
+    for first, last in _batches(start, stop):
+        rows = []
+        for n in range(first, last):
+            rows.append({'title': title_of(n), 'slug_book': slug_of(n),
+                         'description': f"A novel about {WORDS[(n * 3) % len(WORDS)]}.",
+                         'created_at': epoch + timedelta(seconds=n), 'updated_at': epoch + timedelta(seconds=n)})
+        db.session.execute(insert(Book), rows)
+        db.session.commit()
+
+
+def seed_links(book_ids, author_ids, per_book):
+    rows = []
+    for index, book_id in enumerate(book_ids):
+        for j in range(per_book):
+            rows.append({'book_id': book_id, 'author_id': author_ids[(index * per_book + j) % len(author_ids)]})
+        if len(rows) >= BATCH:
+            db.session.execute(insert(AuthorBook), rows)
+            db.session.commit()
+            rows = []
+    if rows:
+        db.session.execute(insert(AuthorBook), rows)
+        db.session.commit()
+
+
+def seed_postgres(authors, books, per_book, seeded_authors, seeded_books):
+    """
+        Same rows generated server side, chunked so one transaction stays small.
+    """
+    words = "ARRAY[" + ", ".join(f"'{word}'" for word in WORDS) + "]"
+    size = len(WORDS)
+    for first, last in _batches(seeded_authors, authors, BATCH * 10):
+        db.session.execute(text(f"""
+            INSERT INTO authors.author (name, biography, created_at, updated_at)
+            SELECT 'Author ' || initcap(({words})[n % {size} + 1]) || ' ' || n,
+                   'Writes about ' || ({words})[n % {size} + 1] || ' and ' || ({words})[(n * 7) % {size} + 1] || '.',
+                   timestamp '2000-01-01' + n * interval '1 second', timestamp '2000-01-01' + n * interval '1 second'
+            FROM generate_series(:first, :last - 1) AS n
+        """), {'first': first, 'last': last})
+        db.session.commit()
+    for first, last in _batches(seeded_books, books, BATCH * 10):
+        db.session.execute(text(f"""
+            INSERT INTO authors.book (title, slug_book, description, created_at, updated_at)
+            SELECT t.title, lower(replace(t.title, ' ', '-')) || CASE WHEN n / :titles > 0 THEN '-' || n / :titles ELSE '' END,
+                   'A novel about ' || ({words})[(n * 3) % {size} + 1] || '.',
+                   timestamp '2000-01-01' + n * interval '1 second', timestamp '2000-01-01' + n * interval '1 second'
+            FROM generate_series(:first, :last - 1) AS n,
+                 LATERAL (SELECT 'The ' || ({words})[k % {size} + 1] || ' ' || ({words})[(k / {size}) % {size} + 1]
+                          || ' ' || k AS title FROM (SELECT n % :titles AS k) AS r) AS t
+        """), {'first': first, 'last': last, 'titles': TITLES})
+        db.session.commit()
+    if per_book and books > seeded_books:
+        # Links of the new books only, authors picked round robin by row number
+        db.session.execute(text("""
+            INSERT INTO authors.author_book (author_id, book_id)
+            SELECT a.id, b.id
+            FROM (SELECT id, row_number() OVER (ORDER BY id) - 1 AS rn FROM authors.book
+                  ORDER BY id OFFSET :seeded_books) AS b
+            CROSS JOIN generate_series(0, :per_book - 1) AS j
+            JOIN (SELECT id, row_number() OVER (ORDER BY id) - 1 AS rn FROM authors.author) AS a
+              ON a.rn = (b.rn * :per_book + j) % :authors
+        """), {'seeded_books': seeded_books, 'per_book': per_book, 'authors': max(authors, seeded_authors)})
+        db.session.commit()
+
+
+def ensure_bench_user(app):
+    if User.find_for_login(BENCH_USER) is not None:
+        return
+    user = User(username=BENCH_USER, email=f'{BENCH_USER}@example.com', first_name='Bench', last_name='Load',
+                password=app.password_hasher.hash(BENCH_PASSWORD))
+    db.session.add(user)
+    db.session.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--authors', type=int, default=10000)
+    parser.add_argument('--books', type=int, default=10000)
+    parser.add_argument('--links-per-book', type=int, default=2)
+    parser.add_argument('--create', action='store_true', help='Create the tables first (scratch sqlite)')
+    args = parser.parse_args()
+
+    app = bench_app()
+    with app.app_context():
+        if args.create:
+            db.create_all()
+        started = time.perf_counter()
+        seeded_authors = db.session.scalar(select(func.count()).select_from(Author))
+        seeded_books = db.session.scalar(select(func.count()).select_from(Book))
+        if db.session.get_bind().dialect.name == 'postgresql':
+            seed_postgres(args.authors, args.books, args.links_per_book, seeded_authors, seeded_books)
+        else:
+            epoch = datetime(2000, 1, 1, tzinfo=timezone.utc)
+            seed_authors(seeded_authors, args.authors, epoch)
+            seed_books(seeded_books, args.books, epoch)
+            if args.links_per_book and args.books > seeded_books:
+                author_ids = db.session.scalars(select(Author.id).order_by(Author.id)).all()
+                book_ids = db.session.scalars(select(Book.id).order_by(Book.id).offset(seeded_books)).all()
+                seed_links(book_ids, author_ids, args.links_per_book)
+        ensure_bench_user(app)
+        print(f"{max(args.authors, seeded_authors)} authors, {max(args.books, seeded_books)} books "
+              f"in {time.perf_counter() - started:.1f}s")
+
+
+if __name__ == '__main__':
+    main()
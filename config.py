@@ -19,12 +19,160 @@ class Config:
     JWT_SECRET_KEY = os.getenv('SECRET_KEY')
     GOOGLE_CLIENT_SECRET=os.getenv('GOOGLE_CLIENT_SECRET')
     GOOGLE_CLIENT_ID = os.getenv('GOOGLE_CLIENT_ID')
+    # Discovery document of the Google login, point it to a stand-in server in the tests
+    GOOGLE_SERVER_METADATA_URL = os.getenv('GOOGLE_SERVER_METADATA_URL', 'https://accounts.google.com/.well-known/openid-configuration')
+    # Disk cache of the discovery document and JWKS, shared by the workers
+    OIDC_CACHE_PATH = os.getenv('OIDC_CACHE_PATH', '/tmp/author_books_oidc.json')
+    OIDC_CACHE_TTL = float(os.getenv('OIDC_CACHE_TTL', 3600))  # When the provider sends no max-age
+    OIDC_REFRESH_BEFORE = float(os.getenv('OIDC_REFRESH_BEFORE', 300))
+    OIDC_FETCH_TIMEOUT = float(os.getenv('OIDC_FETCH_TIMEOUT', 5))
+    OIDC_MIN_REFETCH_INTERVAL = float(os.getenv('OIDC_MIN_REFETCH_INTERVAL', 60))
+    OIDC_WARM_AT_STARTUP = os.getenv('OIDC_WARM_AT_STARTUP', 'False') == 'True'
     JWT_ACCESS_TOKEN_EXPIRES = expire
+    # Build current_user from the jwt claims instead of loading the User row
+    JWT_CLAIMS_MODE = os.getenv('JWT_CLAIMS_MODE', 'True') == 'True'
+    # Seconds a worker trusts its cached token_version of a user
+    JWT_TOKEN_VERSION_TTL = int(os.getenv('JWT_TOKEN_VERSION_TTL', 30))
+    JWT_REFRESH_TOKEN_EXPIRES = timedelta(days=30)
+    # In memory index of revoked tokens (bloom filter + exact jtis)
+    REVOCATION_INDEX_ENABLED = os.getenv('REVOCATION_INDEX_ENABLED', 'True') == 'True'
+    REVOCATION_BLOOM_CAPACITY = int(os.getenv('REVOCATION_BLOOM_CAPACITY', 100000))
+    REVOCATION_BLOOM_FP_RATE = float(os.getenv('REVOCATION_BLOOM_FP_RATE', 0.001))
+    # Seconds between reads of the rows revoked by the other workers. A token revoked (logout,
+    # refresh) on one worker is still accepted by the others until their next read: up to
+    # this interval, plus BLOCKLIST_FLUSH_INTERVAL in 'batched' mode. Lower it to shrink the window
+    REVOCATION_SYNC_INTERVAL = float(os.getenv('REVOCATION_SYNC_INTERVAL', 5))
+    # 'sync' commits each revoked token in the request, 'batched' buffers them and
+    # flushes every BLOCKLIST_FLUSH_INTERVAL seconds (can lose the last interval on a crash)
+    BLOCKLIST_WRITE_MODE = os.getenv('BLOCKLIST_WRITE_MODE', 'sync')
+    BLOCKLIST_FLUSH_INTERVAL = float(os.getenv('BLOCKLIST_FLUSH_INTERVAL', 1))
+    BLOCKLIST_FLUSH_SIZE = int(os.getenv('BLOCKLIST_FLUSH_SIZE', 500))
+    # Seconds between purges of the expired rows, 0 disables it
+    BLOCKLIST_PURGE_INTERVAL = float(os.getenv('BLOCKLIST_PURGE_INTERVAL', 300))
+    BLOCKLIST_PURGE_CHUNK = int(os.getenv('BLOCKLIST_PURGE_CHUNK', 1000))
+    # Storage of the rate limit counters, mmap:///path/to/file shares them between the
+    # workers of the host (see ratelimit_storage.py), memory:// counts per process: with
+    # n workers a client gets up to n times the limit. The default follows WEB_CONCURRENCY
+    # (the worker count of gunicorn), use redis:// across hosts
+    RATELIMIT_STORAGE_URI = os.getenv(
+        'RATELIMIT_STORAGE_URI',
+        'mmap:///tmp/author_books_ratelimit.bin' if int(os.getenv('WEB_CONCURRENCY', 1)) > 1 else 'memory://'
+    )
+    # Limit of every endpoint per client address (flask-limiter syntax, ';' separated)
+    RATELIMIT_DEFAULT = os.getenv('RATELIMIT_DEFAULT', '30 per minute')
+    # Turn it off only for the load benchmarks
+    RATELIMIT_ENABLED = os.getenv('RATELIMIT_ENABLED', 'True') == 'True'
+    # Full werkzeug hash method with its parameters, hashes with other ones are upgraded on login
+    PASSWORD_HASH_METHOD = os.getenv('PASSWORD_HASH_METHOD', 'scrypt:32768:8:1')
+    # Processes hashing passwords, and jobs that can wait before answering 503
+    PASSWORD_HASH_WORKERS = int(os.getenv('PASSWORD_HASH_WORKERS', 2))
+    PASSWORD_HASH_QUEUE = int(os.getenv('PASSWORD_HASH_QUEUE', 16))
+    PASSWORD_HASH_TIMEOUT = float(os.getenv('PASSWORD_HASH_TIMEOUT', 10))
+    PASSWORD_HASH_RETRY_AFTER = int(os.getenv('PASSWORD_HASH_RETRY_AFTER', 1))
+    # Records validated and written per transaction by the bulk import
+    IMPORT_CHUNK_SIZE = int(os.getenv('IMPORT_CHUNK_SIZE', 5000))
+    # Pairs accepted by one request of the batch link endpoint
+    LINKS_BATCH_MAX = int(os.getenv('LINKS_BATCH_MAX', 10000))
+    # Page size of the catalog listings
+    PAGE_SIZE_DEFAULT = int(os.getenv('PAGE_SIZE_DEFAULT', 50))
+    PAGE_SIZE_MAX = int(os.getenv('PAGE_SIZE_MAX', 200))
+    # Default max sql statements per request (empty disables it), 'log' or 'raise' when exceeded
+    SQL_QUERY_BUDGET = int(os.getenv('SQL_QUERY_BUDGET')) if os.getenv('SQL_QUERY_BUDGET') else None
+    SQL_QUERY_BUDGET_MODE = os.getenv('SQL_QUERY_BUDGET_MODE', 'log')
+    # Send the statements of each request in X-SQL-Statements, for the load benchmarks
+    SQL_COUNT_HEADER = os.getenv('SQL_COUNT_HEADER', 'False') == 'True'
+    # Response cache of the catalog reads: 'file' (shared by the workers of the host, a commit
+    # evicts the entries of all of them), 'memory' (per worker, the other workers serve the old
+    # entry for up to CATALOG_CACHE_TTL seconds, fine with a single worker) or 'none'.
+    # With several hosts the others serve stale entries for up to CATALOG_CACHE_TTL seconds too
+    CATALOG_CACHE_BACKEND = os.getenv('CATALOG_CACHE_BACKEND', 'file')
+    CATALOG_CACHE_PATH = os.getenv('CATALOG_CACHE_PATH', '/tmp/author_books_cache.sqlite')
+    CATALOG_CACHE_TTL = float(os.getenv('CATALOG_CACHE_TTL', 60))
+    CATALOG_CACHE_MAX_ENTRIES = int(os.getenv('CATALOG_CACHE_MAX_ENTRIES', 10000))
+    # Seconds read again by every updated_at sync of the in process indexes (autocomplete,
+    # graph, similar books): longer than the longest write transaction plus the clock skew
+    # between the app hosts and the database
+    CATALOG_SYNC_OVERLAP = float(os.getenv('CATALOG_SYNC_OVERLAP', 300))
+    # In process autocomplete index: seconds between the syncs of the rows written by the
+    # other workers, between full rebuilds, build it at startup. The rows deleted by another
+    # worker are suggested until the next rebuild, lower the interval if that matters
+    AUTOCOMPLETE_SYNC_INTERVAL = float(os.getenv('AUTOCOMPLETE_SYNC_INTERVAL', 30))
+    AUTOCOMPLETE_REBUILD_INTERVAL = float(os.getenv('AUTOCOMPLETE_REBUILD_INTERVAL', 3600))
+    AUTOCOMPLETE_BUILD_AT_STARTUP = os.getenv('AUTOCOMPLETE_BUILD_AT_STARTUP', 'False') == 'True'
+    AUTOCOMPLETE_LIMIT_MAX = int(os.getenv('AUTOCOMPLETE_LIMIT_MAX', 50))
+    # In memory co-author graph (needs numpy, scipy for the components): seconds between
+    # the syncs and the rebuilds, overlay links merged into the arrays, build it at startup
+    GRAPH_SYNC_INTERVAL = float(os.getenv('GRAPH_SYNC_INTERVAL', 30))
+    GRAPH_REBUILD_INTERVAL = float(os.getenv('GRAPH_REBUILD_INTERVAL', 3600))
+    GRAPH_COMPACT_AFTER = int(os.getenv('GRAPH_COMPACT_AFTER', 50000))
+    GRAPH_BUILD_AT_STARTUP = os.getenv('GRAPH_BUILD_AT_STARTUP', 'False') == 'True'
+    GRAPH_MAX_HOPS = int(os.getenv('GRAPH_MAX_HOPS', 3))
+    GRAPH_MAX_PATH_HOPS = int(os.getenv('GRAPH_MAX_PATH_HOPS', 6))
+    GRAPH_LIMIT_MAX = int(os.getenv('GRAPH_LIMIT_MAX', 1000))
+    GRAPH_RETRY_AFTER = int(os.getenv('GRAPH_RETRY_AFTER', 5))
+    # Similar books (needs numpy and scipy): directory of the files built by `flask catalog
+    # similar-books`, neighbors kept per book, weight of the shared authors against the text,
+    # fraction of changed books above which the update is a full build
+    SIMILAR_BOOKS_PATH = os.getenv('SIMILAR_BOOKS_PATH', '/tmp/author_books_similar')
+    SIMILAR_BOOKS_K = int(os.getenv('SIMILAR_BOOKS_K', 20))
+    SIMILAR_BOOKS_AUTHOR_WEIGHT = float(os.getenv('SIMILAR_BOOKS_AUTHOR_WEIGHT', 0.3))
+    SIMILAR_BOOKS_MAX_CHANGED = float(os.getenv('SIMILAR_BOOKS_MAX_CHANGED', 0.2))
+    # Requests slower than this are logged with their slowest statements, 0 disables it
+    METRICS_SLOW_REQUEST_SECONDS = float(os.getenv('METRICS_SLOW_REQUEST_SECONDS', 1))
+    # Encode the listings and the search with orjson when installed, same output (HTTP dates)
+    JSON_FAST_ENCODER = os.getenv('JSON_FAST_ENCODER', 'True') == 'True'
+
+    # Full url of the database, overrides the DB_* variables (e.g. sqlite:///catalog.db)
+    DATABASE_URL = os.getenv('DATABASE_URL')
+    # Connection pool of each engine
+    DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 5))
+    DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', 10))
+    DB_POOL_TIMEOUT = int(os.getenv('DB_POOL_TIMEOUT', 30))
+    DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', 1800))
+    DB_POOL_PRE_PING = os.getenv('DB_POOL_PRE_PING', 'True') == 'True'
+    # Max milliseconds of one statement on postgres, 0 disables it
+    DB_STATEMENT_TIMEOUT_MS = int(os.getenv('DB_STATEMENT_TIMEOUT_MS', 0))
+    # Comma separated urls of read replicas, the read only endpoints are served from them
+    DB_REPLICA_URIS = [uri.strip() for uri in os.getenv('DB_REPLICA_URIS', '').split(',') if uri.strip()]
+    # Seconds a client keeps reading from the primary after it wrote (read your writes)
+    DB_REPLICA_STICKY_SECONDS = int(os.getenv('DB_REPLICA_STICKY_SECONDS', 5))
 
     @property
     def SQLALCHEMY_DATABASE_URI(self):
+        if self.DATABASE_URL:
+            return self.DATABASE_URL
         return f"postgresql://{self.DB_USER}:{self.DB_PASSWORD}@{self.DB_HOST}:{self.DB_PORT}/{self.DB_NAME}"
 
+    @property
+    def SQLALCHEMY_ENGINE_OPTIONS(self):
+        return self.engine_options(self.SQLALCHEMY_DATABASE_URI)
+
+    @property
+    def SQLALCHEMY_BINDS(self):
+        # Replica engines, picked by db_routing.RoutingSession for the read only endpoints
+        return {
+            f'replica_{n}': {'url': uri, **self.engine_options(uri)}
+            for n, uri in enumerate(self.DB_REPLICA_URIS)
+        }
+
+    def engine_options(self, uri):
+        options = {'pool_pre_ping': self.DB_POOL_PRE_PING}
+        if uri.startswith('sqlite'):
+            # sqlite has no schemas, put the admin and authors tables in the main database
+            options['execution_options'] = {'schema_translate_map': {'admin': None, 'authors': None}}
+            return options
+        from metrics import TimedQueuePool  # Records the checkout wait
+        options.update({
+            'poolclass': TimedQueuePool,
+            'pool_size': self.DB_POOL_SIZE,
+            'max_overflow': self.DB_MAX_OVERFLOW,
+            'pool_timeout': self.DB_POOL_TIMEOUT,
+            'pool_recycle': self.DB_POOL_RECYCLE,
+        })
+        if uri.startswith('postgresql') and self.DB_STATEMENT_TIMEOUT_MS:
+            options['connect_args'] = {'options': f'-c statement_timeout={self.DB_STATEMENT_TIMEOUT_MS}'}
+        return options
+
 class DevelopmentConfig(Config):
     DB_HOST = 'localhost'
 
@@ -0,0 +1,97 @@
+"""
+    Send the reads of the read only endpoints to the replicas and everything else
+    to the primary. After a commit the client keeps reading from the primary for
+    DB_REPLICA_STICKY_SECONDS (a cookie carries it between requests and workers),
+    so it always sees its own writes.
+"""
+import itertools
+import time
+from functools import wraps
+from flask import g, has_request_context, request
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+
+STICKY_COOKIE = 'db_primary_until'
+_counter = itertools.count()
+_listening = False
+
+
+class RoutingSession(Session):
+    """
+        Session of flask-sqlalchemy that picks a replica engine when the request
+        is marked as read only, nothing was written and nothing is being flushed.
+    """
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and not self._flushing and _use_replica():
+            replica = _pick_replica(self._db)
+            if replica is not None:
+                return replica
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def _pick_replica(db):
+    """
+        Round robin between the replicas, once per request: all the reads of a request
+        see the same snapshot (the replicas lag by different amounts).
+    """
+    if has_request_context() and 'db_replica' in g:
+        return g.db_replica
+    replicas = [key for key in db.engines if key and str(key).startswith('replica_')]
+    replica = db.engines[replicas[next(_counter) % len(replicas)]] if replicas else None
+    if has_request_context():
+        g.db_replica = replica
+    return replica
+
+
+def read_engine(db):
+    """
+        Engine for long reads outside of the session (e.g. the export), a replica if there is one.
+    """
+    return _pick_replica(db) or db.engine
+
+
+def _use_replica():
+    if not has_request_context() or not g.get('db_read_only') or g.get('db_wrote'):
+        return False
+    return not pinned_to_primary(request.cookies.get(STICKY_COOKIE))
+
+
+def pinned_to_primary(cookie) -> bool:
+    """
+        True while the sticky cookie of a client that wrote has not expired.
+    """
+    try:
+        return float(cookie or 0) >= time.time()
+    except ValueError:
+        return False
+
+
+def read_only(f):
+    """
+        The safe methods (GET, HEAD) of the view can read from a replica.
+        Put it below jwt_required, the token checks must see the primary.
+    """
+    @wraps(f)
+    def decorator(*args, **kwargs):
+        g.db_read_only = request.method in ('GET', 'HEAD')
+        return f(*args, **kwargs)
+    return decorator
+
+
+def _after_commit(session):
+    if has_request_context():
+        g.db_wrote = True
+
+
+def init_db_routing(app):
+    global _listening
+    if not _listening:
+        event.listen(Session, 'after_commit', _after_commit)
+        _listening = True
+
+    @app.after_request
+    def stick_to_primary(response):
+        if g.get('db_wrote') and app.config.get('DB_REPLICA_URIS'):
+            seconds = app.config.get('DB_REPLICA_STICKY_SECONDS', 5)
+            response.set_cookie(STICKY_COOKIE, str(time.time() + seconds), max_age=seconds, httponly=True)
+        return response
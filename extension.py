@@ -2,4 +2,5 @@
     Save extensions to isolate imports
 """
 from flask_sqlalchemy import SQLAlchemy
-db = SQLAlchemy() # In flask is better to intialize an object and create a factory
+from db_routing import RoutingSession
+db = SQLAlchemy(session_options={"class_": RoutingSession}) # In flask is better to intialize an object and create a factory
@@ -0,0 +1,81 @@
+"""
+    Fast json responses with orjson, and helpers to serialize row tuples selected
+    with only the needed columns instead of hydrated ORM instances.
+"""
+import json
+from datetime import date, datetime
+from flask import current_app
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # Optional, the default provider of flask is used without it
+    orjson = None
+
+# Datetimes go through the default of flask, the responses keep their HTTP dates
+ORJSON_OPTIONS = (orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME) if orjson else 0
+# The export writes them in ISO 8601, naive ones as UTC
+EXPORT_OPTIONS = (orjson.OPT_NAIVE_UTC | orjson.OPT_NON_STR_KEYS) if orjson else 0
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    """
+        JSON provider backed by orjson, same output as the default one but the order
+        of the keys. Not installed as app.json, the listings use it through
+        listing_response().
+    """
+    def dumps(self, obj, **kwargs):
+        if kwargs:  # sort_keys, indent... orjson has no equivalent, the default provider does it
+            return super().dumps(obj, **kwargs)
+        return orjson.dumps(obj, default=self.default, option=ORJSON_OPTIONS).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(
+            orjson.dumps(obj, default=self.default, option=ORJSON_OPTIONS),
+            mimetype=self.mimetype
+        )
+
+
+def listing_json(obj, app=None) -> bytes:
+    """
+        Body of a listing, encoded with orjson when it is installed and JSON_FAST_ENCODER
+        is on, with app.json otherwise.
+    """
+    app = app or current_app
+    if orjson is not None and app.config.get('JSON_FAST_ENCODER'):
+        return orjson.dumps(obj, default=DefaultJSONProvider.default, option=ORJSON_OPTIONS)
+    return app.json.dumps(obj).encode()
+
+
+def listing_response(obj):
+    """
+        jsonify() for the listings, see listing_json().
+    """
+    return current_app.response_class(listing_json(obj), mimetype=current_app.json.mimetype)
+
+
+def dumps_line(obj) -> bytes:
+    """
+        One json document followed by a new line (ndjson), as bytes.
+    """
+    if orjson is not None:
+        return orjson.dumps(obj, option=EXPORT_OPTIONS | orjson.OPT_APPEND_NEWLINE)
+    return (json.dumps(obj, default=_default, separators=(',', ':')) + '\n').encode()
+
+
+def _default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def rows_to_dicts(keys, rows):
+    """
+        Build the dicts of the response from row tuples, the first len(keys) values
+        of each row are the ones of `keys`.
+    """
+    return [dict(zip(keys, row)) for row in rows]
@@ -0,0 +1,269 @@
+"""
+    Request and database metrics in the Prometheus text format, served at /metrics.
+    - http_request_duration_seconds: latency histogram per blueprint, endpoint, method and status
+    - http_request_sql_statements / http_request_sql_seconds: statements and their time per request
+    - db_pool_checkout_wait_seconds: time waiting for a connection of the pool
+    - ratelimit_rejections_total: requests answered with a 429
+    - ratelimit_evictions_total: live counters of mmap:// dropped from a full stripe
+    Requests slower than METRICS_SLOW_REQUEST_SECONDS are logged with their slowest
+    statements. The numbers are per process, scrape every worker.
+    Recording is a perf_counter and a locked bisect per observation, cheap enough to
+    leave on in production.
+"""
+import logging
+import threading
+import time
+from bisect import bisect_left
+from flask import Response, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import QueuePool
+
+logger = logging.getLogger(__name__)
+_listening = False
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+STATEMENT_BUCKETS = (1, 2, 3, 5, 8, 13, 21, 34, 55, 100)
+WAIT_BUCKETS = (0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 30)
+# Statements kept per request for the slow request log
+MAX_SLOW_STATEMENTS = 50
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def _labels(names, values, extra='') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labels=()):
+        self.name, self.help, self.labels = name, help, tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self):
+        yield f'# HELP {self.name} {self.help}'
+        yield f'# TYPE {self.name} counter'
+        with self._lock:
+            values = list(self._values.items())
+        for label_values, value in values:
+            yield f'{self.name}{_labels(self.labels, label_values)} {_number(value)}'
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labels=(), buckets=LATENCY_BUCKETS):
+        self.name, self.help, self.labels = name, help, tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series = {}  # label values -> [counts per bucket..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * (len(self.buckets) + 2)
+            series[index] += 1
+            series[-1] += value
+
+    def render(self):
+        yield f'# HELP {self.name} {self.help}'
+        yield f'# TYPE {self.name} histogram'
+        with self._lock:
+            series = [(label_values, list(values)) for label_values, values in self._series.items()]
+        for label_values, values in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), values):
+                cumulative += count
+                labels = _labels(self.labels, label_values, f'le="{_number(bound)}"')
+                yield f'{self.name}_bucket{labels} {cumulative}'
+            labels = _labels(self.labels, label_values)
+            yield f'{self.name}_sum{labels} {_number(values[-1])}'
+            yield f'{self.name}_count{labels} {cumulative}'
+
+
+class Registry:
+    """
+        Metrics plus collectors, functions called at scrape time that return the
+        lines of values read on demand (pool sizes, cache stats).
+    """
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def add_collector(self, fn):
+        self.collectors.append(fn)
+        return fn
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        for collector in self.collectors:
+            try:
+                lines.extend(collector())
+            except Exception:
+                logger.exception("Metrics collector %s failed", getattr(collector, '__name__', collector))
+        return '\n'.join(lines) + '\n'
+
+
+def gauge_lines(name: str, help: str, samples, labels=()):
+    """
+        Lines of a gauge for the collectors, samples are (label values, value).
+    """
+    yield f'# HELP {name} {help}'
+    yield f'# TYPE {name} gauge'
+    for label_values, value in samples:
+        yield f'{name}{_labels(labels, label_values)} {_number(value)}'
+
+
+REGISTRY = Registry()
+REQUEST_LATENCY = REGISTRY.register(Histogram(
+    'http_request_duration_seconds', 'Latency of the requests.',
+    ('blueprint', 'endpoint', 'method', 'status')))
+REQUEST_STATEMENTS = REGISTRY.register(Histogram(
+    'http_request_sql_statements', 'SQL statements run by a request.',
+    ('blueprint', 'endpoint'), STATEMENT_BUCKETS))
+REQUEST_SQL_SECONDS = REGISTRY.register(Histogram(
+    'http_request_sql_seconds', 'Time of the SQL statements of a request.',
+    ('blueprint', 'endpoint')))
+POOL_WAIT = REGISTRY.register(Histogram(
+    'db_pool_checkout_wait_seconds', 'Time waiting for a connection of the pool.',
+    ('pool',), WAIT_BUCKETS))
+RATELIMIT_REJECTIONS = REGISTRY.register(Counter(
+    'ratelimit_rejections_total', 'Requests rejected by the rate limiter.', ('blueprint', 'endpoint')))
+RATELIMIT_EVICTIONS = REGISTRY.register(Counter(
+    'ratelimit_evictions_total', 'Rate limit counters not expired yet, dropped for a new key (mmap:// storage).'))
+
+
+class TimedQueuePool(QueuePool):
+    """
+        QueuePool that records how long a checkout waited for a free connection.
+        `metrics_label` is set by init_metrics with the bind key of the engine.
+    """
+    metrics_label = 'default'
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            POOL_WAIT.observe(time.perf_counter() - start, self.metrics_label)
+
+    def recreate(self):
+        pool = super().recreate()
+        pool.metrics_label = self.metrics_label
+        return pool
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context():
+        conn.info.setdefault('metrics_started', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.get('metrics_started')
+    if not started or not has_request_context():
+        return
+    elapsed = time.perf_counter() - started.pop()
+    g.sql_seconds = g.get('sql_seconds', 0.0) + elapsed
+    statements = g.get('sql_log')
+    if statements is None:
+        statements = g.sql_log = []
+    if len(statements) < MAX_SLOW_STATEMENTS:
+        statements.append((elapsed, statement))
+
+
+def _handle_error(context):
+    # The statement failed, after_cursor_execute won't pop its start
+    started = context.connection.info.get('metrics_started') if context.connection is not None else None
+    if started:
+        started.pop()
+
+
+def init_metrics(app):
+    """
+        Hook the request and engine events and add the /metrics endpoint.
+        Returns the registry, to add collectors.
+    """
+    global _listening
+    if not _listening:
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+        event.listen(Engine, 'handle_error', _handle_error)
+        _listening = True
+    slow_seconds = app.config.get('METRICS_SLOW_REQUEST_SECONDS', 1.0)
+
+    @app.before_request
+    def start_timer():
+        g.metrics_started = time.perf_counter()
+
+    @app.after_request
+    def record_request(response):
+        started = g.get('metrics_started')
+        if started is None:
+            return response
+        elapsed = time.perf_counter() - started
+        blueprint, endpoint = request.blueprint or '', request.endpoint or '<unmatched>'
+        if endpoint == 'metrics':
+            return response
+        REQUEST_LATENCY.observe(elapsed, blueprint, endpoint, request.method, response.status_code)
+        # Counted by query_budget
+        REQUEST_STATEMENTS.observe(g.get('sql_statements', 0), blueprint, endpoint)
+        REQUEST_SQL_SECONDS.observe(g.get('sql_seconds', 0.0), blueprint, endpoint)
+        if response.status_code == 429:
+            RATELIMIT_REJECTIONS.inc(blueprint, endpoint)
+        if slow_seconds and elapsed >= slow_seconds:
+            statements = sorted(g.get('sql_log', []), key=lambda item: item[0], reverse=True)
+            logger.warning(
+                "Slow request %s %s %.3fs, %s statements in %.3fs, slowest:\n%s",
+                request.method, request.path, elapsed, g.get('sql_statements', 0), g.get('sql_seconds', 0.0),
+                '\n'.join(f"  {seconds * 1e3:.1f} ms  {statement}" for seconds, statement in statements[:5])
+            )
+        return response
+
+    @REGISTRY.add_collector
+    def pool_usage():
+        from extension import db
+        samples_out, samples_size = [], []
+        with app.app_context():
+            engines = dict(db.engines)
+        for key, engine in engines.items():
+            pool = engine.pool
+            if isinstance(pool, QueuePool):
+                label = key or 'default'
+                samples_out.append(((label,), pool.checkedout()))
+                samples_size.append(((label,), pool.size()))
+        yield from gauge_lines('db_pool_checked_out', 'Connections in use.', samples_out, ('pool',))
+        yield from gauge_lines('db_pool_size', 'Size of the pool.', samples_size, ('pool',))
+
+    with app.app_context():
+        from extension import db
+        for key, engine in db.engines.items():
+            if isinstance(engine.pool, TimedQueuePool):
+                engine.pool.metrics_label = key or 'default'
+
+    def metrics():
+        return Response(REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
+    app.add_url_rule('/metrics', 'metrics', metrics)
+    return REGISTRY
@@ -0,0 +1,26 @@
+"""Add user.token_version to invalidate tokens served from the claims
+
+Revision ID: a1c3e5f7b901
+Revises: dcf460af1118
+Create Date: 2026-10-18 09:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a1c3e5f7b901'
+down_revision = 'dcf460af1118'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('user', schema='admin') as batch_op:
+        batch_op.add_column(sa.Column('token_version', sa.Integer(), server_default='0', nullable=False))
+
+
+def downgrade():
+    with op.batch_alter_table('user', schema='admin') as batch_op:
+        batch_op.drop_column('token_version')
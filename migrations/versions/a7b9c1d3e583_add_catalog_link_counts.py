@@ -0,0 +1,124 @@
+"""Add author.book_count and book.author_count kept by triggers on author_book
+
+Revision ID: a7b9c1d3e583
+Revises: f6b8d0e2a461
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a7b9c1d3e583'
+down_revision = 'f6b8d0e2a461'
+branch_labels = None
+depends_on = None
+
+# Rows backfilled per transaction
+BATCH_SIZE = 10000
+
+# Same triggers as authors/counters.py, copied so this revision never changes
+POSTGRES_TRIGGERS = [
+    """
+    CREATE OR REPLACE FUNCTION authors.author_book_counts() RETURNS trigger LANGUAGE plpgsql AS $body$
+    BEGIN
+        IF TG_OP IN ('DELETE', 'UPDATE') THEN
+            UPDATE authors.author AS a SET book_count = a.book_count - d.n, updated_at = timezone('utc', now())
+            FROM (SELECT author_id, count(*) AS n FROM old_links GROUP BY author_id) AS d WHERE a.id = d.author_id;
+            UPDATE authors.book AS b SET author_count = b.author_count - d.n, updated_at = timezone('utc', now())
+            FROM (SELECT book_id, count(*) AS n FROM old_links GROUP BY book_id) AS d WHERE b.id = d.book_id;
+        END IF;
+        IF TG_OP IN ('INSERT', 'UPDATE') THEN
+            UPDATE authors.author AS a SET book_count = a.book_count + d.n, updated_at = timezone('utc', now())
+            FROM (SELECT author_id, count(*) AS n FROM new_links GROUP BY author_id) AS d WHERE a.id = d.author_id;
+            UPDATE authors.book AS b SET author_count = b.author_count + d.n, updated_at = timezone('utc', now())
+            FROM (SELECT book_id, count(*) AS n FROM new_links GROUP BY book_id) AS d WHERE b.id = d.book_id;
+        END IF;
+        RETURN NULL;
+    END
+    $body$
+    """,
+    """
+    CREATE TRIGGER author_book_counts_insert AFTER INSERT ON authors.author_book
+    REFERENCING NEW TABLE AS new_links FOR EACH STATEMENT EXECUTE FUNCTION authors.author_book_counts()
+    """,
+    """
+    CREATE TRIGGER author_book_counts_delete AFTER DELETE ON authors.author_book
+    REFERENCING OLD TABLE AS old_links FOR EACH STATEMENT EXECUTE FUNCTION authors.author_book_counts()
+    """,
+    """
+    CREATE TRIGGER author_book_counts_update AFTER UPDATE ON authors.author_book
+    REFERENCING OLD TABLE AS old_links NEW TABLE AS new_links
+    FOR EACH STATEMENT EXECUTE FUNCTION authors.author_book_counts()
+    """,
+]
+
+SQLITE_TRIGGERS = [
+    """
+    CREATE TRIGGER IF NOT EXISTS author_book_counts_insert AFTER INSERT ON author_book BEGIN
+        UPDATE author SET book_count = book_count + 1, updated_at = CURRENT_TIMESTAMP WHERE id = NEW.author_id;
+        UPDATE book SET author_count = author_count + 1, updated_at = CURRENT_TIMESTAMP WHERE id = NEW.book_id;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS author_book_counts_delete AFTER DELETE ON author_book BEGIN
+        UPDATE author SET book_count = book_count - 1, updated_at = CURRENT_TIMESTAMP WHERE id = OLD.author_id;
+        UPDATE book SET author_count = author_count - 1, updated_at = CURRENT_TIMESTAMP WHERE id = OLD.book_id;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS author_book_counts_update AFTER UPDATE OF author_id, book_id ON author_book BEGIN
+        UPDATE author SET book_count = book_count - 1, updated_at = CURRENT_TIMESTAMP WHERE id = OLD.author_id;
+        UPDATE book SET author_count = author_count - 1, updated_at = CURRENT_TIMESTAMP WHERE id = OLD.book_id;
+        UPDATE author SET book_count = book_count + 1, updated_at = CURRENT_TIMESTAMP WHERE id = NEW.author_id;
+        UPDATE book SET author_count = author_count + 1, updated_at = CURRENT_TIMESTAMP WHERE id = NEW.book_id;
+    END
+    """,
+]
+
+# table -> (counter column, column of author_book pointing to it)
+COUNTERS = {
+    'author': ('book_count', 'author_id'),
+    'book': ('author_count', 'book_id'),
+}
+
+
+def upgrade():
+    conn = op.get_bind()
+    # Constant default: no table rewrite on postgres 11+
+    for table, (counter, _) in COUNTERS.items():
+        with op.batch_alter_table(table, schema='authors') as batch_op:
+            batch_op.add_column(sa.Column(counter, sa.Integer(), nullable=False, server_default='0'))
+
+    # Triggers first, so links written during the backfill are counted
+    for statement in (POSTGRES_TRIGGERS if conn.dialect.name == 'postgresql' else SQLITE_TRIGGERS):
+        op.execute(statement)
+
+    links = sa.table('author_book', sa.column('author_id'), sa.column('book_id'), schema='authors')
+    with op.get_context().autocommit_block():
+        for table, (counter, link_column) in COUNTERS.items():
+            target = sa.table(table, sa.column('id'), sa.column(counter), schema='authors')
+            actual = sa.select(sa.func.count()).where(links.c[link_column] == target.c.id).scalar_subquery()
+            last_id = conn.execute(sa.select(sa.func.max(target.c.id))).scalar() or 0
+            for start in range(0, last_id + 1, BATCH_SIZE):
+                conn.execute(target.update()
+                             .where(target.c.id.between(start, start + BATCH_SIZE - 1))
+                             .values({counter: actual}))
+            op.create_index(f'ix_{table}_{counter}_id', table, [counter, 'id'], schema='authors',
+                            postgresql_concurrently=True)
+
+
+def downgrade():
+    conn = op.get_bind()
+    for name in ('insert', 'delete', 'update'):
+        if conn.dialect.name == 'postgresql':
+            op.execute(f"DROP TRIGGER IF EXISTS author_book_counts_{name} ON authors.author_book")
+        else:
+            op.execute(f"DROP TRIGGER IF EXISTS author_book_counts_{name}")
+    if conn.dialect.name == 'postgresql':
+        op.execute("DROP FUNCTION IF EXISTS authors.author_book_counts()")
+    for table, (counter, _) in COUNTERS.items():
+        op.drop_index(f'ix_{table}_{counter}_id', table_name=table, schema='authors')
+        with op.batch_alter_table(table, schema='authors') as batch_op:
+            batch_op.drop_column(counter)
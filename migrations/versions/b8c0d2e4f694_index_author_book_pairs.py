@@ -0,0 +1,80 @@
+"""Unique (author_id, book_id) and book_id indexes on author_book, drop the UNIQUE(id)
+
+Revision ID: b8c0d2e4f694
+Revises: a7b9c1d3e583
+Create Date: 2026-10-18 12:30:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b8c0d2e4f694'
+down_revision = 'a7b9c1d3e583'
+branch_labels = None
+depends_on = None
+
+# Duplicated links deleted per transaction
+BATCH_SIZE = 10000
+# A duplicate written while the unique index is built makes it fail, dedupe and try again
+ATTEMPTS = 3
+
+
+def _dedupe(conn):
+    """
+        Keep the oldest row of every duplicated pair. The counter triggers take the
+        deleted rows off author.book_count and book.author_count.
+    """
+    links = sa.table('author_book', sa.column('id'), sa.column('author_id'), sa.column('book_id'), schema='authors')
+    older = links.alias('older')
+    duplicated = sa.select(links.c.id).where(sa.exists().where(
+        older.c.author_id == links.c.author_id, older.c.book_id == links.c.book_id, older.c.id < links.c.id
+    )).limit(BATCH_SIZE).scalar_subquery()
+    while conn.execute(links.delete().where(links.c.id.in_(duplicated))).rowcount:
+        pass
+
+
+def upgrade():
+    conn = op.get_bind()
+    postgres = conn.dialect.name == 'postgresql'
+    with op.get_context().autocommit_block():
+        # Reverse index first, it makes the dedupe and the cascades cheap
+        op.create_index('ix_author_book_book_id', 'author_book', ['book_id'], schema='authors',
+                        postgresql_concurrently=True)
+        for attempt in range(ATTEMPTS):
+            _dedupe(conn)
+            try:
+                op.create_index('ix_author_book_author_id_book_id', 'author_book', ['author_id', 'book_id'],
+                                unique=True, schema='authors', postgresql_concurrently=True)
+                break
+            except sa.exc.IntegrityError:
+                if not postgres or attempt == ATTEMPTS - 1:
+                    raise
+                # A failed concurrent build leaves an invalid index behind
+                op.execute("DROP INDEX CONCURRENTLY IF EXISTS authors.ix_author_book_author_id_book_id")
+    if postgres:
+        # The primary key already makes id unique, drop the UNIQUE(id) constraints
+        # (unnamed in the first migrations, so looked up by their definition)
+        op.execute("""
+            DO $body$
+            DECLARE name text;
+            BEGIN
+                FOR name IN
+                    SELECT c.conname FROM pg_constraint c
+                    JOIN pg_attribute a ON a.attrelid = c.conrelid AND a.attnum = ANY (c.conkey)
+                    WHERE c.conrelid = 'authors.author_book'::regclass AND c.contype = 'u'
+                      AND array_length(c.conkey, 1) = 1 AND a.attname = 'id'
+                LOOP
+                    EXECUTE format('ALTER TABLE authors.author_book DROP CONSTRAINT %I', name);
+                END LOOP;
+            END
+            $body$
+        """)
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute("ALTER TABLE authors.author_book ADD CONSTRAINT author_book_id_key UNIQUE (id)")
+    op.drop_index('ix_author_book_author_id_book_id', table_name='author_book', schema='authors')
+    op.drop_index('ix_author_book_book_id', table_name='author_book', schema='authors')
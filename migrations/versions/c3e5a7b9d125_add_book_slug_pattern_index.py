@@ -0,0 +1,28 @@
+"""Add a pattern ops index on book.slug_book for the prefix queries of the slug allocator
+
+Revision ID: c3e5a7b9d125
+Revises: b2d4f6a8c013
+Create Date: 2026-10-18 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c3e5a7b9d125'
+down_revision = 'b2d4f6a8c013'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # The unique index can't serve LIKE 'prefix-%' unless the collation is C
+    with op.batch_alter_table('book', schema='authors') as batch_op:
+        batch_op.create_index('ix_book_slug_book_pattern', ['slug_book'], unique=False,
+                              postgresql_ops={'slug_book': 'varchar_pattern_ops'})
+
+
+def downgrade():
+    with op.batch_alter_table('book', schema='authors') as batch_op:
+        batch_op.drop_index('ix_book_slug_book_pattern')
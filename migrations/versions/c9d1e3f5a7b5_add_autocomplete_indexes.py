@@ -0,0 +1,46 @@
+"""Trigram indexes of the titles and names, updated_at indexes for the autocomplete sync
+
+Revision ID: c9d1e3f5a7b5
+Revises: b8c0d2e4f694
+Create Date: 2026-10-18 13:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c9d1e3f5a7b5'
+down_revision = 'b8c0d2e4f694'
+branch_labels = None
+depends_on = None
+
+# table -> label column, must match authors/autocomplete.py
+LABELS = {
+    'author': 'name',
+    'book': 'title',
+}
+
+
+def upgrade():
+    postgres = op.get_bind().dialect.name == 'postgresql'
+    if postgres:
+        op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    with op.get_context().autocommit_block():
+        for table, column in LABELS.items():
+            # Rows changed since the last sync of the autocomplete index
+            op.create_index(f'ix_{table}_updated_at', table, ['updated_at'], schema='authors',
+                            postgresql_concurrently=True)
+            if postgres:
+                # Serves the ILIKE of the autocomplete while its index is cold
+                op.create_index(f'ix_{table}_{column}_trgm', table, [column], schema='authors',
+                                postgresql_using='gin', postgresql_ops={column: 'gin_trgm_ops'},
+                                postgresql_concurrently=True)
+
+
+def downgrade():
+    postgres = op.get_bind().dialect.name == 'postgresql'
+    for table, column in LABELS.items():
+        if postgres:
+            op.drop_index(f'ix_{table}_{column}_trgm', table_name=table, schema='authors')
+        op.drop_index(f'ix_{table}_updated_at', table_name=table, schema='authors')
@@ -0,0 +1,37 @@
+"""Add the (sort column, id) indexes used by the keyset pagination of authors and books
+
+Revision ID: d4f6b8c0e237
+Revises: c3e5a7b9d125
+Create Date: 2026-10-18 10:30:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd4f6b8c0e237'
+down_revision = 'c3e5a7b9d125'
+branch_labels = None
+depends_on = None
+
+INDEXES = [
+    ('ix_author_created_at_id', 'author', ['created_at', 'id']),
+    ('ix_author_name_id', 'author', ['name', 'id']),
+    ('ix_book_created_at_id', 'book', ['created_at', 'id']),
+    ('ix_book_title_id', 'book', ['title', 'id']),
+]
+
+
+def upgrade():
+    # Built concurrently so the tables keep accepting writes, that needs autocommit
+    with op.get_context().autocommit_block():
+        for name, table, columns in INDEXES:
+            op.create_index(name, table, columns, unique=False, schema='authors',
+                            postgresql_concurrently=True)
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        for name, table, columns in INDEXES:
+            op.drop_index(name, table_name=table, schema='authors', postgresql_concurrently=True)
@@ -0,0 +1,46 @@
+"""Add generated tsvector columns with GIN indexes for the catalog search
+
+Revision ID: e5a7c9d1f349
+Revises: d4f6b8c0e237
+Create Date: 2026-10-18 11:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e5a7c9d1f349'
+down_revision = 'd4f6b8c0e237'
+branch_labels = None
+depends_on = None
+
+# table -> (weight A column, weight B column), must match authors/search.py
+SEARCH_FIELDS = {
+    'author': ('name', 'biography'),
+    'book': ('title', 'description'),
+}
+
+
+def upgrade():
+    # Generated columns need postgres 12+, the other databases use the in memory fallback
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    for table, (field_a, field_b) in SEARCH_FIELDS.items():
+        op.execute(
+            f"ALTER TABLE authors.{table} ADD COLUMN search_vector tsvector GENERATED ALWAYS AS ("
+            f"setweight(to_tsvector('english', coalesce({field_a}, '')), 'A') || "
+            f"setweight(to_tsvector('english', coalesce({field_b}, '')), 'B')) STORED"
+        )
+    with op.get_context().autocommit_block():
+        for table in SEARCH_FIELDS:
+            op.create_index(f'ix_{table}_search_vector', table, ['search_vector'], schema='authors',
+                            postgresql_using='gin', postgresql_concurrently=True)
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    for table in SEARCH_FIELDS:
+        op.drop_index(f'ix_{table}_search_vector', table_name=table, schema='authors')
+        op.drop_column(table, 'search_vector', schema='authors')
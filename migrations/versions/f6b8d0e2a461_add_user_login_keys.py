@@ -0,0 +1,68 @@
+"""Add normalized username_key and email_key with unique indexes for the login lookups
+
+Revision ID: f6b8d0e2a461
+Revises: e5a7c9d1f349
+Create Date: 2026-10-18 11:30:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f6b8d0e2a461'
+down_revision = 'e5a7c9d1f349'
+branch_labels = None
+depends_on = None
+
+# Rows updated per transaction while backfilling
+BATCH_SIZE = 1000
+
+
+def normalize_login(value):
+    # Frozen copy of admin.models.normalize_login. The keys are computed in python, sql
+    # lower(trim()) differs on the whitespace other than spaces and on non ascii case
+    return str(value).strip().lower() if value is not None else None
+
+
+def upgrade():
+    with op.batch_alter_table('user', schema='admin') as batch_op:
+        batch_op.add_column(sa.Column('username_key', sa.String(length=80), nullable=True))
+        batch_op.add_column(sa.Column('email_key', sa.String(length=150), nullable=True))
+
+    # Backfill in small transactions so the table is never locked for long.
+    user = sa.table('user', sa.column('id'), sa.column('username'), sa.column('email'),
+                    sa.column('username_key'), sa.column('email_key'), schema='admin')
+    batch = sa.select(user.c.id, user.c.username, user.c.email)\
+        .where(user.c.id > sa.bindparam('last_id')).order_by(user.c.id).limit(BATCH_SIZE)
+    backfill = user.update().where(user.c.id == sa.bindparam('user_id')).values(
+        username_key=sa.bindparam('new_username_key'),
+        email_key=sa.bindparam('new_email_key'),
+    )
+    conn = op.get_bind()
+    with op.get_context().autocommit_block():
+        last_id = 0
+        while True:
+            rows = conn.execute(batch, {'last_id': last_id}).all()
+            if not rows:
+                break
+            conn.execute(backfill, [{'user_id': row.id, 'new_username_key': normalize_login(row.username),
+                                     'new_email_key': normalize_login(row.email)} for row in rows])
+            last_id = rows[-1].id
+        # Fails if two users only differ by case, they must be merged by hand first
+        op.create_index('ix_admin_user_username_key', 'user', ['username_key'], unique=True,
+                        schema='admin', postgresql_concurrently=True)
+        op.create_index('ix_admin_user_email_key', 'user', ['email_key'], unique=True,
+                        schema='admin', postgresql_concurrently=True)
+
+    with op.batch_alter_table('user', schema='admin') as batch_op:
+        batch_op.alter_column('username_key', existing_type=sa.String(length=80), nullable=False)
+        batch_op.alter_column('email_key', existing_type=sa.String(length=150), nullable=False)
+
+
+def downgrade():
+    op.drop_index('ix_admin_user_email_key', table_name='user', schema='admin')
+    op.drop_index('ix_admin_user_username_key', table_name='user', schema='admin')
+    with op.batch_alter_table('user', schema='admin') as batch_op:
+        batch_op.drop_column('email_key')
+        batch_op.drop_column('username_key')
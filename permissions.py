@@ -7,11 +7,13 @@ from flask_jwt_extended import (current_user)
 from admin.models import UserRoleEnum
 def admin_required(f):
     @wraps(f)
-    def decorator(f, *args, **kwargs):
+    def decorator(*args, **kwargs):
         """
-            Function to handle authenticated user role admin and superadmin
+            Function to handle authenticated user role admin and superadmin.
+            The role comes from the jwt claims, so use it after jwt_required.
         """
         user = current_user
         if user.role == UserRoleEnum.admin or user.role == UserRoleEnum.superadmin:
             return f(*args, **kwargs)
-        return jsonify("Permission Denied! admin only"), 403
\ No newline at end of file
+        return jsonify("Permission Denied! admin only"), 403
+    return decorator
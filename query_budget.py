@@ -0,0 +1,70 @@
+"""
+    Count the sql statements of each request and complain when an endpoint goes over
+    its budget, so N+1 regressions show up in the logs or fail the tests.
+"""
+import logging
+from functools import wraps
+from flask import g, has_request_context, request, current_app
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+_listening = False
+
+
+class QueryBudgetExceeded(RuntimeError):
+    """
+        Raised in 'raise' mode by the statement that goes over the budget.
+    """
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if not has_request_context():
+        return
+    g.sql_statements = g.get('sql_statements', 0) + 1
+    budget = g.get('query_budget')
+    if budget is None or g.sql_statements <= budget:
+        return
+    if current_app.config.get('SQL_QUERY_BUDGET_MODE') == 'raise':
+        raise QueryBudgetExceeded(
+            f"{request.endpoint} went over its budget of {budget} statements: {statement}"
+        )
+
+
+def init_query_budget(app):
+    """
+        Hook the statement counter. SQL_QUERY_BUDGET is the default budget of every
+        endpoint (None disables it), @query_budget overrides it per view.
+    """
+    global _listening
+    if not _listening:
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        _listening = True
+
+    @app.before_request
+    def start_query_budget():
+        g.sql_statements = 0
+        g.query_budget = app.config.get('SQL_QUERY_BUDGET')
+
+    @app.after_request
+    def check_query_budget(response):
+        budget = g.get('query_budget')
+        count = g.get('sql_statements', 0)
+        if budget is not None and count > budget:
+            logger.warning("%s ran %s sql statements, its budget is %s", request.endpoint, count, budget)
+        if app.config.get('SQL_COUNT_HEADER'):
+            response.headers['X-SQL-Statements'] = str(count)  # Read by benchmarks.load
+        return response
+
+
+def query_budget(statements: int):
+    """
+        Max number of sql statements of the view, including the ones of the jwt checks.
+    """
+    def decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            g.query_budget = statements
+            return f(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,192 @@
+"""
+    Rate limit storage shared by all the workers of a host through a memory mapped
+    file, so the limits count the requests of every process without a Redis.
+    Use it with RATELIMIT_STORAGE_URI = "mmap:///path/to/file" (fixed window strategy).
+
+    The file is a fixed size hash table of slots (key hash, count, expiry). The
+    slots are split in stripes; a stripe is locked with a byte range lock of the file
+    (between processes) plus a thread lock (inside the process), so unrelated keys
+    don't contend. Expired slots are reused, which evicts the idle keys. When a stripe
+    has no expired slot the one closest to expire is taken, that client starts again
+    from zero: ratelimit_evictions_total counts them, raise `slots` if it moves.
+"""
+import fcntl
+import hashlib
+import mmap
+import os
+import struct
+import threading
+import time
+from urllib.parse import urlparse
+from limits.storage import Storage
+from metrics import RATELIMIT_EVICTIONS
+
+MAGIC = b'ABRL0001'
+HEADER = struct.Struct('<8sQQ')  # magic, stripes, slots per stripe
+HEADER_SIZE = 64
+SLOT = struct.Struct('<Qqd')  # key hash, count, expiry (epoch seconds)
+
+
+def _key_hash(key: str) -> int:
+    # 0 marks an empty slot
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), 'little') or 1
+
+
+class MmapStorage(Storage):
+    """
+        Options (query string of the uri or keyword arguments):
+        stripes (default 64) and slots (per stripe, default 1024). The size of the
+        table is fixed when the file is created.
+    """
+    STORAGE_SCHEME = ['mmap']
+
+    def __init__(self, uri: str = None, wrap_exceptions: bool = False, **options):
+        super().__init__(uri, wrap_exceptions=wrap_exceptions, **options)
+        parsed = urlparse(uri or 'mmap:///tmp/author_books_ratelimit.bin')
+        query = dict(part.split('=', 1) for part in parsed.query.split('&') if '=' in part)
+        self.path = parsed.path
+        stripes = int(options.get('stripes', query.get('stripes', 64)))
+        slots = int(options.get('slots', query.get('slots', 1024)))
+        self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        self.stripes, self.slots = self._open_table(stripes, slots)
+        self._thread_locks = [threading.Lock() for _ in range(self.stripes)]
+
+    def _open_table(self, stripes, slots):
+        size = HEADER_SIZE + stripes * slots * SLOT.size
+        fcntl.lockf(self._fd, fcntl.LOCK_EX, HEADER_SIZE, 0)
+        try:
+            header = os.pread(self._fd, HEADER.size, 0)
+            if len(header) == HEADER.size and header[:8] == MAGIC:
+                # Another worker created it, use its layout
+                _, stripes, slots = HEADER.unpack(header)
+                size = HEADER_SIZE + stripes * slots * SLOT.size
+            else:
+                os.ftruncate(self._fd, size)
+                os.pwrite(self._fd, HEADER.pack(MAGIC, stripes, slots), 0)
+            self._map = mmap.mmap(self._fd, size)
+        finally:
+            fcntl.lockf(self._fd, fcntl.LOCK_UN, HEADER_SIZE, 0)
+        return stripes, slots
+
+    @property
+    def base_exceptions(self):
+        return OSError
+
+    # Table access, the caller holds the lock of the stripe
+
+    def _lock(self, stripe):
+        self._thread_locks[stripe].acquire()
+        fcntl.lockf(self._fd, fcntl.LOCK_EX, self.slots * SLOT.size, self._offset(stripe, 0))
+
+    def _unlock(self, stripe):
+        fcntl.lockf(self._fd, fcntl.LOCK_UN, self.slots * SLOT.size, self._offset(stripe, 0))
+        self._thread_locks[stripe].release()
+
+    def _locate(self, key_hash):
+        stripe = key_hash % self.stripes
+        return stripe, (key_hash // self.stripes) % self.slots
+
+    def _offset(self, stripe, index):
+        return HEADER_SIZE + (stripe * self.slots + index) * SLOT.size
+
+    def _find(self, stripe, start, key_hash, now, create):
+        """
+            Offset of the slot of the key. With `create`, an empty or expired slot is
+            taken, or the one closest to expire when the stripe is full.
+        """
+        free, oldest, oldest_expiry = None, None, None
+        for step in range(self.slots):
+            offset = self._offset(stripe, (start + step) % self.slots)
+            slot_hash, _, expiry = SLOT.unpack_from(self._map, offset)
+            if slot_hash == key_hash:
+                return offset
+            if slot_hash == 0:
+                # Keys are never removed from the middle of a probe chain, so the key is not further
+                return (free if free is not None else offset) if create else None
+            if free is None and expiry <= now:
+                free = offset
+            if oldest_expiry is None or expiry < oldest_expiry:
+                oldest, oldest_expiry = offset, expiry
+        if not create:
+            return None
+        return free if free is not None else oldest
+
+    # Storage api
+
+    def incr(self, key: str, expiry: int, elastic_expiry: bool = False, amount: int = 1) -> int:
+        key_hash = _key_hash(key)
+        stripe, start = self._locate(key_hash)
+        now = time.time()
+        self._lock(stripe)
+        try:
+            offset = self._find(stripe, start, key_hash, now, create=True)
+            slot_hash, count, expires_at = SLOT.unpack_from(self._map, offset)
+            if slot_hash not in (0, key_hash) and expires_at > now:
+                RATELIMIT_EVICTIONS.inc()  # The stripe is full, a live counter goes
+            if slot_hash != key_hash or expires_at <= now:
+                count, expires_at = 0, now + expiry
+            count += amount
+            if elastic_expiry:
+                expires_at = now + expiry
+            SLOT.pack_into(self._map, offset, key_hash, count, expires_at)
+        finally:
+            self._unlock(stripe)
+        return count
+
+    def get(self, key: str) -> int:
+        key_hash = _key_hash(key)
+        stripe, start = self._locate(key_hash)
+        now = time.time()
+        self._lock(stripe)
+        try:
+            offset = self._find(stripe, start, key_hash, now, create=False)
+            if offset is None:
+                return 0
+            _, count, expires_at = SLOT.unpack_from(self._map, offset)
+        finally:
+            self._unlock(stripe)
+        return count if expires_at > now else 0
+
+    def get_expiry(self, key: str) -> float:
+        key_hash = _key_hash(key)
+        stripe, start = self._locate(key_hash)
+        now = time.time()
+        self._lock(stripe)
+        try:
+            offset = self._find(stripe, start, key_hash, now, create=False)
+            if offset is None:
+                return now
+            _, _, expires_at = SLOT.unpack_from(self._map, offset)
+        finally:
+            self._unlock(stripe)
+        return max(expires_at, now)
+
+    def clear(self, key: str) -> None:
+        key_hash = _key_hash(key)
+        stripe, start = self._locate(key_hash)
+        self._lock(stripe)
+        try:
+            offset = self._find(stripe, start, key_hash, time.time(), create=False)
+            if offset is not None:
+                # Keep the hash so the probe chain stays intact, just expire it
+                SLOT.pack_into(self._map, offset, key_hash, 0, 0.0)
+        finally:
+            self._unlock(stripe)
+
+    def check(self) -> bool:
+        return not self._map.closed
+
+    def reset(self) -> int:
+        cleared = 0
+        empty = bytes(self.slots * SLOT.size)
+        for stripe in range(self.stripes):
+            self._lock(stripe)
+            try:
+                start = self._offset(stripe, 0)
+                for index in range(self.slots):
+                    if SLOT.unpack_from(self._map, start + index * SLOT.size)[0]:
+                        cleared += 1
+                self._map[start:start + len(empty)] = empty
+            finally:
+                self._unlock(stripe)
+        return cleared
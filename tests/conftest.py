@@ -0,0 +1,47 @@
+"""
+    App on a throwaway sqlite database. config.py reads the environment when it is
+    imported, so the variables are set before the app is.
+"""
+import os
+import tempfile
+
+TMP = tempfile.mkdtemp(prefix='author_books_tests_')
+os.environ.update({
+    'DATABASE_URL': f'sqlite:///{TMP}/catalog.db',
+    'SECRET_KEY': 'tests-secret',
+    'RATELIMIT_ENABLED': 'False',
+    'CATALOG_CACHE_BACKEND': 'none',
+    'SQL_QUERY_BUDGET_MODE': 'raise',
+    'SQL_COUNT_HEADER': 'True',
+    'OIDC_CACHE_PATH': f'{TMP}/oidc.json',
+    'SIMILAR_BOOKS_PATH': f'{TMP}/similar',
+})
+
+import pytest
+from flask_jwt_extended import create_access_token
+from app import create_app
+from extension import db
+
+
+@pytest.fixture
+def app():
+    app = create_app()
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def auth_headers(app):
+    from admin.models import User
+    user = User(username='reader', email='reader@example.com', first_name='Ada', last_name='Reader')
+    db.session.add(user)
+    db.session.commit()
+    return {'Authorization': f'Bearer {create_access_token(identity=user)}'}
@@ -0,0 +1,75 @@
+"""
+    Native listings of asgi.py, skipped without the packages of requirements-asgi.txt.
+"""
+import asyncio
+import pytest
+
+pytest.importorskip('asgiref')
+pytest.importorskip('aiosqlite')
+pytest.importorskip('greenlet')
+
+from limits import parse_many
+from extension import db
+from authors.models import Author
+
+
+@pytest.fixture
+def catalog(app, monkeypatch):
+    from asgi import AsyncCatalog
+    catalog = AsyncCatalog(app)
+    yield catalog
+    asyncio.run(catalog.close())
+
+
+def call(catalog, path='/author-books/author', headers=(), client=('10.0.0.1', 1234)):
+    sent = []
+
+    async def receive():
+        return {'type': 'http.request'}
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {'type': 'http', 'method': 'GET', 'path': path, 'query_string': b'', 'client': client,
+             'headers': [(name.lower().encode(), value.encode()) for name, value in dict(headers).items()]}
+    asyncio.run(catalog(scope, receive, send))
+    return sent[0]['status'], dict(sent[0]['headers']), sent[1]['body']
+
+
+def test_listing_is_served_with_the_statement_count(app, catalog, auth_headers, monkeypatch):
+    db.session.add(Author(name='Ursula'))
+    db.session.commit()
+    monkeypatch.setitem(app.config, 'SQL_COUNT_HEADER', True)
+    status, headers, body = call(catalog, headers=auth_headers)
+    assert status == 200
+    assert b'Ursula' in body
+    # Page and total for the ETag, the page with the list columns
+    assert headers[b'x-sql-statements'] == b'3'
+
+
+def test_listing_is_rate_limited_like_flask(app, catalog, auth_headers, monkeypatch):
+    from flask import Flask
+    from flask_limiter import Limiter
+    from flask_limiter.util import get_remote_address
+    # The tests run with RATELIMIT_ENABLED=False, that limiter has no storage
+    monkeypatch.setattr(app, 'limiter', Limiter(get_remote_address, app=Flask(__name__), storage_uri='memory://'))
+    monkeypatch.setattr(catalog, 'limits', list(parse_many('2 per minute')))
+    statuses = [call(catalog, headers=auth_headers)[0] for _ in range(3)]
+    assert statuses == [200, 200, 429]
+    status, headers, _ = call(catalog, headers=auth_headers)
+    assert status == 429 and int(headers[b'retry-after']) > 0
+    # Per client address and endpoint
+    assert call(catalog, headers=auth_headers, client=('10.0.0.2', 1234))[0] == 200
+    assert call(catalog, path='/author-books/book', headers=auth_headers)[0] == 200
+
+
+def test_bad_token_is_a_401_other_errors_surface(app, catalog, monkeypatch):
+    assert call(catalog, headers={'Authorization': 'Bearer junk'})[0] == 401
+    assert call(catalog)[0] == 401
+
+    def broken(*args, **kwargs):
+        raise RuntimeError("database down")
+
+    monkeypatch.setattr('asgi.verify_jwt_in_request', broken)
+    with pytest.raises(RuntimeError):
+        call(catalog, headers={'Authorization': 'Bearer junk'})
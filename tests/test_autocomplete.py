@@ -0,0 +1,57 @@
+"""
+    Ranking and cache of the prefix index, and the cold path on the database.
+"""
+from extension import db
+from authors.autocomplete import Autocomplete, PrefixIndex, TOP_SIZE
+from authors.models import Book
+
+
+def test_long_prefix_is_ranked_by_popularity_and_cached():
+    index = PrefixIndex.build([(1, 'The Winter Garden', 1), (2, 'The Other', 5), (3, 'Theory', 3)])
+    assert [row[0] for row in index.search('the', 2)] == [2, 3]
+    assert 'the' in index._top
+    assert [row[0] for row in index.search('the', 10)] == [2, 3, 1]  # Fewer than TOP_SIZE, all there
+
+
+def test_upsert_drops_the_rankings_of_the_row():
+    index = PrefixIndex.build([(1, 'The Winter Garden', 1), (2, 'The Other', 5)])
+    index.search('the')
+    index.search('garden')
+    index.search('other')
+    index.upsert(1, 'The Winter Garden', 10)
+    assert 'the' not in index._top and 'garden' not in index._top
+    assert 'other' in index._top
+    assert index.search('the')[0][0] == 1
+
+
+def test_ranking_across_a_change_is_not_cached():
+    index = PrefixIndex.build([(1, 'Winter', 1)])
+    ranked = []
+
+    class Changing(dict):
+        def get(self, key, default=None):
+            if not ranked:
+                ranked.append(key)
+                index.rows = dict(self)
+                index.upsert(2, 'Winter Two', 3)  # Lands while the ranking runs
+            return super().get(key, default)
+
+    index.rows = Changing(index.rows)
+    index.search('win')
+    assert 'win' not in index._top
+
+
+def test_cached_top_is_not_reused_past_its_size():
+    index = PrefixIndex.build([(n, f'Word {n}', n) for n in range(TOP_SIZE + 10)])
+    assert len(index.search('word', 5)) == 5
+    assert len(index.search('word', TOP_SIZE + 10)) == TOP_SIZE + 10
+
+
+def test_database_path_splits_words_like_the_index(app):
+    db.session.add_all([Book('Mid-Winter Tales'), Book('Winter'), Book('Snowy_winter'), Book('Swinter')])
+    db.session.commit()
+    labels = {label for _, label, _ in Autocomplete._search_database('book', 'WIN', 10, db.session)}
+    assert labels == {'Mid-Winter Tales', 'Winter', 'Snowy_winter'}
+    index = PrefixIndex.build([(n, label, 0) for n, label in enumerate(labels | {'Swinter'})])
+    assert {label for _, label, _ in index.search('win')} == labels
+    assert [row[1] for row in Autocomplete._search_database('book', 'mid winter', 10, db.session)] == ['Mid-Winter Tales']
@@ -0,0 +1,96 @@
+"""
+    Response cache of the catalog reads with the memory and the file backends.
+"""
+import pytest
+from extension import db
+import authors.events as events
+from authors.cache import FileBackend, MemoryBackend, ResponseCache
+from authors.links import link_pairs
+from authors.events import record_changes
+from authors.models import Author, Book
+
+
+@pytest.fixture(params=['memory', 'file'])
+def backend(request, tmp_path):
+    if request.param == 'memory':
+        return MemoryBackend()
+    return FileBackend(str(tmp_path / 'cache.sqlite'))
+
+
+@pytest.fixture
+def cache(app, backend, monkeypatch):
+    cache = ResponseCache(backend, ttl=60)
+    monkeypatch.setattr(app, 'catalog_cache', cache)
+    monkeypatch.setattr(events, '_listeners', events._listeners + [cache.invalidate])
+    return cache
+
+
+def get(client, headers, url):
+    response = client.get(url, headers=headers)
+    assert response.status_code == 200
+    return response.get_json()
+
+
+def test_hit_then_evicted_by_a_change_of_the_row(client, auth_headers, cache):
+    author = Author(name='Ursula')
+    other = Author(name='Terry')
+    db.session.add_all([author, other])
+    db.session.commit()
+    url, other_url = f'/author-books/author/{author.id}', f'/author-books/author/{other.id}'
+    get(client, auth_headers, url)
+    get(client, auth_headers, other_url)
+    get(client, auth_headers, url)
+    assert (cache.hits, cache.misses) == (1, 2)
+    author.name = 'Ursula K. Le Guin'
+    db.session.commit()
+    assert get(client, auth_headers, url)['name'] == 'Ursula K. Le Guin'
+    # Only the entries of the touched row are evicted
+    get(client, auth_headers, other_url)
+    assert (cache.hits, cache.misses) == (2, 3)
+
+
+def test_new_row_evicts_the_listing(client, auth_headers, cache):
+    db.session.add(Author(name='Ursula'))
+    db.session.commit()
+    assert len(get(client, auth_headers, '/author-books/author')['items']) == 1
+    assert len(get(client, auth_headers, '/author-books/author')['items']) == 1
+    assert cache.hits == 1
+    db.session.add(Author(name='Terry'))
+    db.session.commit()
+    assert len(get(client, auth_headers, '/author-books/author')['items']) == 2
+
+
+def test_link_evicts_both_ends(client, auth_headers, cache):
+    author, book = Author(name='Ursula'), Book('The Dispossessed')
+    db.session.add_all([author, book])
+    db.session.commit()
+    author_url, book_url = f'/author-books/author/{author.id}?related=true', f'/author-books/book/{book.id}?related=true'
+    assert get(client, auth_headers, author_url)['books'] == []
+    assert get(client, auth_headers, book_url)['authors'] == []
+    record_changes(db.session, links=link_pairs([(author.id, book.id)]))
+    db.session.commit()
+    assert [item['id'] for item in get(client, auth_headers, author_url)['books']] == [book.id]
+    assert [item['id'] for item in get(client, auth_headers, book_url)['authors']] == [author.id]
+    assert cache.hits == 0
+
+
+def test_body_read_before_an_invalidation_is_not_stored(backend):
+    version = backend.version()
+    backend.delete_tags({'author:1'})  # The commit of another request lands meanwhile
+    assert not backend.set('/author-books/author/1?', {'body': '{}'}, {'author:1'}, 60, version)
+    assert backend.get('/author-books/author/1?') is None
+    assert backend.set('/author-books/author/1?', {'body': '{}'}, {'author:1'}, 60, backend.version())
+    assert backend.get('/author-books/author/1?') == {'body': '{}'}
+
+
+def test_workers_sharing_the_file_see_each_other_invalidations(tmp_path):
+    path = str(tmp_path / 'cache.sqlite')
+    worker_a, worker_b = FileBackend(path), FileBackend(path)
+    version = worker_a.version()  # A misses and reads the database
+    worker_a.set('/other?', {'body': '{}'}, {'author:2'}, 60)
+    worker_b.delete_tags({'author:1'})  # B commits a change of author 1
+    assert not worker_a.set('/author-books/author/1?', {'body': 'stale'}, {'author:1'}, 60, version)
+    assert worker_b.get('/author-books/author/1?') is None
+    assert worker_b.get('/other?') == {'body': '{}'}
+    worker_b.clear()
+    assert worker_a.get('/other?') is None
@@ -0,0 +1,122 @@
+"""
+    The link counters kept by the author_book triggers, whatever writes the links,
+    and the batch links endpoint on top of them.
+"""
+from datetime import datetime
+import pytest
+from flask_jwt_extended import create_access_token
+from sqlalchemy import update
+from extension import db
+from admin.models import User, UserRoleEnum
+from authors.counters import reconcile_counts
+from authors.links import link_pairs, unlink_pairs
+from authors.models import Author, AuthorBook, Book
+
+
+def counts(*rows):
+    for row in rows:
+        db.session.refresh(row)
+    return [row.book_count if isinstance(row, Author) else row.author_count for row in rows]
+
+
+@pytest.fixture
+def catalog(app):
+    authors = [Author(name='Ann'), Author(name='Bob')]
+    books = [Book('First'), Book('Second')]
+    db.session.add_all(authors + books)
+    db.session.commit()
+    return authors, books
+
+
+@pytest.fixture
+def admin_headers(app):
+    user = User(username='admin', email='admin@example.com', first_name='Ad', last_name='Min',
+                role=UserRoleEnum.admin)
+    db.session.add(user)
+    db.session.commit()
+    return {'Authorization': f'Bearer {create_access_token(identity=user)}'}
+
+
+def test_orm_link_and_unlink(catalog):
+    (ann, bob), (first, second) = catalog
+    db.session.add_all([AuthorBook(author=ann, book=first), AuthorBook(author=ann, book=second),
+                        AuthorBook(author=bob, book=first)])
+    db.session.commit()
+    assert counts(ann, bob, first, second) == [2, 1, 2, 1]
+    db.session.delete(db.session.scalars(db.select(AuthorBook).filter_by(author_id=ann.id, book_id=first.id)).one())
+    db.session.commit()
+    assert counts(ann, bob, first, second) == [1, 1, 1, 1]
+
+
+def test_link_moves_updated_at(catalog):
+    (ann, _), (first, _) = catalog
+    db.session.execute(update(Author).where(Author.id == ann.id).values(updated_at=datetime(2000, 1, 1)))
+    db.session.commit()
+    link_pairs([(ann.id, first.id)])
+    db.session.commit()
+    db.session.refresh(ann)
+    assert ann.updated_at.year > 2000
+
+
+def test_link_pairs_and_unlink_pairs(catalog):
+    (ann, bob), (first, second) = catalog
+    pairs = [(ann.id, first.id), (bob.id, first.id), (ann.id, second.id)]
+    assert sorted(link_pairs(pairs + [(ann.id, first.id)])) == sorted(pairs)
+    assert link_pairs(pairs) == []  # Already linked, skipped by the unique index
+    db.session.commit()
+    assert counts(ann, bob, first, second) == [2, 1, 2, 1]
+    assert unlink_pairs([(ann.id, first.id), (bob.id, second.id)]) == [(ann.id, first.id)]
+    db.session.commit()
+    assert counts(ann, bob, first, second) == [1, 1, 1, 1]
+
+
+def test_cascade_delete(catalog):
+    (ann, bob), (first, second) = catalog
+    link_pairs([(ann.id, first.id), (bob.id, first.id), (ann.id, second.id)])
+    db.session.commit()
+    db.session.expire_all()
+    db.session.delete(db.session.get(Author, ann.id))
+    db.session.commit()
+    assert counts(bob, first, second) == [1, 1, 0]
+    db.session.delete(db.session.get(Book, first.id))
+    db.session.commit()
+    assert counts(bob, second) == [0, 0]
+
+
+def test_reconcile_after_drift(catalog):
+    (ann, bob), (first, second) = catalog
+    link_pairs([(ann.id, first.id), (bob.id, first.id)])
+    db.session.commit()
+    # Written around the triggers
+    db.session.execute(update(Author).where(Author.id == ann.id).values(book_count=7))
+    db.session.execute(update(Book).where(Book.id == second.id).values(author_count=3))
+    db.session.commit()
+    assert reconcile_counts(fix=False, chunk_size=1) == {'author': 1, 'book': 1}
+    assert counts(ann, second) == [7, 3]
+    assert reconcile_counts(chunk_size=1) == {'author': 1, 'book': 1}
+    assert counts(ann, bob, first, second) == [1, 1, 2, 0]
+    assert reconcile_counts() == {'author': 0, 'book': 0}
+
+
+def test_links_endpoint(client, catalog, admin_headers):
+    (ann, bob), (first, second) = catalog
+    response = client.post('/author-books/links', headers=admin_headers, json={
+        'link': [[ann.id, first.id], {'author_id': bob.id, 'book_id': first.id}, [ann.id, 999]],
+    })
+    assert response.status_code == 200, response.get_json()
+    assert response.get_json() == {'linked': 2, 'already_linked': 0, 'unlinked': 0, 'not_linked': 0,
+                                   'not_found': [[ann.id, 999]]}
+    response = client.post('/author-books/links', headers=admin_headers, json={
+        'link': [[ann.id, first.id]], 'unlink': [[bob.id, first.id], [bob.id, second.id]],
+    })
+    assert response.get_json() == {'linked': 0, 'already_linked': 1, 'unlinked': 1, 'not_linked': 1,
+                                   'not_found': []}
+    assert counts(ann, bob, first) == [1, 0, 1]
+
+
+def test_links_endpoint_validation(client, catalog, admin_headers, auth_headers):
+    assert client.post('/author-books/links', headers=admin_headers, json={'link': [[1, 'a']]}).status_code == 422
+    assert client.post('/author-books/links', headers=admin_headers, json={'link': [[1, True]]}).status_code == 422
+    client.application.config['LINKS_BATCH_MAX'] = 1
+    assert client.post('/author-books/links', headers=admin_headers, json={'link': [[1, 1], [1, 2]]}).status_code == 422
+    assert client.post('/author-books/links', headers=auth_headers, json={'link': []}).status_code == 403
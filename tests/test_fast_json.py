@@ -0,0 +1,39 @@
+"""
+    orjson only encodes the listings, and with the same output as the default provider.
+"""
+import json
+from datetime import datetime
+import pytest
+from flask.json.provider import DefaultJSONProvider
+from extension import db
+from authors.models import Book
+from fast_json import OrjsonProvider, listing_json
+
+orjson = pytest.importorskip('orjson')
+
+
+def test_listing_keeps_the_http_dates(app):
+    body = {'items': [{'id': 1, 'created_at': datetime(2024, 5, 1, 12, 30)}], 'total': 1}
+    with app.app_context():
+        assert json.loads(listing_json(body)) == json.loads(app.json.dumps(body))
+        assert json.loads(listing_json(body))['items'][0]['created_at'] == 'Wed, 01 May 2024 12:30:00 GMT'
+
+
+def test_app_json_is_not_replaced(app):
+    assert not isinstance(app.json, OrjsonProvider)
+
+
+def test_provider_honors_the_dumps_kwargs(app):
+    provider = OrjsonProvider(app)
+    body = {'b': 1, 'a': 2}
+    assert provider.dumps(body, sort_keys=True, indent=2) == DefaultJSONProvider(app).dumps(body, sort_keys=True, indent=2)
+
+
+def test_listing_and_detail_use_the_same_dates(client, auth_headers):
+    book = Book('Dated')
+    db.session.add(book)
+    db.session.commit()
+    listing = client.get('/author-books/book', headers=auth_headers).get_json()
+    detail = client.get(f'/author-books/book/{book.id}', headers=auth_headers).get_json()
+    assert listing['items'][0]['created_at'] == detail['created_at']
+    assert detail['created_at'].endswith(' GMT')
@@ -0,0 +1,93 @@
+"""
+    Co-author graph: the CSR arrays, the overlay of the links written after the
+    build, and the engine built from the table.
+"""
+import pytest
+
+np = pytest.importorskip('numpy')
+
+from extension import db
+from authors.events import CatalogChanges
+from authors.graph import AUTHOR, BOOK, CoauthorGraph, CsrGraph, GraphUnavailable
+from authors.links import link_pairs
+from authors.models import Author, Book
+
+# Authors 1-2-3 chained by books 10 and 11, 4 alone on book 12, 1 and 2 share book 13 too
+LINKS = [(1, 10), (2, 10), (2, 11), (3, 11), (4, 12), (1, 13), (2, 13)]
+
+
+def make_graph(links=LINKS):
+    return CsrGraph([a for a, _ in links], [b for _, b in links])
+
+
+def test_queries():
+    graph = make_graph()
+    assert graph.coauthors(2) == [(1, 2), (3, 1)]
+    assert graph.coauthors(2, limit=1) == [(1, 2)]
+    assert [level.tolist() for level in graph.k_hop(1, 3)] == [[2], [3]]
+    path = graph.shortest_path(1, 3, 3)
+    assert path[0] == (AUTHOR, 1) and path[2:] == [(AUTHOR, 2), (BOOK, 11), (AUTHOR, 3)]
+    assert path[1] in ((BOOK, 10), (BOOK, 13))  # Either shared book
+    assert graph.shortest_path(1, 3, 1) is None
+    assert graph.shortest_path(1, 4, 5) is None
+
+
+def test_overlay_matches_a_rebuild():
+    graph = make_graph()
+    graph.link(3, 12)  # Joins 4 to the chain
+    graph.unlink(1, 10)
+    graph.link(5, 14)
+    graph.unlink(5, 14)  # Added then removed, nothing left of it
+    expected = [link for link in LINKS if link != (1, 10)] + [(3, 12)]
+    fresh = make_graph(expected)
+    for author_id in range(1, 6):
+        assert graph.neighbors(AUTHOR, author_id) == fresh.neighbors(AUTHOR, author_id)
+        assert graph.coauthors(author_id) == fresh.coauthors(author_id)
+    assert graph.shortest_path(1, 4, 5) is not None
+    compacted = graph.compact()
+    assert compacted.overlay_size == 0 and compacted.edges == len(expected)
+    assert all(compacted.coauthors(a) == fresh.coauthors(a) for a in range(1, 6))
+
+
+def test_replace_and_drop():
+    graph = make_graph()
+    graph.replace(AUTHOR, 3, {10})
+    assert graph.neighbors(AUTHOR, 3) == {10}
+    graph.drop(BOOK, 10)
+    assert graph.neighbors(AUTHOR, 1) == {13}
+    assert 3 not in dict(graph.coauthors(2))
+
+
+def test_components():
+    pytest.importorskip('scipy')
+    labels, sizes, linked = make_graph().components()
+    assert sorted(linked.tolist()) == [1, 3]
+    assert labels[1] == labels[3] != labels[4]
+
+
+@pytest.fixture
+def engine(app, monkeypatch):
+    engine = CoauthorGraph(app)
+    monkeypatch.setattr(engine, 'ensure_started', lambda: None)  # No background thread
+    return engine
+
+
+def test_engine_from_the_table(engine):
+    with pytest.raises(GraphUnavailable):
+        engine.coauthors(1, 10)
+    authors = [Author(name=f'Author {n}') for n in range(3)]
+    books = [Book(f'Book {n}') for n in range(2)]
+    db.session.add_all(authors + books)
+    db.session.flush()
+    a, b = [author.id for author in authors], [book.id for book in books]
+    link_pairs([(a[0], b[0]), (a[1], b[0]), (a[1], b[1])])
+    db.session.commit()
+    engine.rebuild()
+    assert engine.coauthors(a[1], 10) == {'author_id': a[1], 'coauthors': [{'id': a[0], 'shared_books': 1}]}
+    assert engine.path(a[0], a[2], 3) is None
+    # A commit of this worker reaches the overlay through the catalog events
+    changes = CatalogChanges()
+    changes.links.add((a[2], b[1]))
+    engine.apply_changes(changes)
+    assert engine.path(a[0], a[2], 3)['hops'] == 2
+    assert engine.hops(a[0], 2, 10)['count'] == 2
@@ -0,0 +1,72 @@
+"""
+    Bulk import of books on sqlite (ON CONFLICT ... RETURNING like postgres).
+"""
+import pytest
+from sqlalchemy import select
+from extension import db
+import authors.importer as importer
+from authors.importer import CatalogImporter
+from authors.models import Book
+
+
+def run(records, **kwargs):
+    return CatalogImporter('books', **kwargs).run(enumerate(records, start=1))
+
+
+def titles():
+    return dict(db.session.execute(select(Book.slug_book, Book.title)).all())
+
+
+def test_slugs_of_the_file_are_upserted(app):
+    run([{'title': 'Dune', 'slug': 'dune'}, {'title': 'Emma', 'slug': 'emma'}])
+    summary = run([{'title': 'Dune (new edition)', 'slug': 'dune'}, {'title': 'Ulysses', 'slug': 'ulysses'}],
+                  on_conflict='update')
+    assert (summary['inserted'], summary['updated'], summary['skipped']) == (1, 1, 0)
+    assert titles()['dune'] == 'Dune (new edition)'
+    summary = run([{'title': 'Dune again', 'slug': 'dune'}])
+    assert (summary['inserted'], summary['updated'], summary['skipped']) == (0, 0, 1)
+    assert titles()['dune'] == 'Dune (new edition)'
+
+
+def test_books_without_slug_are_new_books(app):
+    run([{'title': 'Dune', 'slug': 'dune'}])
+    summary = run([{'title': 'Dune'}, {'title': 'Dune', 'slug': 'dune-1'}], on_conflict='update')
+    # The allocation sees the slug of the file written just before
+    assert (summary['inserted'], summary['updated'], summary['failed']) == (2, 0, 0)
+    assert sorted(titles()) == ['dune', 'dune-1', 'dune-2']
+
+
+@pytest.mark.parametrize('on_conflict', ['skip', 'update'])
+def test_allocated_slug_taken_by_a_concurrent_insert(app, monkeypatch, on_conflict):
+    db.session.add(Book('Somebody else', slug='dune'))
+    db.session.commit()
+    real = importer.allocate_slugs
+    calls = []
+
+    def stale_allocation(texts, session=None):
+        # The first allocation ran before the other insert committed
+        calls.append(texts)
+        return ['dune'] * len(texts) if len(calls) == 1 else real(texts, session)
+
+    monkeypatch.setattr(importer, 'allocate_slugs', stale_allocation)
+    summary = run([{'title': 'Dune', 'description': 'Spice'}], on_conflict=on_conflict)
+    assert (summary['inserted'], summary['updated'], summary['skipped'], summary['failed']) == (1, 0, 0, 0)
+    assert len(calls) == 2
+    assert titles() == {'dune': 'Somebody else', 'dune-1': 'Dune'}
+
+
+def test_no_free_slug_after_the_retries_fails_the_row(app, monkeypatch):
+    db.session.add(Book('Somebody else', slug='dune'))
+    db.session.commit()
+    monkeypatch.setattr(importer, 'allocate_slugs', lambda texts, session=None: ['dune'] * len(texts))
+    summary = run([{'title': 'Dune'}, {'title': 'Emma', 'slug': 'emma'}])
+    assert (summary['inserted'], summary['failed']) == (1, 1)
+    assert titles() == {'dune': 'Somebody else', 'emma': 'Emma'}
+
+
+def test_errors_are_capped(app, monkeypatch):
+    monkeypatch.setattr(importer, 'MAX_ERRORS', 3)
+    summary = run([{'title': ''} for _ in range(7)], chunk_size=2)
+    assert summary['failed'] == 7
+    assert sum(len(group['errors']) for group in summary['errors']) == 3
+    assert summary['errors_dropped'] == 4
@@ -0,0 +1,83 @@
+"""
+    The related=true listings load the links of the whole page in a fixed number of
+    statements. The app runs with SQL_QUERY_BUDGET_MODE=raise, a lazy load per row
+    goes over the budget of the view and fails the request.
+"""
+import pytest
+from extension import db
+from authors.models import Author, Book
+from authors.links import link_pairs
+
+
+def seed(authors: int):
+    rows = [Author(name=f'Author {n}') for n in range(authors)]
+    books = [Book(f'Book {n}') for n in range(authors * 2)]
+    db.session.add_all(rows + books)
+    db.session.flush()
+    link_pairs([(author.id, books[n * 2 + offset].id) for n, author in enumerate(rows) for offset in (0, 1)])
+    db.session.commit()
+
+
+def statements(client, headers, url):
+    response = client.get(url, headers=headers)
+    assert response.status_code == 200, response.get_json()
+    return int(response.headers['X-SQL-Statements']), response.get_json()
+
+
+@pytest.mark.parametrize('url, related_key', [
+    ('/author-books/author?related=true&limit=50', 'books'),
+    ('/author-books/book?related=true&limit=50', 'authors'),
+])
+def test_related_listing_statements_dont_grow_with_the_page(client, auth_headers, url, related_key):
+    statements(client, auth_headers, url)  # The first request seeds the revocation index
+    seed(3)
+    few, body = statements(client, auth_headers, url)
+    assert all(item[related_key] for item in body['items'])
+    seed(20)
+    many, body = statements(client, auth_headers, url)
+    assert len(body['items']) == (46 if related_key == 'authors' else 23)
+    assert all(item[related_key] for item in body['items'])
+    assert many == few
+    assert many <= 10
+
+
+def test_listing_counts_the_total_once(app, client, auth_headers):
+    from sqlalchemy import event
+    seed(3)
+    statements(client, auth_headers, '/author-books/author')
+    counts = []
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        if 'count(*)' in statement.lower():
+            counts.append(statement)
+
+    engine = db.engine
+    event.listen(engine, 'before_cursor_execute', count)
+    try:
+        for url in ('/author-books/author?count=exact', '/author-books/book?related=true'):
+            counts.clear()
+            _, body = statements(client, auth_headers, url)
+            assert len(counts) == 1
+            assert body['total'] == len(body['items'])
+    finally:
+        event.remove(engine, 'before_cursor_execute', count)
+
+
+def test_reconciled_counter_moves_last_modified(app, client, auth_headers):
+    from sqlalchemy import text
+    from authors.counters import reconcile_counts
+    seed(1)
+    author = db.session.scalars(db.select(Author)).first()
+    # A drift written around the triggers, with an old updated_at
+    db.session.execute(text("UPDATE author SET book_count = 7, updated_at = '2020-01-01 00:00:00' WHERE id = :id"),
+                       {'id': author.id})
+    db.session.commit()
+    url = f'/author-books/author/{author.id}'
+    response = client.get(url, headers=auth_headers)
+    assert response.get_json()['book_count'] == 7
+    since = response.headers['Last-Modified']
+    assert client.get(url, headers={**auth_headers, 'If-Modified-Since': since}).status_code == 304
+    assert reconcile_counts() == {'author': 1, 'book': 0}
+    response = client.get(url, headers={**auth_headers, 'If-Modified-Since': since})
+    assert response.status_code == 200
+    assert response.get_json()['book_count'] == 2
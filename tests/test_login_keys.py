@@ -0,0 +1,53 @@
+"""
+    Migration of the normalized login keys, run on sqlite with the admin schema
+    attached, against the model.
+"""
+import importlib.util
+import pathlib
+import pytest
+import sqlalchemy as sa
+
+alembic = pytest.importorskip('alembic')
+from alembic.migration import MigrationContext
+from alembic.operations import Operations
+from admin.models import User, normalize_login
+
+MIGRATION = pathlib.Path(__file__).parents[1] / 'migrations' / 'versions' / 'f6b8d0e2a461_add_user_login_keys.py'
+LOGINS = [(' Ada ', 'Ada@Example.com'), (' Émile\t', 'ÉMILE@EXAMPLE.COM'), ('İpek', 'ipek@example.com')]
+
+
+@pytest.fixture
+def migrated(monkeypatch):
+    spec = importlib.util.spec_from_file_location('login_keys_migration', MIGRATION)
+    migration = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(migration)
+    monkeypatch.setattr(migration, 'BATCH_SIZE', 2)  # More than one batch
+    engine = sa.create_engine('sqlite://')
+
+    @sa.event.listens_for(engine, 'connect')
+    def attach(dbapi_connection, _):
+        dbapi_connection.execute("ATTACH DATABASE ':memory:' AS admin")
+
+    metadata = sa.MetaData()
+    user = sa.Table('user', metadata, sa.Column('id', sa.Integer, primary_key=True),
+                    sa.Column('username', sa.String(80)), sa.Column('email', sa.String(150)), schema='admin')
+    with engine.connect() as conn:
+        metadata.create_all(conn)
+        conn.execute(user.insert(), [{'username': username, 'email': email} for username, email in LOGINS])
+        conn.commit()
+        with Operations.context(MigrationContext.configure(conn)):
+            migration.upgrade()
+        yield conn
+
+
+def test_backfill_matches_the_model(migrated):
+    rows = migrated.execute(sa.text('SELECT username, email, username_key, email_key FROM admin.user ORDER BY id')).all()
+    assert [(username_key, email_key) for _, _, username_key, email_key in rows] == \
+        [(normalize_login(username), normalize_login(email)) for username, email in LOGINS]
+
+
+def test_index_names_match_the_model(migrated):
+    created = {name for name, in migrated.execute(sa.text("SELECT name FROM admin.sqlite_master WHERE type = 'index'"))}
+    expected = {index.name for index in User.__table__.indexes if index.name.endswith('_key')}
+    assert expected == created
+    assert all(index.unique for index in User.__table__.indexes if index.name in created)
@@ -0,0 +1,124 @@
+"""
+    OidcCache against a local stand-in of the provider serving the discovery
+    document and the key set.
+"""
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+from admin.oidc_cache import OidcCache
+
+
+class Provider:
+    def __init__(self):
+        self.keys = [{'kid': 'key-1', 'kty': 'RSA'}]
+        self.max_age = None  # Cache-Control of the responses
+        self.hits = {'/.well-known/openid-configuration': 0, '/jwks': 0}
+        provider = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                path = self.path.split('?')[0]
+                if path not in provider.hits:
+                    self.send_error(404)
+                    return
+                provider.hits[path] += 1
+                if path == '/jwks':
+                    body = {'keys': list(provider.keys)}
+                else:
+                    body = {'issuer': provider.url, 'jwks_uri': f'{provider.url}/jwks'}
+                payload = json.dumps(body).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                if provider.max_age is not None:
+                    self.send_header('Cache-Control', f'public, max-age={provider.max_age}')
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f'http://127.0.0.1:{self.server.server_port}'
+        self.metadata_url = f'{self.url}/.well-known/openid-configuration'
+        threading.Thread(target=self.server.serve_forever, kwargs={'poll_interval': 0.05}, daemon=True).start()
+
+    @property
+    def jwks_hits(self):
+        return self.hits['/jwks']
+
+    @property
+    def metadata_hits(self):
+        return self.hits['/.well-known/openid-configuration']
+
+
+@pytest.fixture
+def provider():
+    provider = Provider()
+    yield provider
+    provider.server.shutdown()
+    provider.server.server_close()
+
+
+@pytest.fixture
+def cache_path(tmp_path):
+    return str(tmp_path / 'oidc.json')
+
+
+def test_other_workers_read_the_disk_cache(provider, cache_path):
+    first = OidcCache(provider.metadata_url, cache_path)
+    assert first.load()['jwks']['keys'][0]['kid'] == 'key-1'
+    assert (provider.metadata_hits, provider.jwks_hits) == (1, 1)
+    first.load()
+    # A new process reads the file, not the provider
+    second = OidcCache(provider.metadata_url, cache_path)
+    assert second.load()['metadata']['jwks_uri'] == f'{provider.url}/jwks'
+    assert (provider.metadata_hits, provider.jwks_hits) == (1, 1)
+
+
+def test_disk_cache_of_another_provider_is_ignored(provider, cache_path):
+    OidcCache(provider.metadata_url, cache_path).load()
+    OidcCache(f'{provider.metadata_url}?tenant=2', cache_path).load()
+    assert provider.metadata_hits == 2
+
+
+def test_max_age_of_the_provider_sets_the_expiry(provider, cache_path):
+    provider.max_age = 120
+    entry = OidcCache(provider.metadata_url, cache_path, ttl=3600).load()
+    assert entry['expires_at'] - entry['fetched_at'] == pytest.approx(120)
+
+
+def test_expired_entry_is_fetched_again(provider, cache_path):
+    cache = OidcCache(provider.metadata_url, cache_path, ttl=0.2)
+    cache.load()
+    cache.load()
+    assert provider.metadata_hits == 1
+    time.sleep(0.3)
+    provider.keys = [{'kid': 'key-2', 'kty': 'RSA'}]
+    assert cache.load()['jwks']['keys'][0]['kid'] == 'key-2'
+    assert (provider.metadata_hits, provider.jwks_hits) == (2, 2)
+    # And the file has the new copy for the other workers
+    assert OidcCache(provider.metadata_url, cache_path).load()['jwks']['keys'][0]['kid'] == 'key-2'
+
+
+def test_unknown_kid_forces_one_jwks_refetch(provider, cache_path):
+    cache = OidcCache(provider.metadata_url, cache_path, min_refetch_interval=60)
+
+    class Client:
+        server_metadata = {}
+
+    client = cache.attach(Client())
+    cache.load()
+    provider.keys = [{'kid': 'key-1', 'kty': 'RSA'}, {'kid': 'key-2', 'kty': 'RSA'}]
+    # What authlib does when the kid of the id token is not in the key set
+    jwks = client.fetch_jwk_set(force=True)
+    assert [key['kid'] for key in jwks['keys']] == ['key-1', 'key-2']
+    assert client.server_metadata['jwks'] == jwks
+    assert (provider.metadata_hits, provider.jwks_hits) == (1, 2)
+    # Made up kids don't make us hammer the provider
+    client.fetch_jwk_set(force=True)
+    assert provider.jwks_hits == 2
+    # The rotated key set is shared through the file
+    assert OidcCache(provider.metadata_url, cache_path).load()['jwks'] == jwks
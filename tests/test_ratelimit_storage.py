@@ -0,0 +1,40 @@
+"""
+    mmap:// rate limit storage: counters shared through the file, and the evictions
+    of a full stripe counted.
+"""
+from metrics import RATELIMIT_EVICTIONS
+from ratelimit_storage import MmapStorage
+
+
+def evictions():
+    return sum(RATELIMIT_EVICTIONS._values.values())
+
+
+def test_counters_are_shared_through_the_file(tmp_path):
+    uri = f'mmap://{tmp_path}/limits.bin?stripes=2&slots=8'
+    first, second = MmapStorage(uri), MmapStorage(uri)
+    assert first.incr('client', 60) == 1
+    assert second.incr('client', 60) == 2
+    assert first.get('client') == 2
+    first.clear('client')
+    assert second.get('client') == 0
+
+
+def test_full_stripe_evicts_and_counts(tmp_path):
+    storage = MmapStorage(f'mmap://{tmp_path}/limits.bin', stripes=1, slots=2)
+    before = evictions()
+    storage.incr('a', 60)
+    storage.incr('b', 60)
+    assert evictions() == before
+    storage.incr('c', 60)  # No expired slot left, a live counter goes
+    assert evictions() == before + 1
+    assert storage.get('c') == 1
+
+
+def test_expired_slots_are_reused_without_eviction(tmp_path):
+    storage = MmapStorage(f'mmap://{tmp_path}/limits.bin', stripes=1, slots=2)
+    before = evictions()
+    storage.incr('a', 0)
+    storage.incr('b', 0)
+    storage.incr('c', 60)
+    assert evictions() == before
@@ -0,0 +1,69 @@
+"""
+    Revocation index of two workers sharing the blocklist table.
+"""
+import threading
+import time
+from datetime import timedelta
+from extension import db
+from admin.models import TokenBlocklist, get_current_time
+from admin.revocation import RevocationIndex
+
+
+def revoke_on_other_worker(jti, expires_in=3600):
+    db.session.add(TokenBlocklist(jti=jti, created_at=get_current_time(),
+                                  expires_at=get_current_time() + timedelta(seconds=expires_in)))
+    db.session.commit()
+
+
+def test_revoked_on_this_worker_is_rejected_right_away(app):
+    index = RevocationIndex(sync_interval=60)
+    assert not index.is_revoked('a')
+    index.add('a', time.time() + 3600)
+    assert index.is_revoked('a')
+
+
+def test_revoked_on_another_worker_is_accepted_until_the_next_sync(app):
+    index = RevocationIndex(sync_interval=0.2)
+    assert not index.is_revoked('a')  # Seeded
+    revoke_on_other_worker('a')
+    # The documented window: not in this bloom filter, no database read
+    assert not index.is_revoked('a')
+    time.sleep(0.25)
+    assert index.is_revoked('a')
+
+
+def test_seed_reads_the_live_rows_only(app):
+    revoke_on_other_worker('live')
+    revoke_on_other_worker('expired', expires_in=-60)
+    index = RevocationIndex(sync_interval=60)
+    assert index.is_revoked('live')
+    assert index.stats()['exact'] == 1
+
+
+def test_one_seed_for_concurrent_requests(app, monkeypatch):
+    revoke_on_other_worker('a')
+    index = RevocationIndex(sync_interval=60)
+    syncs = []
+    sync = index._sync
+
+    def slow_sync():
+        syncs.append(1)
+        time.sleep(0.1)
+        sync()
+
+    monkeypatch.setattr(index, '_sync', slow_sync)
+    answers = []
+
+    def request():
+        with app.app_context():
+            answers.append(index.is_revoked('a'))
+            db.session.remove()
+
+    threads = [threading.Thread(target=request) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # Nobody answered before the seed was loaded
+    assert answers == [True] * 8
+    assert len(syncs) == 1
@@ -0,0 +1,104 @@
+"""
+    Search on sqlite, served by the in memory inverted index.
+"""
+from extension import db
+from authors.models import Book
+
+
+def add_book(title, description=None):
+    book = Book(title)
+    book.description = description
+    db.session.add(book)
+    db.session.commit()
+    return book.id
+
+
+def search(client, headers, **args):
+    return client.get('/author-books/search', query_string=args, headers=headers)
+
+
+def test_ranking_title_before_description(client, auth_headers):
+    in_description = add_book('Harbor', 'A dragon sleeps under the harbor')
+    in_title = add_book('The Dragon Queen', 'A story of a queen')
+    in_both = add_book('Dragon Tales', 'Every dragon of the north')
+    add_book('Small Gods', 'Nothing about dragons here')
+    response = search(client, auth_headers, q='dragon')
+    assert response.status_code == 200
+    items = response.get_json()['items']
+    assert [item['id'] for item in items] == [in_both, in_title, in_description]
+    assert items[0]['rank'] > items[1]['rank'] > items[2]['rank']
+
+
+def test_every_token_must_match(client, auth_headers):
+    add_book('Dragon Tales')
+    queen = add_book('The Dragon Queen')
+    items = search(client, auth_headers, q='queen dragon').get_json()['items']
+    assert [item['id'] for item in items] == [queen]
+
+
+def test_pages_follow_the_rank(client, auth_headers):
+    ids = {add_book(f'Dragon {n}') for n in range(5)}
+    seen, cursor = [], None
+    while True:
+        args = {'q': 'dragon', 'limit': 2, **({'cursor': cursor} if cursor else {})}
+        body = search(client, auth_headers, **args).get_json()
+        seen += [item['id'] for item in body['items']]
+        cursor = body['next_cursor']
+        if cursor is None:
+            break
+    assert seen == sorted(ids)
+
+
+def test_empty_query_is_rejected(client, auth_headers):
+    for args in ({}, {'q': ''}, {'q': '   '}):
+        assert search(client, auth_headers, **args).status_code == 422
+
+
+def test_bad_parameters_are_rejected(client, auth_headers):
+    assert search(client, auth_headers, q='dragon', type='shelf').status_code == 422
+    assert search(client, auth_headers, q='dragon', limit='ten').status_code == 422
+    assert search(client, auth_headers, q='dragon', limit=0).status_code == 422
+
+
+def test_index_is_rebuilt_after_a_commit(client, auth_headers):
+    add_book('Dragon Tales')
+    assert len(search(client, auth_headers, q='dragon').get_json()['items']) == 1
+    new = add_book('Dragon Queen')
+    items = search(client, auth_headers, q='dragon').get_json()['items']
+    assert new in [item['id'] for item in items]
+    db.session.delete(db.session.get(Book, new))
+    db.session.commit()
+    items = search(client, auth_headers, q='dragon').get_json()['items']
+    assert new not in [item['id'] for item in items]
+
+
+def test_pages_keep_the_rows_tied_at_the_cursor(client, auth_headers):
+    # 1.4, then five tied at 1.0 across the page boundary, then 0.4
+    top = add_book('Dragon Tales', 'Every dragon of the north')
+    tied = [add_book(f'Dragon {n}') for n in range(5)]
+    low = add_book('Harbor', 'A dragon sleeps under the harbor')
+    seen, cursor = [], None
+    while True:
+        args = {'q': 'dragon', 'limit': 3, **({'cursor': cursor} if cursor else {})}
+        body = search(client, auth_headers, **args).get_json()
+        seen += [item['id'] for item in body['items']]
+        cursor = body['next_cursor']
+        if cursor is None:
+            break
+    assert seen == [top, *tied, low]
+
+
+def test_postgres_rank_is_compared_as_double_precision():
+    from sqlalchemy import Double
+    from sqlalchemy.dialects import postgresql
+    from authors.pagination import encode_cursor
+    from authors.search import PostgresSearch
+    cursor = encode_cursor('book:dragon', 'desc', 0.1, 3)
+    compiled = PostgresSearch.statement('book', 'dragon', 2, cursor).compile(dialect=postgresql.dialect())
+    rank = 'CAST(ts_rank_cd(search_vector'
+    sql = str(compiled)
+    # Selected (goes into the next cursor), compared and ordered as float8, never as real
+    assert sql.count(rank) == 4
+    assert sql.count('AS DOUBLE PRECISION)') == 4
+    cursor_binds = [bind for name, bind in compiled.binds.items() if bind.value == 0.1]
+    assert cursor_binds and all(isinstance(bind.type, Double) for bind in cursor_binds)
@@ -0,0 +1,59 @@
+"""
+    Similar books: full build, incremental update and the memory mapped reader.
+"""
+import pytest
+
+pytest.importorskip('numpy')
+pytest.importorskip('scipy')
+
+from extension import db
+from authors.links import link_pairs
+from authors.models import Author, Book
+from authors.similar import SimilarBooks, SimilarityBuilder, SimilarUnavailable
+
+
+@pytest.fixture
+def books(app):
+    author = Author(name='Ann')
+    rows = [
+        Book('Dragons of the northern mountains'),
+        Book('Mountains and dragons, a northern saga'),
+        Book('Cooking with rice'),
+        Book('Rice and beans cooking'),
+        Book('Gardening for beginners'),
+    ]
+    db.session.add_all([author] + rows)
+    db.session.flush()
+    link_pairs([(author.id, rows[4].id), (author.id, rows[0].id)])
+    db.session.commit()
+    return {book.title: book.id for book in rows}
+
+
+def test_build_and_read(books, tmp_path):
+    report = SimilarityBuilder(str(tmp_path), k=3, sync_overlap=0).build()
+    assert report['full'] and report['books'] == 5
+    reader = SimilarBooks(str(tmp_path), check_interval=0)
+    dragons = reader.similar(books['Dragons of the northern mountains'])
+    assert dragons[0][0] == books['Mountains and dragons, a northern saga']
+    # Only the shared author links it to the gardening book
+    assert books['Gardening for beginners'] in [other for other, _ in dragons]
+    assert reader.similar(books['Cooking with rice'])[0][0] == books['Rice and beans cooking']
+    assert all(score > 0 for _, score in dragons)
+    assert reader.similar(10 ** 6) == []
+
+
+def test_update_only_the_changed_books(books, tmp_path):
+    builder = SimilarityBuilder(str(tmp_path), k=3, sync_overlap=0)
+    builder.build()
+    book = db.session.get(Book, books['Gardening for beginners'])
+    book.title = 'Rice gardening'
+    db.session.commit()
+    report = builder.update(max_fraction=0.5)
+    assert not report['full'] and report['changed'] == 1
+    reader = SimilarBooks(str(tmp_path), check_interval=0)
+    assert book.id in [other for other, _ in reader.similar(books['Cooking with rice'])]
+
+
+def test_reader_without_a_build(tmp_path):
+    with pytest.raises(SimilarUnavailable):
+        SimilarBooks(str(tmp_path / 'missing'), check_interval=0).similar(1)
@@ -0,0 +1,68 @@
+"""
+    Slug allocation of the books.
+"""
+from sqlalchemy import event, select
+from sqlalchemy.dialects import postgresql
+from extension import db
+from authors.models import Book
+from authors.slugs import _taken, allocate_slugs
+
+
+def add(*slugs):
+    for slug in slugs:
+        book = Book(slug)
+        book.slug_book = slug
+        db.session.add(book)
+    db.session.commit()
+
+
+def test_book_gets_its_slug_at_the_flush(app):
+    statements = []
+
+    def record(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', record)
+    try:
+        books = [Book('Dune') for _ in range(3)] + [Book('Emma'), Book('Anything', slug='Dune Messiah')]
+        assert all(book.slug_book is None for book in books)  # No query in __init__
+        assert statements == []
+        db.session.add_all(books)
+        db.session.commit()
+        selects = [statement for statement in statements if statement.lstrip().startswith('SELECT')]
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', record)
+    assert len(selects) == 1
+    assert [book.slug_book for book in books] == ['dune', 'dune-1', 'dune-2', 'emma', 'dune-messiah']
+
+
+def test_next_suffix_after_the_existing_ones(app):
+    add('dune', 'dune-1', 'dune-2', 'dune-4')
+    assert allocate_slugs(['Dune', 'Dune']) == ['dune-5', 'dune-6']
+    assert allocate_slugs(['Emma']) == ['emma']
+
+
+def test_slugs_that_only_start_with_the_base_are_not_read(app):
+    add('the', 'the-1', 'the-book-club', 'the-road', 'the-2-towers', 'theory')
+    assert _taken({'the'}, db.session) == {'the': [True, {1}]}
+    assert allocate_slugs(['The']) == ['the-2']
+
+
+def test_unrelated_numbered_slug_does_not_move_the_suffix(app):
+    add('harry', 'harry-1', 'harry-2023')
+    assert allocate_slugs(['Harry', 'Harry 2023']) == ['harry-2', 'harry-2023-1']
+
+
+def test_suffix_skips_the_taken_numbers(app):
+    add('dune', 'dune-3', 'dune-4')
+    # Only 3 and 4 are within the dense range of 2 suffixes + 1
+    assert allocate_slugs(['Dune', 'Dune']) == ['dune-5', 'dune-6']
+    assert set(db.session.scalars(select(Book.slug_book))) == {'dune', 'dune-3', 'dune-4'}
+
+
+def test_postgres_filters_the_suffixes_on_the_server(app, monkeypatch):
+    compiled = []
+    monkeypatch.setattr(db.session, 'scalars', lambda stmt: compiled.append(
+        str(stmt.compile(dialect=postgresql.dialect(), compile_kwargs={'literal_binds': True}))) or [])
+    _taken({'the'}, db.session)
+    assert "slug_book LIKE 'the-%%'" in compiled[0] and "slug_book ~ '^the-[0-9]+$'" in compiled[0]